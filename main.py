@@ -2,53 +2,138 @@ import os
 import sys
 import time
 import shutil
+import signal
 import logging
-import json
+import zipfile
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from watchdog.observers.polling import PollingObserver
-from watchdog.events import FileSystemEventHandler
-import zipfile
 
 # ───────────────────── Paths and Constants ─────────────────────
 base_dir = os.path.dirname(os.path.abspath(__file__))
 WATCH_DIR     = Path(base_dir, "drop_zip_here")
 OUTPUT_PARENT = Path(base_dir, "output")
 DATA_DIR      = Path(base_dir, "data")
-for p in (WATCH_DIR, OUTPUT_PARENT, DATA_DIR):
-    p.mkdir(exist_ok=True)
+CACHE_DIR     = Path(base_dir, "cache")       # survives the DATA_DIR wipe between runs
+
+TOKEN_CACHE_PATH   = CACHE_DIR / "token_cache.sqlite"
+TOKEN_CACHE_MAX_MB = int(os.getenv("TOKEN_CACHE_MAX_MB", "256"))
+
+# "exact" tokenizes everything; "estimate" samples per model/language and extrapolates
+# (much faster, writes monthly_cost_estimate.csv with confidence bounds)
+TOKEN_COUNT_MODE = os.getenv("TOKEN_COUNT_MODE", "exact")
+
+# Worker processes for the per-conversation API emulation (1 = in-process)
+EMULATION_WORKERS = int(os.getenv("EMULATION_WORKERS", "1"))
+
+# Plot rendering: process pool size (0 = one per CPU, 1 = in-process) and cache of earlier renders
+PLOT_WORKERS      = int(os.getenv("PLOT_WORKERS", "0"))
+PLOT_CACHE_DIR    = CACHE_DIR / "plots"
+PLOT_CACHE_MAX_MB = int(os.getenv("PLOT_CACHE_MAX_MB", "64"))
+
+# Pipeline stages running at the same time (independent stages overlap; see pipeline_dag.py)
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "4"))
+
+# Outputs of finished stages by content hash of their inputs, so a retried or resumed run
+# skips to the first stage whose inputs changed (see stage_cache.py)
+STAGE_CACHE_DIR    = CACHE_DIR / "stages"
+STAGE_CACHE_MAX_MB = int(os.getenv("STAGE_CACHE_MAX_MB", "1024"))
+
+# Background writer threads for outputs no later stage reads back (0 = write in the stage)
+# and how many queued writes a stage may run ahead of them (see artifact_sink.py)
+ARTIFACT_WRITERS     = int(os.getenv("ARTIFACT_WRITERS", "1"))
+ARTIFACT_MAX_PENDING = int(os.getenv("ARTIFACT_MAX_PENDING", "8"))
+
+# Resource budget for shared hosts (see resource_budget.py): cap on every pool (0 = none),
+# memory to stay under (0 = none; picks pools, overlap and streaming to fit) and the
+# I/O priority of the daemon, e.g. IO_NICE=idle or IO_NICE=best-effort:7
+MAX_WORKERS   = int(os.getenv("MAX_WORKERS", "0"))
+MAX_MEMORY_MB = int(os.getenv("MAX_MEMORY_MB", "0"))
+IO_NICE       = os.getenv("IO_NICE", "")
+
+# Optional what-if scenarios, comma-separated "NAME=MODEL[@PRICES_CSV]" or model names,
+# e.g. "gpt-4o-mini,gpt-4-1,o3" (what_if_monthly_costs.csv + one plot per scenario)
+WHAT_IF_SCENARIOS = [s for s in os.getenv("WHAT_IF_SCENARIOS", "").split(",") if s.strip()]
 
 STABILITY_SECONDS = 15
 POLL_INTERVAL     = 5
 
+# "memory" (default) or "streaming": bounded-memory, conversation-chunked processing
+PIPELINE_MODE     = os.getenv("PIPELINE_MODE", "memory").strip().lower()
+STREAM_MEMORY_MB  = int(os.getenv("STREAM_MEMORY_MB", "1024"))
+
+# Incremental runs: a per-user index (cache/incremental/<user>/) of the conversations already
+# processed, so repeat exports only re-process new or changed conversations (implies streaming)
+INCREMENTAL              = os.getenv("INCREMENTAL", "0").strip().lower() in ("1", "true", "yes")
+INCREMENTAL_DIR          = CACHE_DIR / "incremental"
+INCREMENTAL_SEGMENT_SIZE = int(os.getenv("INCREMENTAL_SEGMENT_SIZE", "100"))   # new conversations per segment
+
+# Two-phase reports: a fast, approximate preview (counts, model usage, rough cost) archived
+# and emailed seconds after ingest, superseded by the full report when the run finishes
+PREVIEW_REPORT = os.getenv("PREVIEW_REPORT", "0").strip().lower() in ("1", "true", "yes")
+PREVIEW_DIR    = DATA_DIR / "_preview"
+PREVIEW_ZIP    = "preview_results.zip"
+
+# Local HTTP/JSON query service over the archived runs (0 = off), e.g. QUERY_PORT=8765
+QUERY_PORT = int(os.getenv("QUERY_PORT", "0"))
+QUERY_HOST = os.getenv("QUERY_HOST", "127.0.0.1")
+
 # put this near the top of main.py
 INBOX_DIR   = WATCH_DIR / "_inbox"
+FAILED_DIR  = WATCH_DIR / "_failed"       # zips of failed runs; drop one again to retry it
 PROCESSED   = set()                       # {(name, size)}
 
-INBOX_DIR.mkdir(exist_ok=True)            # ensure it exists
-
-# ───────────────────── Logging Setup ─────────────────────
 log_path = DATA_DIR / "logs.txt"
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(log_path, mode="w", encoding="utf-8"),
-        logging.StreamHandler(sys.stdout)
-    ],
-)
+
+# Pipeline modules live in src/ and are imported lazily inside run_pipeline()
+sys.path.append(os.path.join(base_dir, "src"))
+
 def log(msg, level=logging.INFO):
     logging.log(level, msg)
 
+# ───────────────────── Runtime Setup ─────────────────────
+def configure_logging(mode="w"):
+    """Log to data/logs.txt (truncated with mode "w") and stdout."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[
+            logging.FileHandler(log_path, mode=mode, encoding="utf-8"),
+            logging.StreamHandler(sys.stdout)
+        ],
+    )
+
+def setup_runtime():
+    """
+    Create the working folders, configure logging (data/logs.txt + stdout) and
+    drop empty analysis folders left by earlier runs. Called once by the daemon;
+    importing main.py has no side effects.
+    """
+    for p in (WATCH_DIR, OUTPUT_PARENT, DATA_DIR, CACHE_DIR, INBOX_DIR):
+        p.mkdir(exist_ok=True)
+
+    configure_logging()
+
+    # ─── Remove any EMPTY analysis folders that might be left behind ───
+    for d in OUTPUT_PARENT.glob("analysis-*"):
+        if not any(d.iterdir()):                      # directory is empty
+            shutil.rmtree(d, ignore_errors=True)
+
 # ───────────────────── Watchdog Handler ─────────────────────
-class ZipReadyHandler(FileSystemEventHandler):
-    def __init__(self):
-        super().__init__()
-        self._found = None
-    def on_created(self, event):
-        if not event.is_directory and event.src_path.lower().endswith(".zip"):
-            self._found = Path(event.src_path)
-            log(f"🛈 Detected new zip: {self._found.name}")
+def make_zip_handler():
+    """Build the watchdog handler (imported here so watchdog loads only when watching)."""
+    from watchdog.events import FileSystemEventHandler
+
+    class ZipReadyHandler(FileSystemEventHandler):
+        def __init__(self):
+            super().__init__()
+            self._found = None
+        def on_created(self, event):
+            if not event.is_directory and event.src_path.lower().endswith(".zip"):
+                self._found = Path(event.src_path)
+                log(f"🛈 Detected new zip: {self._found.name}")
+
+    return ZipReadyHandler()
 
 
 def await_first_zip() -> Path:
@@ -57,7 +142,9 @@ def await_first_zip() -> Path:
     then MOVE it to WATCH_DIR/_inbox and return that new path.
     Duplicate-trigger safe.
     """
-    handler  = ZipReadyHandler()
+    from watchdog.observers.polling import PollingObserver
+
+    handler  = make_zip_handler()
     observer = PollingObserver(timeout=POLL_INTERVAL)
     observer.schedule(handler, str(WATCH_DIR), recursive=False)
     observer.start()
@@ -77,11 +164,15 @@ def await_first_zip() -> Path:
                 time.sleep(STABILITY_SECONDS)
                 if candidate.exists() and candidate.stat().st_size == size_a:
                     sig = (candidate.name, size_a)
-                    if sig in PROCESSED:                # already handled once
+                    failed = FAILED_DIR / candidate.name
+                    if sig in PROCESSED and not failed.exists():   # already handled once
                         log(f"↪︎ Duplicate event for {candidate.name} – ignored")
                         candidate = None                 # reset and keep watching
                         handler._found = None
                         continue
+                    if failed.exists():                  # a retry supersedes the failed copy
+                        failed.unlink()
+                        log(f"🔁 Retrying {candidate.name} (finished stages are reused)")
 
                     # move out of watched dir BEFORE returning
                     target = INBOX_DIR / candidate.name
@@ -101,69 +192,286 @@ def await_first_zip() -> Path:
         observer.stop()
         observer.join()
 
-# ───────────────────── Import pipeline modules ─────────────────────
-sys.path.append("src")
-from import_export_zip import prepare_export_and_load_conversations
-from survey_schema       import survey_conversation_keys
-from flatten_messages    import run_flatten_and_sample
-from flatten_websearch   import extract_flattened_data
-from flatten_images      import extract_image_records
-from merge_flattened     import merge_all
-from fill_model_names    import fill_model_names
-from analyze_model_usage import analyze_model_usage
-from token_counter       import count_tokens
-from emulate_api_chat_costs          import main as emulate_api_chat_costs
-from plot_monthly_summary            import plot_monthly_summary
-from plot_token_costs_comparison     import main as plot_token_costs_comparison
-from send_email_report               import send_email_report
+# ───────────────────── Reports ─────────────────────
+def pack_results(source_dir: Path, results_zip: Path):
+    """Zip every file under source_dir (except .zip files), with paths relative to it."""
+    with zipfile.ZipFile(results_zip, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for root, _, files in os.walk(source_dir):
+            for f in files:
+                if f.lower().endswith(".zip"):
+                    continue
+                p = Path(root) / f
+                zf.write(p, arcname=p.relative_to(source_dir))
+    log(f"📦 Packed results → {results_zip.name}")
 
-# ───────────────────── Core Pipeline ─────────────────────
-def run_pipeline():
-    log("\n=== ChatGPT History Analysis Pipeline ===\n")
+def snapshot_log(target: Path):
+    """Flush logging and copy the current log to target."""
+    for h in logging.getLogger().handlers:
+        h.flush()
+    shutil.copy2(log_path, target)
+
+def publish_preview(json_path: Path, run_outdir: Path, plot_workers=PLOT_WORKERS):
+    """Phase one: build the preview report, archive it as PREVIEW_ZIP and email it."""
+    from preview_report    import preview_report, PREVIEW_CSV
+    from send_email_report import send_email_report
 
-    zip_path = await_first_zip()
+    t0 = time.perf_counter()
+    try:
+        preview_report(json_path, PREVIEW_DIR, workers=plot_workers, cache_dir=PLOT_CACHE_DIR)
+    except Exception as e:
+        log(f"⚠️ Preview report failed, continuing with the full report: {e}", level=logging.WARNING)
+        shutil.rmtree(PREVIEW_DIR, ignore_errors=True)
+        return
+    log(f"⚡ Preview report ready in {time.perf_counter() - t0:.1f}s")
 
-    conversations, folder = prepare_export_and_load_conversations(
-        base_dir=base_dir,
-        zip_path=str(zip_path)
+    run_outdir.mkdir(parents=True, exist_ok=True)
+    snapshot_log(PREVIEW_DIR / "logs.txt")
+    pack_results(PREVIEW_DIR, run_outdir / PREVIEW_ZIP)
+    send_email_report(
+        output_dir=str(PREVIEW_DIR),
+        log_filename="logs.txt",
+        usage_csv="model_usage_frequency.csv",
+        preview=True,
+        attachments=(PREVIEW_CSV,)
     )
 
-    # 1. Survey
-    survey_conversation_keys(conversations)
-
-    # 2. Flatten
-    run_flatten_and_sample( conversations, DATA_DIR / "conversations_flat.csv", show_sample=False)
-    extract_flattened_data(conversations).to_csv(DATA_DIR / "flattened_websearch_thoughts.csv", index=False, encoding="utf-8-sig")
-    extract_image_records(conversations).to_csv(DATA_DIR / "image_generations.csv", index=False, encoding="utf-8-sig")
-
-    # 3. Merge + fill
-    merge_all(
-        DATA_DIR / "conversations_flat.csv",
-        DATA_DIR / "flattened_websearch_thoughts.csv",
-        DATA_DIR / "image_generations.csv",
-        DATA_DIR / "merged_conversations.csv",
-        show_df=False
+# ───────────────────── Core Pipeline ─────────────────────
+def run_pipeline(zip_path: Path, out_of_memory: bool = False):
+    """
+    Run the whole pipeline on one export zip. out_of_memory: a previous attempt ran out
+    of memory (the worker was OOM-killed), so start in streaming mode right away.
+    """
+    from import_export_zip import load_conversations, extract_export
+    from survey_schema       import survey_conversation_keys
+    from flatten_messages    import run_flatten_and_sample
+    from flatten_websearch   import extract_flattened_data
+    from flatten_images      import extract_image_records
+    from merge_flattened     import merge_all
+    from fill_model_names    import fill_model_names
+    from analyze_model_usage import analyze_model_usage
+    from token_counter       import count_tokens
+    from emulate_api_chat_costs          import main as emulate_api_chat_costs
+    from plot_monthly_summary            import monthly_count_figures, token_usage_figure
+    from plot_token_costs_comparison     import main as plot_token_costs_comparison
+    from what_if_scenarios               import main as what_if_scenarios, parse_scenario
+    from send_email_report               import send_email_report
+    from streaming_pipeline              import run_streaming_pipeline
+    from aggregate_cube                  import csv_token_cube, combine_cubes, write_cube, CUBE_CSV
+    from plot_render                     import render_figures
+    from incremental_index               import IncrementalIndex, export_user_id, run_parameters
+    from pricing                         import load_price_table
+    from emulate_api_chat_costs          import BUFFER_TOKENS
+    from pipeline_dag                    import PipelineDAG, TIMINGS_CSV
+    from stage_cache                     import StageCache, CachedStage
+    from streaming_pipeline              import STAGE_FILES
+    from token_counter                   import COST_ESTIMATE_CSV
+    from token_arrays                    import token_array_paths
+    from artifact_sink                   import ArtifactSink
+    from resource_budget                 import plan_run, streaming_fallback, is_out_of_memory
+
+    log("\n=== ChatGPT History Analysis Pipeline ===\n")
+
+    run_outdir = OUTPUT_PARENT / f"analysis-{datetime.now():%Y%m%d-%H%M%S}"
+    folder = extract_export(base_dir=base_dir, zip_path=str(zip_path))
+    json_path = DATA_DIR / folder / "conversations.json"
+
+    # Pools, stage overlap and memory vs streaming mode within MAX_WORKERS / MAX_MEMORY_MB
+    plan = plan_run(
+        json_path.stat().st_size,
+        mode="streaming" if PIPELINE_MODE == "streaming" or INCREMENTAL else "memory",
+        stream_memory_mb=STREAM_MEMORY_MB,
+        pipeline_workers=PIPELINE_WORKERS,
+        emulation_workers=EMULATION_WORKERS,
+        plot_workers=PLOT_WORKERS,
+        artifact_writers=ARTIFACT_WRITERS,
+        max_workers=MAX_WORKERS,
+        max_memory_mb=MAX_MEMORY_MB
     )
-    with open(DATA_DIR / folder / "conversations.json", encoding="utf-8") as jf:
-        fill_model_names(
-            DATA_DIR / "merged_conversations.csv",
-            json.load(jf),
-            DATA_DIR / "merged_conversations_filled.csv",
-            debug=False
-        )
-
-    # 4. Stats, tokens, costs
+    if out_of_memory:
+        plan = streaming_fallback(plan, MAX_MEMORY_MB)
+    if MAX_MEMORY_MB or MAX_WORKERS or out_of_memory:
+        log(f"🪫 Resource budget: {plan.mode} mode, estimated peak ~{plan.estimate_mb} MB"
+            + (f" ({'; '.join(plan.notes)})" if plan.notes else ""))
+
+    if PREVIEW_REPORT:
+        publish_preview(json_path, run_outdir, plan.plot_workers)
+
     filled_csv = DATA_DIR / "merged_conversations_filled.csv"
-    analyze_model_usage(filled_csv, show_table=True)
-    count_tokens(filled_csv, DATA_DIR / "token_counts.csv")
-    emulate_api_chat_costs(DATA_DIR / "token_counts.csv", DATA_DIR / "token_costs_true_api_emulated.csv")
+    if TOKEN_COUNT_MODE == "estimate":
+        log("📐 Token estimate mode: sampled counts, see monthly_cost_estimate.csv for bounds")
+
+    def run_stages(plan):
+        # The run as a dependency graph: every stage starts once the stages it needs are done
+        # (see pipeline_dag.py); stages whose inputs are unchanged since an earlier attempt are
+        # restored from the stage cache. Outputs only read again by the report (figures,
+        # summary CSVs) and the stage cache entries are written in the background.
+        sink = ArtifactSink(plan.artifact_writers, ARTIFACT_MAX_PENDING) if plan.artifact_writers > 0 else None
+        dag = PipelineDAG(StageCache(STAGE_CACHE_DIR, STAGE_CACHE_MAX_MB), sink)
+        params = run_parameters(TOKEN_COUNT_MODE, load_price_table(), BUFFER_TOKENS)
+        token_outputs = [DATA_DIR / "token_counts.csv", *token_array_paths(str(DATA_DIR / "token_counts.csv")),
+                         DATA_DIR / COST_ESTIMATE_CSV]
+
+        def render(jobs):
+            return render_figures(jobs, plan.plot_workers, PLOT_CACHE_DIR, PLOT_CACHE_MAX_MB, sink), len(jobs)
+
+        if plan.mode == "streaming":
+            # 1–5. Survey, flatten, merge + fill, tokens, costs and cube in conversation-aligned chunks
+            log(f"🧩 Streaming mode (memory ceiling {plan.stream_memory_mb} MB)")
+            index = None
+            if INCREMENTAL:
+                index_dir = INCREMENTAL_DIR / export_user_id(DATA_DIR / folder)
+                log(f"♻️ Incremental mode: index {index_dir}")
+                index = IncrementalIndex(index_dir, params)
+            dag.add("stream", lambda r: run_streaming_pipeline(
+                json_path,
+                DATA_DIR,
+                memory_limit_mb=plan.stream_memory_mb,
+                token_cache_path=TOKEN_CACHE_PATH,
+                token_cache_max_mb=TOKEN_CACHE_MAX_MB,
+                token_count_mode=TOKEN_COUNT_MODE,
+                token_threads=plan.token_threads,
+                index=index,
+                max_conversations=INCREMENTAL_SEGMENT_SIZE if INCREMENTAL else None
+            ), cache=None if INCREMENTAL else CachedStage(        # incremental runs have their own index
+                outputs=[*(DATA_DIR / f for f in STAGE_FILES), DATA_DIR / CUBE_CSV, DATA_DIR / "model_usage_frequency.csv",
+                         DATA_DIR / "flat_error.txt", *token_outputs],
+                inputs=[json_path],
+                params=params
+            ))
+            messages_stage = tokens_stage = cube_stage = "stream"
+        else:
+            # 1. Load + survey
+            dag.add("load", lambda r: load_conversations(json_path))
+            dag.add("survey", lambda r: survey_conversation_keys(r["load"]), deps=["load"])
+
+            # 2. Flatten: three independent extractors
+            dag.add("flatten_messages", lambda r: run_flatten_and_sample(
+                r["load"], DATA_DIR / "conversations_flat.csv", show_sample=False
+            ), deps=["load"], keep_result=False,
+                cache=CachedStage([DATA_DIR / "conversations_flat.csv"], inputs=[json_path]))
+            dag.add("flatten_websearch", lambda r: extract_flattened_data(r["load"]).to_csv(
+                DATA_DIR / "flattened_websearch_thoughts.csv", index=False, encoding="utf-8-sig"
+            ), deps=["load"], cache=CachedStage([DATA_DIR / "flattened_websearch_thoughts.csv"], inputs=[json_path]))
+            dag.add("flatten_images", lambda r: extract_image_records(r["load"]).to_csv(
+                DATA_DIR / "image_generations.csv", index=False, encoding="utf-8-sig"
+            ), deps=["load"], cache=CachedStage([DATA_DIR / "image_generations.csv"], inputs=[json_path]))
+
+            # 3. Merge + fill
+            dag.add("merge", lambda r: merge_all(
+                DATA_DIR / "conversations_flat.csv",
+                DATA_DIR / "flattened_websearch_thoughts.csv",
+                DATA_DIR / "image_generations.csv",
+                DATA_DIR / "merged_conversations.csv",
+                show_df=False
+            ), deps=["flatten_messages", "flatten_websearch", "flatten_images"], keep_result=False,
+                cache=CachedStage([DATA_DIR / "merged_conversations.csv"]))
+
+            def fill(r):
+                filled, cube = fill_model_names(
+                    DATA_DIR / "merged_conversations.csv",
+                    r["load"],
+                    DATA_DIR / "merged_conversations_filled.csv",
+                    DATA_DIR / "model_usage_frequency.csv",
+                    debug=False,
+                    sink=sink
+                )
+                return cube, filled[["message_id", "role"]]
+            dag.add("fill", fill, deps=["load", "merge"], cache=CachedStage(
+                [filled_csv, DATA_DIR / "model_usage_frequency.csv"], inputs=[json_path]
+            ))
+
+            # 4. Tokens, costs
+            dag.add("tokens", lambda r: count_tokens(
+                filled_csv,
+                DATA_DIR / "token_counts.csv",
+                cache_path=TOKEN_CACHE_PATH,
+                cache_max_mb=TOKEN_CACHE_MAX_MB,
+                mode=TOKEN_COUNT_MODE,
+                num_threads=plan.token_threads
+            ), deps=["fill"], keep_result=False, cache=CachedStage(token_outputs, params=params))
+            dag.add("emulate", lambda r: emulate_api_chat_costs(
+                DATA_DIR / "token_counts.csv",
+                DATA_DIR / "token_costs_true_api_emulated.csv",
+                branches_csv=DATA_DIR / "token_costs_branches.csv",
+                workers=plan.emulation_workers,
+                sink=sink
+            ), deps=["tokens"], keep_result=False, cache=CachedStage(
+                [DATA_DIR / "token_costs_true_api_emulated.csv", DATA_DIR / "token_costs_branches.csv"], params=params
+            ))
+
+            # 5. Aggregate cube: month × model × role counts, tokens and costs for the plots
+            def build_cube(r):
+                message_cube, roles = r["fill"]
+                cube = combine_cubes([message_cube, csv_token_cube(
+                    DATA_DIR / "token_counts.csv", DATA_DIR / "token_costs_true_api_emulated.csv", roles
+                )])
+                write_cube(cube, DATA_DIR / CUBE_CSV, sink)
+                return cube
+            dag.add("cube", build_cube, deps=["fill", "emulate"])
+            messages_stage, tokens_stage, cube_stage = "fill", "tokens", "cube"
+
+        def message_cube_of(r):
+            return r[messages_stage][0] if messages_stage == "fill" else r[messages_stage]
+
+        # 6. Stats and plots: each figure group starts as soon as its part of the cube exists
+        dag.add("model_usage", lambda r: analyze_model_usage(filled_csv, show_table=True, cube=message_cube_of(r)),
+                deps=[messages_stage], keep_result=False)
+        dag.add("count_plots", lambda r: render(monthly_count_figures(message_cube_of(r), DATA_DIR)),
+                deps=[messages_stage])
+        dag.add("token_usage_plot", lambda r: render([token_usage_figure(r[cube_stage], DATA_DIR)]),
+                deps=[cube_stage])
+        dag.add("cost_plots", lambda r: render(plot_token_costs_comparison(
+            emulated_csv=DATA_DIR / "token_costs_true_api_emulated.csv",
+            token_counts_csv=DATA_DIR / "token_counts.csv",
+            output_csv=DATA_DIR / "monthly_token_cost_comparison.csv",
+            naive_png=DATA_DIR / "plot_naive_costs.png",
+            emulated_png=DATA_DIR / "plot_api_emulation_costs.png",
+            cube=r[cube_stage],
+            render=False,
+            sink=sink
+        )), deps=[cube_stage])
+        # A scenario with an unpriced model (e.g. a typo) is left out rather than shown as $0
+        scenarios = []
+        for spec in WHAT_IF_SCENARIOS:
+            try:
+                scenarios.append(parse_scenario(spec))
+            except ValueError as e:
+                log(f"{e}; scenario skipped", level=logging.ERROR)
+        if scenarios:
+            log(f"🔮 What-if scenarios: {', '.join(s['name'] for s in scenarios)}")
+            dag.add("what_if", partial(
+                what_if_scenarios,
+                scenarios,
+                token_counts_csv=DATA_DIR / "token_counts.csv",
+                output_csv=DATA_DIR / "what_if_monthly_costs.csv"
+            ), deps=[tokens_stage], process=True, keep_result=False)
 
-    # 5. Plots
-    plot_monthly_summary(merged_csv_path=filled_csv, output_dir=DATA_DIR)
-    plot_token_costs_comparison()
+        try:
+            results = dag.run(plan.pipeline_workers)
+        finally:
+            dag.report(DATA_DIR / TIMINGS_CSV)
+            seconds, path = dag.critical_path()
+            log(f"⏱️ Critical path {seconds:.1f}s: {' → '.join(path)} (stage timings in {TIMINGS_CSV})")
+            if sink is not None:
+                # Barrier: every background write is on disk (or its error raised) before packing
+                sink.close()
+        if dag.reused:
+            log(f"♻️ Reused cached outputs of {len(dag.reused)} stage(s): {', '.join(sorted(dag.reused))}")
+        n_rendered, n_figures = map(sum, zip(*(results[s] for s in ("count_plots", "token_usage_plot", "cost_plots"))))
+        log(f"🖼️ Rendered {n_rendered} of {n_figures} figures ({n_figures - n_rendered} from the plot cache)")
+
+    try:
+        run_stages(plan)
+    except Exception as e:
+        # Degrade instead of failing: the estimate was off, so retry in bounded-memory chunks
+        if plan.mode != "memory" or not is_out_of_memory(e):
+            raise
+        plan = streaming_fallback(plan, MAX_MEMORY_MB)
+        log(f"🪫 Out of memory in memory mode ({e}); retrying in streaming mode "
+            f"(ceiling {plan.stream_memory_mb} MB)", level=logging.WARNING)
+        run_stages(plan)
 
     # ────────────── FINISHING TOUCHES ──────────────
-    run_outdir = OUTPUT_PARENT / f"analysis-{datetime.now():%Y%m%d-%H%M%S}"
     run_outdir.mkdir(parents=True, exist_ok=True)
 
     # Move original zip file to output folder
@@ -175,22 +483,15 @@ def run_pipeline():
             shutil.rmtree(item, ignore_errors=True)
             log(f"🗑️  Removed folder: {item.name}")
 
-    # Build results.zip (excluding any .zip files)
-    results_zip = run_outdir / "results.zip"
-    import zipfile
-    with zipfile.ZipFile(results_zip, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(DATA_DIR):
-            for f in files:
-                if f.lower().endswith(".zip"):
-                    continue
-                p = Path(root) / f
-                zf.write(p, arcname=p.relative_to(DATA_DIR))
-    log(f"📦 Packed results → {results_zip.name}")
+    # Build results.zip (excluding any .zip files); the full report supersedes the preview
+    shutil.rmtree(PREVIEW_DIR, ignore_errors=True)
+    pack_results(DATA_DIR, run_outdir / "results.zip")
+    if (run_outdir / PREVIEW_ZIP).exists():
+        (run_outdir / PREVIEW_ZIP).unlink()
+        log(f"🗑️  Removed {PREVIEW_ZIP} (superseded by results.zip)")
 
     # Flush logging and snapshot log
-    for h in logging.getLogger().handlers:
-        h.flush()
-    shutil.copy2(log_path, run_outdir / "logs.txt")
+    snapshot_log(run_outdir / "logs.txt")
 
     # Copy key deliverables into output folder
     for png in DATA_DIR.glob("*.png"):
@@ -226,20 +527,76 @@ def run_pipeline():
 
     print(f"🎉 Pipeline complete! Output archived to: {run_outdir.resolve()}\n")
 
-# ─── Remove any EMPTY analysis folders that might be left behind ───
-for d in OUTPUT_PARENT.glob("analysis-*"):
-    if not any(d.iterdir()):                      # directory is empty
-        shutil.rmtree(d, ignore_errors=True)
-       # log(f"🗑️  Removed empty output folder: {d.name}")
+def init_worker():
+    """
+    Warm worker initializer: the worker is a fresh interpreter, so it appends to the
+    daemon's log; then IO_NICE, before any thread or pool starts so all of them inherit it.
+    """
+    configure_logging(mode="a")
+    apply_io_nice()
+
+def apply_io_nice():
+    """Set IO_NICE for this process (see resource_budget.set_io_priority)."""
+    if IO_NICE:
+        from resource_budget import set_io_priority
+        if set_io_priority(IO_NICE):
+            log(f"🪫 I/O priority: {IO_NICE}")
+
+def run_job(zip_path: Path, out_of_memory: bool = False):
+    """
+    Worker job: run the pipeline; if it fails, move the zip to FAILED_DIR so that
+    dropping it again retries it (from the stage cache where inputs are unchanged).
+    """
+    try:
+        run_pipeline(zip_path, out_of_memory)
+    except Exception:
+        move_to_failed(zip_path)
+        raise
+
+def retry_crashed_job(zip_path: Path, options: dict, exitcode):
+    """
+    WarmWorker on_crash: a run killed the worker. SIGKILL is the kernel's OOM killer,
+    so that run is retried once in streaming mode; anything else goes to FAILED_DIR.
+    """
+    if exitcode == -signal.SIGKILL and not options.get("out_of_memory"):
+        log(f"🪫 The worker was killed while running {zip_path.name} (out of memory?); "
+            "retrying it in streaming mode", level=logging.WARNING)
+        return dict(options, out_of_memory=True)
+    move_to_failed(zip_path)
+    return None
+
+def move_to_failed(zip_path: Path):
+    """Park the zip of a failed run in FAILED_DIR; it is retried when dropped again."""
+    if zip_path.exists():
+        FAILED_DIR.mkdir(exist_ok=True)
+        shutil.move(str(zip_path), FAILED_DIR / zip_path.name)
+        log(f"🗂️ Moved {zip_path.name} to {FAILED_DIR.name}/; drop it again to retry", level=logging.ERROR)
 
 # ───────────────────── Entry Point with Loop ─────────────────────
 
 if __name__ == "__main__":
+    from warm_worker import WarmWorker
+
+    setup_runtime()
+    # The watcher stays in this process; runs happen in a long-lived warm worker
+    # A job whose run killed the worker is not retried blindly: once in streaming mode, then _failed/
+    worker = WarmWorker(run_job, initializer=init_worker, on_crash=retry_crashed_job)
+    worker.start()
+    # Zips still in the inbox were queued or mid-run when the daemon stopped: resume them
+    for pending in sorted(INBOX_DIR.glob("*.zip"), key=lambda p: p.stat().st_mtime):
+        PROCESSED.add((pending.name, pending.stat().st_size))
+        log(f"🔁 Resuming {pending.name} left in {INBOX_DIR.name}/")
+        worker.submit(pending)
+    if QUERY_PORT:
+        from query_service import serve_in_background
+        serve_in_background(OUTPUT_PARENT, QUERY_HOST, QUERY_PORT)
+        log(f"🔎 Query service on http://{QUERY_HOST}:{QUERY_PORT}/")
     log("🚀 Watching for ChatGPT export ZIPs...\n")
     while True:
         try:
-            run_pipeline()
+            zip_path = await_first_zip()
+            worker.submit(zip_path)
             print("🕐 Waiting for next zip...\n")
         except Exception as e:
-            log(f"❌ Error during pipeline: {e}", level=logging.ERROR)
+            log(f"❌ Error while watching for zips: {e}", level=logging.ERROR)
         time.sleep(3)
@@ -0,0 +1,264 @@
+"""
+Month × model × role × metric aggregate cube shared by the plots and summary CSVs.
+
+The cube is a small long-format table (CUBE_COLUMNS) built with one groupby pass over
+the messages (merged_conversations_filled) and one over the per-message token counts
+and costs. Cubes of conversation-disjoint parts (streaming chunks) combine by summing,
+except first_use which takes the minimum.
+
+Costs are summed in whole cost units (nano-dollars, COST_SCALE per dollar) rather than as floats, so a sum
+doesn't depend on how the rows were split or ordered: a streaming or incremental run
+writes the same cube (and monthly tables) as an in-memory run. Every other summed
+metric is a count, which float64 adds exactly.
+
+Metrics and their dimensions ('' = not applicable):
+    messages             create_time month × model × role
+    distinct_messages    create_time month (first row of each message_id)
+    conversations        conversation_create_time month (distinct conversation/time pairs)
+    first_use            model; earliest create_time in epoch seconds
+    input_tokens, output_tokens, naive_input_cost, naive_output_cost,
+    api_input_tokens, api_input_token_cost, api_output_token_cost
+                         conversation month × model × role (naive costs priced with
+                         the pricing engine, api_* from the emulator output)
+Unparseable months are 'NaT'.
+"""
+import os
+import numpy as np
+import pandas as pd
+from pricing import load_price_table, create_time_dates
+from table_schema import read_table, report_memory
+from artifact_sink import write_csv
+
+CUBE_CSV = "aggregate_cube.csv"
+CUBE_COLUMNS = ["month", "model", "role", "metric", "value"]
+MIN_METRICS = ("first_use",)
+COST_METRICS = ('naive_input_cost', 'naive_output_cost', 'api_input_token_cost', 'api_output_token_cost')
+COST_SCALE = 1_000_000_000  # cost units per dollar; exact up to ~$2M per cube row
+TIME_FORMAT = '%Y%m%d_%H%M%S.%f'
+
+MESSAGE_COLUMNS = ['conversation_id', 'message_id', 'conversation_create_time', 'create_time', 'model', 'role']
+TOKEN_COLUMNS = ['conversation_id', 'message_id', 'conversation_create_time', 'input_tokens', 'output_tokens', 'model']
+EMULATED_METRICS = ['api_input_tokens', 'api_input_token_cost', 'api_output_token_cost']
+
+def _month_labels(dates):
+    """'YYYY-MM' per datetime (NaT → 'NaT'), formatted once per distinct month."""
+    codes = (dates.dt.year * 100 + dates.dt.month).fillna(0).astype(np.int64).to_numpy()
+    uniques, inverse = np.unique(codes, return_inverse=True)
+    labels = np.array([f"{m // 100:04d}-{m % 100:02d}" if m else "NaT" for m in uniques.tolist()], dtype=object)
+    return labels[inverse]
+
+def _to_units(costs):
+    """Costs in dollars → whole cost units (float64 holding integers; NaN counts as 0, as in a sum)."""
+    return np.rint(np.nan_to_num(np.asarray(costs, dtype=np.float64)) * COST_SCALE)
+
+def _from_units(units):
+    return units / COST_SCALE
+
+def _melt(grouped, metrics, month=None, model=None, role=None):
+    """Long rows of a grouped frame; month/model/role given as a constant override the index."""
+    frame = grouped.reset_index()
+    parts = []
+    for metric in metrics:
+        parts.append(pd.DataFrame({
+            'month': frame['month'] if month is None else month,
+            'model': frame['model'] if model is None else model,
+            'role': frame['role'] if role is None else role,
+            'metric': metric,
+            'value': frame[metric].astype(np.float64),
+        }))
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=CUBE_COLUMNS)
+
+def message_cube(messages):
+    """Cube rows of the message metrics (messages, distinct_messages, conversations, first_use)."""
+    create_time = pd.to_datetime(messages['create_time'], format=TIME_FORMAT, errors='coerce')
+    conversation_time = pd.to_datetime(messages['conversation_create_time'], format=TIME_FORMAT, errors='coerce')
+    rows = pd.DataFrame({
+        'month': _month_labels(create_time),
+        'conversation_month': _month_labels(conversation_time),
+        'model': messages['model'].astype(object).fillna('unknown').to_numpy(),
+        'role': messages['role'].astype(object).fillna('').to_numpy() if 'role' in messages else '',
+        'distinct_messages': (messages['message_id'].notna() & ~messages['message_id'].duplicated()).to_numpy(),
+        'conversations': ~pd.DataFrame({
+            'c': messages['conversation_id'].astype(object), 't': conversation_time
+        }).duplicated().to_numpy(),
+        'first_use': (create_time - pd.Timestamp(0)).dt.total_seconds().to_numpy(),
+    })
+
+    # --- One pass; each metric then sums the small result over the dimensions it doesn't use ---
+    grouped = rows.groupby(['month', 'conversation_month', 'model', 'role'], sort=True).agg(
+        messages=('model', 'size'),
+        distinct_messages=('distinct_messages', 'sum'),
+        conversations=('conversations', 'sum'),
+        first_use=('first_use', 'min'),
+    )
+    by_month = grouped.groupby(level=['month', 'model', 'role']).sum()
+    return pd.concat([
+        _melt(by_month, ['messages']),
+        _melt(grouped.groupby(level='month').sum(), ['distinct_messages'], model='', role=''),
+        _melt(grouped.groupby(level='conversation_month').sum().rename_axis('month'), ['conversations'], model='', role=''),
+        _melt(grouped.groupby(level='model').min(), ['first_use'], month='', role=''),
+    ], ignore_index=True)
+
+def token_cube(tokens, roles=None, price_table=None):
+    """
+    Cube rows of the token and cost metrics of a token counts frame (TOKEN_COLUMNS,
+    plus the api_* columns when it is the emulator output). roles: per-row role, if known.
+    """
+    dates = create_time_dates(tokens['conversation_create_time'])
+    input_cost, output_cost = (price_table or load_price_table()).costs(
+        tokens['model'], tokens['input_tokens'], tokens['output_tokens'], dates
+    )
+    rows = pd.DataFrame({
+        'month': _month_labels(dates),
+        'model': tokens['model'].astype(object).fillna('').to_numpy(),
+        'role': '' if roles is None else np.asarray(roles, dtype=object),
+        'input_tokens': tokens['input_tokens'].to_numpy(),
+        'output_tokens': tokens['output_tokens'].to_numpy(),
+        'naive_input_cost': _to_units(input_cost),
+        'naive_output_cost': _to_units(output_cost),
+    })
+    metrics = ['input_tokens', 'output_tokens', 'naive_input_cost', 'naive_output_cost']
+    for column in EMULATED_METRICS:
+        if column in tokens.columns:
+            rows[column] = tokens[column].to_numpy()
+            if column in COST_METRICS:
+                rows[column] = _to_units(rows[column])
+            metrics.append(column)
+    grouped = rows.groupby(['month', 'model', 'role'], sort=True)[metrics].sum()
+    costs = [m for m in metrics if m in COST_METRICS]
+    grouped[costs] = _from_units(grouped[costs])
+    return _melt(grouped, metrics)
+
+def _cost_units(rows):
+    """Cube rows with the cost values in cost units, ready to be summed in any order."""
+    is_cost = rows['metric'].isin(COST_METRICS)
+    if not is_cost.any():
+        return rows
+    return rows.assign(value=np.where(is_cost, _to_units(rows['value']), rows['value']))
+
+def combine_cubes(parts):
+    """Combine cubes of conversation-disjoint parts (sum; min for MIN_METRICS)."""
+    cube = _cost_units(pd.concat(parts, ignore_index=True))
+    keys = ['month', 'model', 'role', 'metric']
+    is_min = cube['metric'].isin(MIN_METRICS)
+    summed = cube[~is_min].groupby(keys, sort=True, as_index=False)['value'].sum()
+    is_cost = summed['metric'].isin(COST_METRICS)
+    summed.loc[is_cost, 'value'] = _from_units(summed.loc[is_cost, 'value'])
+    return pd.concat([
+        summed,
+        cube[is_min].groupby(keys, sort=True, as_index=False, dropna=False)['value'].min(),
+    ], ignore_index=True)[CUBE_COLUMNS]
+
+def _attach_emulated(tokens, emulated_csv):
+    """
+    Add the emulator's api_* columns to a token counts frame. The emulator output is the
+    same rows stably sorted by (conversation_id, message_id), so the rows are matched by
+    position after the same sort.
+    """
+    emulated = pd.read_csv(emulated_csv, usecols=['conversation_id', 'message_id'] + EMULATED_METRICS,
+                           dtype={'conversation_id': str, 'message_id': str})
+    order = tokens.sort_values(['conversation_id', 'message_id']).index
+    if len(order) != len(emulated) or not (
+        tokens.loc[order, 'message_id'].fillna('').to_numpy() == emulated['message_id'].fillna('').to_numpy()
+    ).all():
+        print(f"⚠️ {emulated_csv} doesn't match the token counts, skipping API costs in the cube")
+        return tokens
+    for column in EMULATED_METRICS:
+        values = np.empty(len(tokens))
+        values[tokens.index.get_indexer(order)] = emulated[column].to_numpy()
+        tokens[column] = values
+    return tokens
+
+def csv_token_cube(token_counts_csv, emulated_csv=None, messages=None, price_table=None):
+    """
+    Token and cost cube rows of a token counts CSV, plus the api_* metrics of emulated_csv.
+    messages: the table token_counts_csv was counted from (message_id, role), whose rows
+    it follows one to one; gives the token metrics their role ('' without it).
+    """
+    tokens = pd.read_csv(token_counts_csv, usecols=TOKEN_COLUMNS, dtype={
+        'conversation_id': str, 'message_id': str, 'conversation_create_time': str,
+        'input_tokens': int, 'output_tokens': int, 'model': str
+    })
+    if emulated_csv is not None and os.path.isfile(emulated_csv):
+        tokens = _attach_emulated(tokens, emulated_csv)
+    roles = None
+    if messages is not None and len(messages) == len(tokens) and (
+        messages['message_id'].astype(object).fillna('').to_numpy() == tokens['message_id'].fillna('').to_numpy()
+    ).all():
+        roles = messages['role'].astype(object).fillna('').to_numpy()
+    return token_cube(tokens, roles, price_table)
+
+def build_cube(messages_csv, token_counts_csv=None, emulated_csv=None, price_table=None):
+    """Cube of a run from its CSVs (merged_conversations_filled, token counts, emulator output)."""
+    messages = read_table(messages_csv, usecols=MESSAGE_COLUMNS)
+    report_memory(messages, "build_cube")
+    parts = [message_cube(messages)]
+    if token_counts_csv is not None and os.path.isfile(token_counts_csv):
+        parts.append(csv_token_cube(token_counts_csv, emulated_csv, messages, price_table))
+    return combine_cubes(parts)
+
+def write_cube(cube, output_csv, sink=None):
+    write_csv(cube, output_csv, sink)
+    print(f"✅ Saved aggregate cube ({len(cube)} rows) to {output_csv}")
+
+def read_cube(cube_csv):
+    return pd.read_csv(cube_csv, dtype={'month': str, 'model': str, 'role': str, 'metric': str},
+                       keep_default_na=False, na_values={'value': ['']}, float_precision='round_trip')
+
+# --- Readers ---
+
+def metric_table(cube, metric, index='month', columns=None):
+    """Sum of one metric by index (Series) or index × columns (pivot, 0 where absent)."""
+    rows = _cost_units(cube[cube['metric'] == metric])
+    if columns is None:
+        table = rows.groupby(index, sort=True)['value'].sum()
+    else:
+        table = rows.pivot_table(index=index, columns=columns, values='value', aggfunc='sum', fill_value=0)
+    return _from_units(table) if metric in COST_METRICS else table
+
+def monthly_counts(cube):
+    """(monthly conversations, monthly messages) Series indexed by 'YYYY-MM' (NaT months dropped)."""
+    conversations = metric_table(cube, 'conversations')
+    messages = metric_table(cube, 'messages')
+    return (conversations[conversations.index != 'NaT'].astype(np.int64),
+            messages[messages.index != 'NaT'].astype(np.int64))
+
+def monthly_token_usage(cube):
+    """(input, output) token pivots month × model; rows without a model are left out."""
+    cube = cube[cube['model'] != '']
+    return (metric_table(cube, 'input_tokens', columns='model').astype(np.int64),
+            metric_table(cube, 'output_tokens', columns='model').astype(np.int64))
+
+def model_usage(cube):
+    """
+    Frequency and first use per model, sorted chronologically by first use (oldest first),
+    as written to model_usage_frequency.csv (without the TOTAL row).
+    """
+    frequency = metric_table(cube, 'messages', index='model').astype(np.int64)
+    first_use = cube[cube['metric'] == 'first_use'].groupby('model')['value'].min()
+    first_use = pd.to_datetime(first_use.reindex(frequency.index), unit='s').dt.round('us')
+    return (
+        pd.DataFrame({'model': frequency.index, 'frequency': frequency.to_numpy(), 'first_use': first_use.to_numpy()})
+        .sort_values('first_use', ascending=True)
+        .reset_index(drop=True)
+    )
+
+def monthly_costs(cube):
+    """Monthly naive and emulated API costs (months with a parseable date), as in the cost comparison."""
+    metrics = ['naive_input_cost', 'naive_output_cost', 'api_input_token_cost', 'api_output_token_cost']
+    rows = _cost_units(cube[cube['metric'].isin(metrics) & (cube['month'] != 'NaT')])
+    table = _from_units(rows.pivot_table(index='month', columns='metric', values='value', aggfunc='sum', fill_value=0))
+    return table.reindex(columns=metrics, fill_value=0.0).reset_index().rename_axis(columns=None)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the month × model × role aggregate cube of a run.")
+    parser.add_argument("--data_dir", type=str, default="data")
+    args = parser.parse_args()
+
+    cube = build_cube(
+        os.path.join(args.data_dir, "merged_conversations_filled.csv"),
+        os.path.join(args.data_dir, "token_counts.csv"),
+        os.path.join(args.data_dir, "token_costs_true_api_emulated.csv"),
+    )
+    write_cube(cube, os.path.join(args.data_dir, CUBE_CSV))
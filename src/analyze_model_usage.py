@@ -1,43 +1,28 @@
-import pandas as pd
-import matplotlib.pyplot as plt
+from aggregate_cube import message_cube, model_usage, MESSAGE_COLUMNS
+from table_schema import read_table, report_memory
 
-def analyze_model_usage(merged_csv_path="data/merged_conversations.csv", show_table=True):
+def analyze_model_usage(merged_csv_path="data/merged_conversations.csv", show_table=True, cube=None):
     """
-    Analyzes model usage frequency and first use from the merged conversations CSV.
+    Analyzes model usage frequency and first use, read from the aggregate cube
+    (built from the merged conversations CSV when not given).
     Returns:
         stats: DataFrame with columns [model, frequency, first_use]
         total_frequency: int, total number of messages
     """
-    # --- 1) Load merged CSV ---
-    merged = pd.read_csv(merged_csv_path, dtype=str)
+    # --- 1) Message cube of the merged CSV, unless the pipeline passed one ---
+    if cube is None:
+        merged = read_table(merged_csv_path, usecols=MESSAGE_COLUMNS)
+        report_memory(merged, "analyze_model_usage")
+        cube = message_cube(merged)
+        del merged
 
-    # --- 2) Fill missing 'model' entries ---
-    merged['model'] = merged['model'].fillna('unknown')
+    # --- 2) Frequency & first use per model, sorted chronologically by first use ---
+    stats = model_usage(cube)
 
-    # --- 3) Parse 'create_time' as datetime ---
-    merged['create_time_parsed'] = pd.to_datetime(
-        merged['create_time'],
-        format='%Y%m%d_%H%M%S.%f',
-        errors='coerce'
-    )
-
-    # --- 4) Group by model: frequency & first use ---
-    stats = (
-        merged
-        .groupby('model', as_index=False)
-        .agg(
-            frequency=('model', 'size'),
-            first_use=('create_time_parsed', 'min')
-        )
-    )
-
-    # --- 5) Sort chronologically by first use ---
-    stats = stats.sort_values('first_use').reset_index(drop=True)
-
-    # --- 6) Total frequency ---
+    # --- 3) Total frequency ---
     total_frequency = stats['frequency'].sum()
 
-    # --- 7) Optionally display ---
+    # --- 4) Optionally display ---
     if show_table:
         print("Model usage frequency (chronologically ordered):")
         try:
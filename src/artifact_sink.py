@@ -0,0 +1,171 @@
+"""
+Background writer for run artifacts that no later stage reads back from disk.
+
+A stage hands the ArtifactSink a table or rendered bytes and carries on computing;
+writer threads serialise each artifact to a temporary file next to its target, fsync
+it and rename it into place, so a reader only ever sees a complete file. The queue is
+bounded: once max_pending artifacts wait, the next write blocks until a writer catches
+up, which keeps memory in check when the disk is slower than the pipeline.
+
+A failed write is raised from the next write()/flush() call (ArtifactWriteError), so
+the stage that queued more work stops the run instead of the error being lost.
+flush() is the barrier before results.zip is packed: it returns once every queued
+artifact is on disk.
+
+    sink = ArtifactSink(writers=1)
+    write_csv(branches, "data/token_costs_branches.csv", sink)   # returns immediately
+    sink.close()                                                 # flush + stop the writers
+"""
+import os
+import queue
+import threading
+import traceback
+
+DEFAULT_WRITERS = 1
+DEFAULT_MAX_PENDING = 8
+
+class ArtifactWriteError(OSError):
+    """A background write failed; carries the target path (or the task's label)."""
+
+    def __init__(self, path, message):
+        super().__init__(f"writing {path} failed: {message}")
+        self.path = path
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return                                  # not supported (e.g. Windows)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def write_atomic(path, write, fsync=True):
+    """write(tmp_path), fsync it and rename it to path (the tmp file is removed on failure)."""
+    path = str(path)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp)
+        if fsync:
+            with open(tmp, "rb+") as f:
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    if fsync:
+        _fsync_dir(path)
+
+class ArtifactSink:
+    """Bounded queue of artifact writes served by writer threads (see module docstring)."""
+
+    def __init__(self, writers=DEFAULT_WRITERS, max_pending=DEFAULT_MAX_PENDING, fsync=True):
+        self.fsync = fsync
+        self.jobs = queue.Queue(maxsize=max(1, max_pending))
+        self.errors = []
+        self.pending = {}                       # {path: queued writes not finished yet}
+        self.done = threading.Condition()
+        self.threads = [
+            threading.Thread(target=self._serve, name=f"artifact-writer-{i}", daemon=True)
+            for i in range(max(1, writers))
+        ]
+        for t in self.threads:
+            t.start()
+
+    def _serve(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            path, label, fn = job
+            try:
+                fn()
+            except Exception as e:
+                print(f"❌ Background write of {label} failed: {type(e).__name__}: {e}")
+                with self.done:
+                    self.errors.append(ArtifactWriteError(label, f"{type(e).__name__}: {e}\n{traceback.format_exc()}"))
+            finally:
+                if path is not None:
+                    with self.done:
+                        self.pending[path] -= 1
+                        if not self.pending[path]:
+                            del self.pending[path]
+                        self.done.notify_all()
+                self.jobs.task_done()
+
+    def raise_errors(self):
+        """Raise the first failed write, if any (every failure is also printed as it happens)."""
+        with self.done:
+            if self.errors:
+                raise self.errors[0]
+
+    def _submit(self, path, label, fn):
+        self.raise_errors()
+        if path is not None:
+            with self.done:
+                self.pending[path] = self.pending.get(path, 0) + 1
+        self.jobs.put((path, label, fn))           # blocks while max_pending writes wait
+
+    def write(self, path, write):
+        """Queue write(tmp_path) for path; it is fsynced and renamed into place by a writer."""
+        path = str(path)
+        self._submit(path, path, lambda: write_atomic(path, write, self.fsync))
+
+    def call(self, fn, label="background task"):
+        """
+        Run fn() on a writer once every write queued before it has been picked up
+        (with wait(), fn can depend on their files), e.g. to archive finished outputs.
+        """
+        self._submit(None, label, fn)
+
+    def wait(self, paths):
+        """Block until the queued writes to paths are finished; raises failed writes."""
+        paths = {str(p) for p in paths}
+        with self.done:
+            self.done.wait_for(lambda: not paths & self.pending.keys())
+        self.raise_errors()
+
+    def flush(self):
+        """Barrier: return once every queued write is done; raises the first failed write."""
+        self.jobs.join()
+        self.raise_errors()
+
+    def close(self):
+        """Flush, then stop the writer threads (stopped even if the flush raises)."""
+        try:
+            self.flush()
+        finally:
+            for _ in self.threads:
+                self.jobs.put(None)
+            for t in self.threads:
+                t.join()
+
+def write_csv(df, path, sink=None, **kwargs):
+    """
+    df.to_csv(path, index=False, encoding="utf-8-sig"), in the background when a sink is
+    given. The sink writes a shallow copy, so the caller may add or drop columns meanwhile
+    (but not change values in place).
+    """
+    kwargs = {"index": False, "encoding": "utf-8-sig", **kwargs}
+    if sink is None:
+        df.to_csv(path, **kwargs)
+        return
+    df = df.copy(deep=False)
+    sink.write(path, lambda tmp: df.to_csv(tmp, **kwargs))
+
+def write_bytes(data, path, sink=None):
+    """Write bytes to path, in the background when a sink is given."""
+    def write(target):
+        with open(target, "wb") as f:
+            f.write(data)
+    if sink is None:
+        write(path)
+    else:
+        sink.write(path, write)
@@ -0,0 +1,187 @@
+"""
+Benchmark of the API cost emulator on synthetic long conversations.
+
+Compares emulate_true_api_chat_cost against the original per-row implementation
+(kept below as legacy_emulate_true_api_chat_cost), checks that both produce identical
+frames and prints the timings. The tree-aware mode is checked the same way against a
+replay of every message's full root path, and the precomputed ContextPaths (used by the
+sweeps) against the tree engine.
+
+    python src/bench_emulation.py
+    python src/bench_emulation.py --conversations 20 --messages 5000 --skip_legacy
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from emulate_api_chat_costs import (
+    emulate_true_api_chat_cost, ContextPaths, MODEL_CONTEXT_WINDOW, DEFAULT_CONTEXT_WINDOW, BUFFER_TOKENS
+)
+from pricing import load_price_table
+
+# Mix of small windows (constant pruning) and gpt-4-1's 1M window (never pruned)
+BENCH_MODELS = ("gpt-4-1", "gpt-4o", "gpt-4", "o3", "unknown-model")
+
+def legacy_emulate_true_api_chat_cost(
+    df,
+    model_context_window=MODEL_CONTEXT_WINDOW,
+    price_schedule=None,
+    default_context_window=DEFAULT_CONTEXT_WINDOW,
+    default_prices={'input': np.nan, 'output': np.nan},
+    buffer_tokens=BUFFER_TOKENS
+):
+    """Reference implementation: the original iterrows / list-rebuilding emulator (current prices)."""
+    price_schedule = price_schedule or load_price_table().current()
+    df = df.copy()
+    df['api_input_tokens'] = 0
+    df['api_input_token_cost'] = 0.0
+    df['api_output_token_cost'] = 0.0
+    df['api_total_cost'] = 0.0
+
+    for conv_id, group in df.groupby('conversation_id'):
+        context = []
+        for idx, row in group.iterrows():
+            model = row['model']
+            context_window = model_context_window.get(model, default_context_window)
+            price = price_schedule.get(model, default_prices)
+
+            context.append({
+                'input_tokens': row['input_tokens'],
+                'output_tokens': row['output_tokens'],
+                'model': model,
+                'row_idx': idx
+            })
+
+            prompt_tokens = []
+            for msg in context:
+                if msg['input_tokens'] > 0:
+                    prompt_tokens.append(msg['input_tokens'])
+                if msg['output_tokens'] > 0:
+                    prompt_tokens.append(msg['output_tokens'])
+            total_prompt = sum(prompt_tokens)
+
+            while total_prompt + buffer_tokens > context_window and len(context) > 1:
+                removed = context.pop(0)
+                if removed['input_tokens'] > 0:
+                    prompt_tokens.pop(0)
+                if removed['output_tokens'] > 0:
+                    prompt_tokens.pop(0)
+                total_prompt = sum(prompt_tokens)
+
+            api_input_tokens = total_prompt
+            input_cost = (api_input_tokens / 1e6) * price['input']
+            output_cost = (row['output_tokens'] / 1e6) * price['output']
+            total_cost = input_cost + output_cost
+
+            df.at[idx, 'api_input_tokens'] = api_input_tokens
+            df.at[idx, 'api_input_token_cost'] = input_cost
+            df.at[idx, 'api_output_token_cost'] = output_cost
+            df.at[idx, 'api_total_cost'] = total_cost
+
+    return df
+
+def synthetic_token_counts(n_conversations, n_messages, seed=0):
+    """Alternating user/assistant rows with heavy-tailed token counts, a few rows without conversation."""
+    rng = np.random.default_rng(seed)
+    n = n_conversations * n_messages
+    is_user = np.tile(np.arange(n_messages) % 2 == 0, n_conversations)
+    tokens = np.minimum(rng.lognormal(5, 1.5, n).astype(np.int64), 50_000)
+    df = pd.DataFrame({
+        'conversation_id': np.repeat([f"conv-{i:04d}" for i in range(n_conversations)], n_messages).astype(object),
+        'message_id': [f"msg-{i:08d}" for i in range(n)],
+        'input_tokens': np.where(is_user, tokens, 0),
+        'output_tokens': np.where(is_user, 0, tokens),
+        'model': np.repeat(rng.choice(BENCH_MODELS, n_conversations), n_messages),
+    })
+    df.loc[rng.choice(n, max(1, n // 1000), replace=False), 'conversation_id'] = np.nan
+    return df
+
+def add_branches(df, branch_prob=0.1, seed=0):
+    """Link each message to its predecessor, or with branch_prob to an earlier one (a regeneration)."""
+    rng = np.random.default_rng(seed)
+    df = df.copy()
+    conv = df['conversation_id'].fillna('').to_numpy()
+    parents = []
+    for i in range(len(df)):
+        first = i
+        while first > 0 and conv[first - 1] == conv[i]:
+            first -= 1
+        if i == first:
+            parents.append(np.nan)
+        else:
+            back = 1 + (rng.integers(1, 4) if rng.random() < branch_prob else 0)
+            parents.append(df['message_id'].iat[max(first, i - back)])
+    df['parent_id'] = parents
+    return df
+
+def path_reference_input_tokens(df, buffer_tokens=BUFFER_TOKENS):
+    """Reference for the tree engine: replay each message's whole root path from scratch."""
+    by_id = df.set_index('message_id')
+    result = {}
+    for mid in df.loc[df['conversation_id'].notna(), 'message_id']:
+        path = [mid]
+        while isinstance(by_id.at[path[-1], 'parent_id'], str):
+            path.append(by_id.at[path[-1], 'parent_id'])
+        start, cum = 0, [0]
+        for node in reversed(path):
+            cum.append(cum[-1] + int(by_id.at[node, 'input_tokens'] + by_id.at[node, 'output_tokens']))
+            window = MODEL_CONTEXT_WINDOW.get(by_id.at[node, 'model'], DEFAULT_CONTEXT_WINDOW)
+            while cum[-1] - cum[start] + buffer_tokens > window and start < len(cum) - 2:
+                start += 1
+        result[mid] = cum[-1] - cum[start]
+    return df['message_id'].map(result).fillna(0).astype(np.int64)
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - t0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the API cost emulator on long conversations.")
+    parser.add_argument("--conversations", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=1000, help="Messages per conversation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip_legacy", action="store_true", help="Only time the vectorized engine")
+    parser.add_argument("--branch_prob", type=float, default=0.1, help="Regeneration rate for the tree benchmark")
+    parser.add_argument("--workers", type=int, default=0, help="Also time the process-parallel tree mode")
+    args = parser.parse_args()
+
+    df = synthetic_token_counts(args.conversations, args.messages, args.seed)
+    print(f"{len(df)} rows, {args.conversations} conversations × {args.messages} messages")
+
+    (fast, _), fast_s = timed(emulate_true_api_chat_cost, df)
+    print(f"vectorized: {fast_s:8.3f}s")
+
+    if not args.skip_legacy:
+        legacy, legacy_s = timed(legacy_emulate_true_api_chat_cost, df)
+        print(f"legacy:     {legacy_s:8.3f}s  ({legacy_s / fast_s:.0f}× slower)")
+        pd.testing.assert_frame_equal(fast, legacy, check_exact=True)
+        print("✅ Results identical")
+
+    # --- Tree-aware engine (parent_id links with regenerated branches) ---
+    tree_df = add_branches(df, args.branch_prob, args.seed)
+    (tree_costs, branches), tree_s = timed(emulate_true_api_chat_cost, tree_df)
+    print(f"tree:       {tree_s:8.3f}s  ({len(branches)} branches)")
+
+    if args.workers > 1:
+        (parallel_costs, parallel_branches), parallel_s = timed(
+            lambda d: emulate_true_api_chat_cost(d, workers=args.workers), tree_df
+        )
+        print(f"parallel:   {parallel_s:8.3f}s  ({args.workers} workers)")
+        pd.testing.assert_frame_equal(parallel_costs, tree_costs, check_exact=True)
+        pd.testing.assert_frame_equal(parallel_branches, branches, check_exact=True)
+        print("✅ Parallel results identical")
+
+    if not args.skip_legacy:
+        reference, reference_s = timed(path_reference_input_tokens, tree_df)
+        print(f"per-path:   {reference_s:8.3f}s  ({reference_s / tree_s:.0f}× slower)")
+        assert (tree_costs['api_input_tokens'].to_numpy() == reference.to_numpy()).all()
+        print("✅ Tree results identical")
+
+    # --- Precomputed paths: one build, then one vectorized pass per setting ---
+    paths, build_s = timed(ContextPaths, tree_df)
+    windows = tree_df['model'].map(MODEL_CONTEXT_WINDOW).fillna(DEFAULT_CONTEXT_WINDOW).to_numpy(dtype=np.int64)
+    swept, setting_s = timed(paths.input_tokens, windows, BUFFER_TOKENS)
+    print(f"paths:      {build_s:8.3f}s build + {setting_s:.3f}s per setting")
+    assert (swept == tree_costs['api_input_tokens'].to_numpy()).all()
+    print("✅ Path results identical")
@@ -0,0 +1,75 @@
+"""
+Import-time benchmark for main.py and the src/ entry points.
+
+Each module is imported in a fresh interpreter with `python -X importtime`; the
+cumulative time of the module itself (best of --repeat runs) is reported together
+with its heaviest dependencies.
+
+    python src/bench_import_time.py
+    python src/bench_import_time.py --modules main token_counter --repeat 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_DIR, "src")
+
+DEFAULT_MODULES = (
+    "main", "import_export_zip", "flatten_messages", "merge_flattened", "fill_model_names",
+    "analyze_model_usage", "token_counter", "pricing", "emulate_api_chat_costs", "emulation_sweep", "calculate_token_costs",
+    "aggregate_cube", "plot_monthly_summary", "plot_render", "plot_token_costs_comparison", "what_if_scenarios", "send_email_report",
+    "streaming_pipeline", "incremental_index", "preview_report", "query_service", "pipeline_dag", "stage_cache", "artifact_sink", "resource_budget", "parallel_emulation", "warm_worker",
+)
+
+def import_times(module):
+    """
+    Run one `-X importtime` import of module.
+    Returns (cumulative µs of module, {direct dependency: cumulative µs}).
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_DIR, SRC_DIR]))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_DIR, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr.strip().splitlines()[-1]}")
+
+    # Lines are "import time: self | cumulative | <indent>name", children printed before parents
+    children = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0:
+            if name.strip() == module:
+                return int(cumulative_us), children
+            children = {}
+        elif depth == 1:
+            children[name.strip()] = int(cumulative_us)
+    return 0, {}
+
+def benchmark(module, repeat=5, top=3):
+    """Best-of-repeat import time of module (ms) and its heaviest direct imports."""
+    total_us, deps = min((import_times(module) for _ in range(repeat)), key=lambda run: run[0])
+    heaviest = sorted(deps.items(), key=lambda item: -item[1])[:top]
+    return total_us / 1000, [(name, us / 1000) for name, us in heaviest]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import time of main.py and src modules.")
+    parser.add_argument("--modules", nargs="*", default=list(DEFAULT_MODULES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=3, help="Heaviest dependencies to list per module")
+    args = parser.parse_args()
+
+    print(f"{'module':<30} {'import ms':>10}   heaviest imports")
+    for module in args.modules:
+        try:
+            total_ms, deps = benchmark(module, args.repeat, args.top)
+        except RuntimeError as e:
+            print(f"{module:<30} {'error':>10}   {e}")
+            continue
+        heaviest = ", ".join(f"{name} {ms:.0f}" for name, ms in deps)
+        print(f"{module:<30} {total_ms:>10.1f}   {heaviest}")
@@ -1,41 +1,17 @@
 import pandas as pd
-import numpy as np
 import os
-
-# --- Pricing schedule (add/adjust as needed) ---
-PRICE_SCHEDULE = {
-    'text-davinci-002-render-sha': {'input': 0.50, 'output': 1.50},
-    'gpt-4':                       {'input': 30.00, 'output': 60.00},
-    'gpt-4-mobile':                {'input': 30.00, 'output': 60.00},
-    'gpt-4-browsing':              {'input': 30.00, 'output': 60.00},
-    'gpt-4-plugins':               {'input': 30.00, 'output': 60.00},
-    'text-davinci-002-render-sha-mobile': {'input': 0.50, 'output': 1.50},
-    'gpt-4-gizmo':                 {'input': 30.00, 'output': 60.00},
-    'gpt-3.5-turbo':               {'input': 0.50, 'output': 1.50},
-    'gpt-4o':                      {'input': 2.50,  'output': 10.00},
-    'o1-preview':                  {'input': 15.00, 'output': 60.00},
-    'gpt-4o-canmore':              {'input': 2.50,  'output': 10.00},
-    'o1':                          {'input': 15.00, 'output': 60.00},
-    'o1-mini':                     {'input': 1.10,  'output': 4.40},
-    'o3-mini':                     {'input': 1.10,  'output': 4.40},
-    'o3-mini-high':                {'input': 1.10,  'output': 4.40},
-    'gpt-4-5':                     {'input': 75.00, 'output': 150.00},
-    'gpt-4o-mini':                 {'input': 0.15,  'output': 0.60},
-    'o3':                          {'input': 10.00, 'output': 40.00},
-    'o4-mini-high':                {'input': 1.10,  'output': 4.40},
-    'gpt-4-1':                     {'input': 2.00,  'output': 8.00},
-    'o4-mini':                     {'input': 1.10,  'output': 4.40},
-}
-DEFAULT_PRICES = {'input': np.nan, 'output': np.nan}
+from pricing import load_price_table, create_time_dates
 
 def calculate_token_costs(
     input_csv,
     output_csv,
-    price_schedule=PRICE_SCHEDULE,
+    price_table=None,
     debug=False
 ):
     """
     Calculate costs for input and output tokens per row in a token counts CSV.
+    Rows are priced at the rates in effect on their conversation_create_time
+    (price_table defaults to pricing.load_price_table()).
     Saves the result as a new CSV with cost columns appended.
     """
     # --- Ensure output directory exists ---
@@ -46,29 +22,21 @@ def calculate_token_costs(
         os.makedirs(out_dir, exist_ok=True)
 
     # --- Load token counts ---
-    df = pd.read_csv(input_csv, dtype={'input_tokens': int, 'output_tokens': int, 'model': str})
-
-    # --- Compute cost per row ---
-    def compute_cost(row):
-        model = row['model']
-        prices = price_schedule.get(model, DEFAULT_PRICES)
-        input_cost = (row['input_tokens'] / 1e6) * prices['input']
-        output_cost = (row['output_tokens'] / 1e6) * prices['output']
-        total_cost = input_cost + output_cost
-        return pd.Series({
-            'input_token_cost': input_cost,
-            'output_token_cost': output_cost,
-            'total_cost': total_cost
-        })
-
-    costs_df = df.apply(compute_cost, axis=1)
+    df = pd.read_csv(input_csv, dtype={
+        'input_tokens': int, 'output_tokens': int, 'model': str, 'conversation_create_time': str
+    })
 
-    # --- Merge costs back ---
-    df = pd.concat([df, costs_df], axis=1)
+    # --- Compute cost per row (one vectorized price lookup) ---
+    price_table = price_table or load_price_table()
+    dates = create_time_dates(df['conversation_create_time']) if 'conversation_create_time' in df.columns else None
+    input_cost, output_cost = price_table.costs(df['model'], df['input_tokens'], df['output_tokens'], dates)
+    df['input_token_cost'] = input_cost
+    df['output_token_cost'] = output_cost
+    df['total_cost'] = input_cost + output_cost
 
     # --- Debug: report any models missing price entries ---
     if debug:
-        missing = sorted(set(df['model']) - set(price_schedule.keys()))
+        missing = sorted(set(df['model']) - set(price_table.models))
         print(f"[Debug] Models with default (nan) prices: {missing}")
 
     # --- Display sample if debug ---
@@ -1,6 +1,9 @@
 import pandas as pd
 import numpy as np
 import os
+from bisect import bisect_left
+from pricing import load_price_table, create_time_dates
+from artifact_sink import write_csv
 
 # --- Default context windows ---
 MODEL_CONTEXT_WINDOW = {
@@ -16,105 +19,378 @@ MODEL_CONTEXT_WINDOW = {
 }
 DEFAULT_CONTEXT_WINDOW = 8192
 
-# --- Default prices ---
-PRICE_SCHEDULE = {
-    'text-davinci-002-render-sha': {'input': 0.50, 'output': 1.50},
-    'gpt-4':                       {'input': 30.00, 'output': 60.00},
-    'gpt-4-mobile':                {'input': 30.00, 'output': 60.00},
-    'gpt-4-browsing':              {'input': 30.00, 'output': 60.00},
-    'gpt-4-plugins':               {'input': 30.00, 'output': 60.00},
-    'text-davinci-002-render-sha-mobile': {'input': 0.50, 'output': 1.50},
-    'gpt-4-gizmo':                 {'input': 30.00, 'output': 60.00},
-    'gpt-3.5-turbo':               {'input': 0.50, 'output': 1.50},
-    'gpt-4o':                      {'input': 2.50,  'output': 10.00},
-    'o1-preview':                  {'input': 15.00, 'output': 60.00},
-    'gpt-4o-canmore':              {'input': 2.50,  'output': 10.00},
-    'o1':                          {'input': 15.00, 'output': 60.00},
-    'o1-mini':                     {'input': 1.10,  'output': 4.40},
-    'o3-mini':                     {'input': 1.10,  'output': 4.40},
-    'o3-mini-high':                {'input': 1.10,  'output': 4.40},
-    'gpt-4-5':                     {'input': 75.00, 'output': 150.00},
-    'gpt-4o-mini':                 {'input': 0.15,  'output': 0.60},
-    'o3':                          {'input': 10.00, 'output': 40.00},
-    'o4-mini-high':                {'input': 1.10,  'output': 4.40},
-    'gpt-4-1':                     {'input': 2.00,  'output': 8.00},
-    'o4-mini':                     {'input': 1.10,  'output': 4.40},
-}
-DEFAULT_PRICES = {'input': np.nan, 'output': np.nan}
 
 BUFFER_TOKENS = 300
 
+# Per root-to-leaf path costs, written next to the per-message output
+BRANCHES_CSV = "token_costs_branches.csv"
+BRANCH_COLUMNS = [
+    "conversation_id", "leaf_message_id", "messages", "input_tokens", "output_tokens",
+    "api_input_tokens", "api_input_token_cost", "api_output_token_cost", "api_total_cost",
+]
+
+def sliding_window_input_tokens(conversation_start, tokens, context_windows, buffer_tokens=BUFFER_TOKENS, cum=None):
+    """
+    Prompt size of every message under the API pruning rule, in O(n log n) with numpy.
+
+    Rows must be grouped by conversation, in chat order. Message i's prompt is the
+    suffix [s_i, i] of its conversation with
+        s_i = max(s_{i-1}, first s with sum(tokens[s..i]) + buffer ≤ window_i, capped at i),
+    i.e. old messages are dropped (never restored) until the prompt plus buffer fits,
+    but the current message always stays.
+
+    Args:
+        conversation_start (np.ndarray): Index of the first row of each row's conversation.
+        tokens (np.ndarray): input_tokens + output_tokens per row.
+        context_windows (np.ndarray): Context window of each row's model.
+        buffer_tokens (int): Tokens reserved for the reply.
+        cum (np.ndarray): Optional precomputed [0, cumsum(tokens)...] (see ContextPaths).
+
+    Returns:
+        np.ndarray: int64 prompt tokens per row.
+    """
+    n = len(tokens)
+    if cum is None:
+        cum = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(tokens, out=cum[1:])
+    rows = np.arange(n)
+
+    # first start that fits the window, clamped to [conversation start, current row]
+    fits = np.searchsorted(cum, cum[1:] - context_windows + buffer_tokens, side='left')
+    start = np.clip(fits, conversation_start, rows)
+    # pruning is permanent: the start pointer never moves back within a conversation
+    start = np.maximum.accumulate(start) if n else start
+    return cum[1:] - cum[start]
+
+def _conversation_groups(conversation_ids):
+    """
+    Row order grouping rows by conversation (stable, rows without conversation dropped)
+    and, for each position in that order, the position of its conversation's first row.
+    """
+    codes, _ = pd.factorize(conversation_ids)
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    grouped = codes[order]
+    first_row = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]]) if len(grouped) else grouped
+    conversation_start = np.repeat(first_row, np.diff(np.r_[first_row, len(grouped)]))
+    return order, first_row, conversation_start
+
+def tree_window_costs(message_ids, parent_ids, tokens, context_windows, input_tokens, output_tokens,
+                      price_in, price_out, buffer_tokens=BUFFER_TOKENS):
+    """
+    Tree-aware version of sliding_window_input_tokens for one conversation.
+
+    Every message is replayed with the context of its own root path (following
+    parent_id; a parent that isn't in the table makes the message a root). A depth-first
+    walk keeps the path's cumulative token sums and start pointers on a stack, so sibling
+    branches reuse their shared prefix and each message costs one binary search.
+
+    Args:
+        message_ids, parent_ids (np.ndarray): Node ids and parent ids of the conversation's rows.
+        tokens (np.ndarray): input_tokens + output_tokens per row.
+        context_windows (np.ndarray): Context window per row.
+        input_tokens, output_tokens (np.ndarray): Token counts per row.
+        price_in, price_out (np.ndarray): $/1M tokens per row (NaN if unpriced;
+            counted as 0 in the branch totals, like the monthly sums).
+
+    Returns:
+        (np.ndarray api_input_tokens per row,
+         list of (leaf row, messages, input, output, api_input, input cost, output cost) per root-to-leaf path)
+    """
+    n = len(message_ids)
+    position = {m: i for i, m in enumerate(message_ids)}
+    parent = np.array([position.get(p, -1) for p in parent_ids], dtype=np.int64)
+    children = [[] for _ in range(n)]
+    for i, p in enumerate(parent.tolist()):
+        if p >= 0 and p != i:
+            children[p].append(i)
+
+    api_in = np.zeros(n, dtype=np.int64)
+    in_cost = np.nan_to_num(price_in) / 1e6
+    out_cost = np.nan_to_num(price_out) / 1e6
+    visited = np.zeros(n, dtype=bool)
+    branches = []
+
+    roots = [i for i in range(n) if parent[i] < 0] + list(range(n))   # leftovers: broken cycles
+    for root in roots:
+        if visited[root]:
+            continue
+        cum, starts = [0], []                     # cum[k] = tokens of the first k path messages
+        sums = [(0, 0, 0, 0.0, 0.0)]              # running path totals (in, out, api_in, in $, out $)
+        stack = [(root, 0)]
+        while stack:
+            i, depth = stack.pop()
+            if visited[i]:
+                continue
+            visited[i] = True
+            del cum[depth + 1:], starts[depth:], sums[depth + 1:]
+
+            total = cum[depth] + int(tokens[i])
+            cum.append(total)
+            start = min(bisect_left(cum, total - int(context_windows[i]) + buffer_tokens, 0, depth + 1), depth)
+            start = max(start, starts[-1]) if starts else start
+            starts.append(start)
+            api_in[i] = total - cum[start]
+
+            t_in, t_out, t_api, c_in, c_out = sums[depth]
+            sums.append((
+                t_in + int(input_tokens[i]), t_out + int(output_tokens[i]), t_api + int(api_in[i]),
+                c_in + api_in[i] * in_cost[i], c_out + output_tokens[i] * out_cost[i]
+            ))
+            kids = [k for k in children[i] if not visited[k]]
+            if kids:
+                stack.extend((k, depth + 1) for k in reversed(kids))
+            else:
+                branches.append((i, depth + 1, *sums[depth + 1]))
+    return api_in, branches
+
+def emulate_input_tokens(df, context_windows, buffer_tokens=BUFFER_TOKENS, tree=None,
+                         price_in=None, price_out=None, workers=None):
+    """
+    API prompt tokens of every row of a token counts frame for the given per-row context windows.
+
+    Rows are grouped by conversation_id (keeping their order inside each conversation);
+    with tree (default: the frame has parent_id and message_id) each message is replayed
+    along its own root path, otherwise in row order. Prices are only used for the branch
+    totals of the tree mode. With workers > 1 the tree mode runs on a process pool
+    (parallel_emulation; the linear mode is vectorized and always runs in-process).
+
+    Returns:
+        (np.ndarray int64 api_input_tokens per row (0 outside conversations),
+         np.ndarray bool mask of rows that belong to a conversation,
+         list of tree_window_costs branch tuples with frame row numbers as leaves)
+    """
+    if tree is None:
+        tree = 'parent_id' in df.columns and 'message_id' in df.columns
+    order, first_row, conversation_start = _conversation_groups(df['conversation_id'])
+    tokens = (df['input_tokens'] + df['output_tokens']).to_numpy(dtype=np.int64)
+
+    api_input_tokens = np.zeros(len(df), dtype=np.int64)
+    branch_rows = []
+    if tree:
+        input_tokens = df['input_tokens'].to_numpy(dtype=np.int64)
+        output_tokens = df['output_tokens'].to_numpy(dtype=np.int64)
+        price_in = np.zeros(len(df)) if price_in is None else price_in
+        price_out = np.zeros(len(df)) if price_out is None else price_out
+        if workers and workers > 1:
+            from parallel_emulation import parallel_tree_input_tokens
+            api_in, branches = parallel_tree_input_tokens(
+                _parent_positions(df, order, first_row), tokens[order], context_windows[order],
+                input_tokens[order], output_tokens[order], price_in[order], price_out[order],
+                first_row, buffer_tokens, workers
+            )
+            api_input_tokens[order] = api_in
+            branch_rows = [(order[leaf], *rest) for leaf, *rest in branches]
+        else:
+            message_ids = df['message_id'].to_numpy(dtype=object)
+            parent_ids = df['parent_id'].to_numpy(dtype=object)
+            bounds = np.r_[first_row, len(order)]
+            for a, b in zip(bounds[:-1], bounds[1:]):
+                rows = order[a:b]
+                api_in, branches = tree_window_costs(
+                    message_ids[rows], parent_ids[rows], tokens[rows], context_windows[rows],
+                    input_tokens[rows], output_tokens[rows], price_in[rows], price_out[rows], buffer_tokens
+                )
+                api_input_tokens[rows] = api_in
+                branch_rows += [(rows[leaf], *rest) for leaf, *rest in branches]
+    else:
+        api_input_tokens[order] = sliding_window_input_tokens(
+            conversation_start, tokens[order], context_windows[order], buffer_tokens
+        )
+    in_conversation = np.zeros(len(df), dtype=bool)
+    in_conversation[order] = True
+    return api_input_tokens, in_conversation, branch_rows
+
+def _parent_positions(df, order, first_row):
+    """
+    Position (in the conversation-grouped order) of each grouped row's parent message
+    within its conversation, -1 for roots and unknown parents. The last row wins for
+    duplicate message ids, as in tree_window_costs.
+    """
+    m = len(order)
+    conversation = np.repeat(np.arange(len(first_row)), np.diff(np.r_[first_row, m]))
+    message_ids = df['message_id'].to_numpy(dtype=object)[order]
+    parent_ids = pd.Series(df['parent_id'].to_numpy(dtype=object)[order])
+    last = pd.DataFrame({'c': conversation, 'm': message_ids}).drop_duplicates(keep='last')
+    index = pd.MultiIndex.from_arrays([last['c'], last['m']])
+    parent = np.where(
+        parent_ids.notna(),
+        index.get_indexer(pd.MultiIndex.from_arrays([conversation, parent_ids])),
+        -1
+    )
+    return np.where(parent >= 0, last.index.to_numpy()[np.maximum(parent, 0)], -1)
+
+class ContextPaths:
+    """
+    Prompt sizes of a token counts frame for many (context windows, buffer) settings.
+
+    Built once: the conversation grouping, every message's parent (parent_id within its
+    conversation in tree mode, else the previous row), its depth, the cumulative token sum
+    of its root path and a binary-lifting table of 2^k-th ancestors. Each setting then
+    finds every message's prompt start with a vectorized binary search up its path
+    (the same rule as tree_window_costs / sliding_window_input_tokens, identical results)
+    instead of replaying the conversations.
+    """
+
+    def __init__(self, df, tree=None):
+        if tree is None:
+            tree = 'parent_id' in df.columns and 'message_id' in df.columns
+        self.n = len(df)
+        self.order, first_row, self.conversation_start = _conversation_groups(df['conversation_id'])
+        self.tokens = (df['input_tokens'] + df['output_tokens']).to_numpy(dtype=np.int64)[self.order]
+        self.tree = tree
+        m = len(self.order)
+        if not tree:
+            self.cum = np.zeros(m + 1, dtype=np.int64)
+            np.cumsum(self.tokens, out=self.cum[1:])
+            return
+
+        parent = _parent_positions(df, self.order, first_row)
+        conversation = np.repeat(np.arange(len(first_row)), np.diff(np.r_[first_row, m]))
+
+        # --- Depths and root-path token sums; cycles are cut like the depth-first walk does ---
+        while True:
+            depth, path_tokens, stuck = _path_sums(parent, self.tokens)
+            if not stuck.any():
+                break
+            stuck = np.flatnonzero(stuck)
+            _, first_stuck = np.unique(conversation[stuck], return_index=True)
+            parent[stuck[first_stuck]] = -1      # lowest unreached message becomes a root
+
+        self.depth = depth
+        self.path_tokens = path_tokens                       # tokens from the root to the message
+        self.prefix_tokens = path_tokens - self.tokens       # ... to its parent
+        self.up = [np.where(parent >= 0, parent, np.arange(m))]
+        for _ in range(max(1, int(depth.max(initial=0)).bit_length()) - 1):
+            self.up.append(self.up[-1][self.up[-1]])
+
+    def input_tokens(self, context_windows, buffer_tokens=BUFFER_TOKENS):
+        """
+        api_input_tokens per row (frame order; 0 outside conversations) for per-row
+        context_windows (array) or one window for every row (int).
+        """
+        windows = np.broadcast_to(np.asarray(context_windows, dtype=np.int64), (self.n,))[self.order]
+        api_input_tokens = np.zeros(self.n, dtype=np.int64)
+        if not self.tree:
+            api_input_tokens[self.order] = sliding_window_input_tokens(
+                self.conversation_start, self.tokens, windows, buffer_tokens, cum=self.cum
+            )
+            return api_input_tokens
+
+        # shallowest message on the path with prefix ≥ threshold (the message itself at worst)
+        threshold = self.path_tokens - windows + buffer_tokens
+        start = np.arange(len(self.order))
+        for up in reversed(self.up):
+            candidate = up[start]
+            start = np.where(self.prefix_tokens[candidate] >= threshold, candidate, start)
+        # pruning is permanent along a path: deepest start of any ancestor
+        start_depth = self.depth[start]
+        for up in self.up:
+            start_depth = np.maximum(start_depth, start_depth[up])
+        start = np.arange(len(self.order))
+        lift = self.depth - start_depth
+        for k, up in enumerate(self.up):
+            start = np.where((lift >> k) & 1, up[start], start)
+        api_input_tokens[self.order] = self.path_tokens - self.prefix_tokens[start]
+        return api_input_tokens
+
+def _path_sums(parent, tokens):
+    """
+    Pointer jumping: depth and root-path token sum of every node of a parent forest,
+    and a mask of nodes that never reach a root (in or below a cycle).
+    """
+    depth = (parent >= 0).astype(np.int64)
+    path_tokens = tokens.astype(np.int64)
+    ancestor = parent.copy()
+    for _ in range(max(1, len(parent).bit_length()) + 1):
+        live = np.flatnonzero(ancestor >= 0)
+        if not len(live):
+            break
+        jump = ancestor[live]
+        depth[live] += depth[jump]
+        path_tokens[live] += path_tokens[jump]
+        ancestor[live] = ancestor[jump]
+    return depth, path_tokens, ancestor >= 0
+
 def emulate_true_api_chat_cost(
     df,
     model_context_window=MODEL_CONTEXT_WINDOW,
-    price_schedule=PRICE_SCHEDULE,
     default_context_window=DEFAULT_CONTEXT_WINDOW,
-    default_prices=DEFAULT_PRICES,
     buffer_tokens=BUFFER_TOKENS,
-    debug=False
+    debug=False,
+    tree=None,
+    price_table=None,
+    workers=None
 ):
     """
     Emulates true OpenAI API chat cost for each message, considering context window, buffer, and pruning.
-    Returns a new DataFrame with API emulated cost columns.
+
+    With tree=True (default when the frame has a parent_id column) each message is costed
+    with the context of its own root path, so regenerated sibling branches don't feed each
+    other (see tree_window_costs). Otherwise messages are replayed per conversation in the
+    frame's row order (see sliding_window_input_tokens). Rows without a conversation_id
+    get zero cost. Each message is priced by price_table (default: pricing.load_price_table())
+    at the rates in effect on its conversation_create_time, when the frame has one.
+    workers > 1 runs the tree mode on that many processes (same results).
+
+    Returns:
+        (pd.DataFrame with API emulated cost columns,
+         pd.DataFrame of root-to-leaf branch costs (BRANCH_COLUMNS; empty unless tree))
     """
     df = df.copy()
-    df['api_input_tokens'] = 0
-    df['api_input_token_cost'] = 0.0
-    df['api_output_token_cost'] = 0.0
-    df['api_total_cost'] = 0.0
-
-    for conv_id, group in df.groupby('conversation_id'):
-        context = []
-        for idx, row in group.iterrows():
-            model = row['model']
-            context_window = model_context_window.get(model, default_context_window)
-            price = price_schedule.get(model, default_prices)
-
-            context.append({
-                'input_tokens': row['input_tokens'],
-                'output_tokens': row['output_tokens'],
-                'model': model,
-                'row_idx': idx
-            })
-
-            prompt_tokens = []
-            for msg in context:
-                if msg['input_tokens'] > 0:
-                    prompt_tokens.append(msg['input_tokens'])
-                if msg['output_tokens'] > 0:
-                    prompt_tokens.append(msg['output_tokens'])
-            total_prompt = sum(prompt_tokens)
-
-            while total_prompt + buffer_tokens > context_window and len(context) > 1:
-                removed = context.pop(0)
-                if removed['input_tokens'] > 0:
-                    prompt_tokens.pop(0)
-                if removed['output_tokens'] > 0:
-                    prompt_tokens.pop(0)
-                total_prompt = sum(prompt_tokens)
-
-            api_input_tokens = total_prompt
-            input_cost = (api_input_tokens / 1e6) * price['input']
-            output_cost = (row['output_tokens'] / 1e6) * price['output']
-            total_cost = input_cost + output_cost
-
-            df.at[idx, 'api_input_tokens'] = api_input_tokens
-            df.at[idx, 'api_input_token_cost'] = input_cost
-            df.at[idx, 'api_output_token_cost'] = output_cost
-            df.at[idx, 'api_total_cost'] = total_cost
 
-    return df
+    # --- Per-row context window and prices ---
+    model = df['model']
+    context_windows = model.map(model_context_window).fillna(default_context_window).to_numpy(dtype=np.int64)
+    price_table = price_table or load_price_table()
+    dates = create_time_dates(df['conversation_create_time']) if 'conversation_create_time' in df.columns else None
+    price_in, price_out = price_table.prices(model, dates)
+
+    api_input_tokens, in_conversation, branch_rows = emulate_input_tokens(
+        df, context_windows, buffer_tokens, tree, price_in, price_out, workers
+    )
+
+    input_cost = (api_input_tokens / 1e6) * price_in
+    output_cost = (df['output_tokens'].to_numpy() / 1e6) * price_out
+    df['api_input_tokens'] = api_input_tokens
+    df['api_input_token_cost'] = np.where(in_conversation, input_cost, 0.0)
+    df['api_output_token_cost'] = np.where(in_conversation, output_cost, 0.0)
+    df['api_total_cost'] = np.where(in_conversation, input_cost + output_cost, 0.0)
+
+    # --- Root-to-leaf branch totals ---
+    branches = pd.DataFrame(branch_rows, columns=["leaf_row", *BRANCH_COLUMNS[2:-1]])
+    branches.insert(0, "conversation_id", df['conversation_id'].to_numpy()[branches["leaf_row"].to_numpy(dtype=np.int64)])
+    branches.insert(1, "leaf_message_id", df['message_id'].to_numpy()[branches["leaf_row"].to_numpy(dtype=np.int64)]
+                    if 'message_id' in df.columns else np.nan)
+    branches["api_total_cost"] = branches["api_input_token_cost"] + branches["api_output_token_cost"]
+    branches = branches.drop(columns="leaf_row")[BRANCH_COLUMNS]
+
+    if debug:
+        print(f"[Debug] Emulated {int(in_conversation.sum())} messages in {df['conversation_id'].nunique()} conversations, "
+              f"{len(branches)} branches")
+
+    return df, branches
 
 def main(
     input_csv,
     output_csv,
-    debug=False
+    debug=False,
+    branches_csv=None,
+    workers=None,
+    sink=None
 ):
     """
     Full workflow: load CSV, emulate API cost, save result.
+    When token counts carry parent_id, the per-branch costs are also written to
+    branches_csv (default: BRANCHES_CSV next to output_csv).
+    workers > 1 emulates the conversations on a process pool.
+    With an ArtifactSink, the branch costs (read by no later stage) are written in the background.
     """
     # Load token counts
-    df = pd.read_csv(input_csv, dtype={'input_tokens': int, 'output_tokens': int, 'model': str})
+    df = pd.read_csv(input_csv, dtype={
+        'input_tokens': int, 'output_tokens': int, 'model': str,
+        'conversation_id': str, 'message_id': str, 'parent_id': str
+    })
 
     # Sort DataFrame for correct API emulation order
     if 'conversation_id' in df.columns and 'message_id' in df.columns:
@@ -125,11 +401,11 @@ def main(
         df = df.sort_values(['create_time'])
 
     # Emulate API chat cost
-    df = emulate_true_api_chat_cost(df, debug=debug)
+    df, branches = emulate_true_api_chat_cost(df, debug=debug, workers=workers)
 
-    # Debug: models not in price_schedule
+    # Debug: models not in the price schedule
     if debug:
-        missing = sorted(set(df['model']) - set(PRICE_SCHEDULE.keys()))
+        missing = sorted(set(df['model']) - set(load_price_table().models))
         print(f"[Debug] Models with default (nan) prices: {missing}")
 
     # Show DataFrame head
@@ -144,6 +420,12 @@ def main(
     df.to_csv(output_csv, index=False, encoding="utf-8-sig")
     print(f"✅ Saved true API emulation costs to {output_csv}, total records: {len(df)}")
 
+    if 'parent_id' in df.columns:
+        branches_csv = branches_csv or os.path.join(os.path.dirname(str(output_csv)), BRANCHES_CSV)
+        branches = branches.sort_values(['conversation_id', 'leaf_message_id'])
+        write_csv(branches, branches_csv, sink)
+        print(f"✅ Saved {len(branches)} conversation branch costs to {branches_csv}")
+
     return df
 
 if __name__ == "__main__":
@@ -152,10 +434,12 @@ if __name__ == "__main__":
     parser.add_argument("--input_csv", type=str, required=True, help="Path to token_counts.csv")
     parser.add_argument("--output_csv", type=str, required=True, help="Output CSV for true API emulation costs")
     parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for the tree emulation")
     args = parser.parse_args()
 
     main(
         input_csv=args.input_csv,
         output_csv=args.output_csv,
-        debug=args.debug
+        debug=args.debug,
+        workers=args.workers
     )
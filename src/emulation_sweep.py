@@ -0,0 +1,114 @@
+"""
+Sensitivity of the emulated API cost to the reply buffer and the context window.
+
+The conversation paths and their cumulative token sums are built once (ContextPaths);
+every (buffer, window cap) setting is then a vectorized binary search for the prompt
+starts, not a full re-emulation. Results are a tidy table (one row per setting) and a
+cost-vs-buffer plot with one line per window cap.
+
+    python src/emulation_sweep.py
+    python src/emulation_sweep.py --buffers 0 512 1024 2048 4096 --windows model 8192 32768
+"""
+import os
+import numpy as np
+import pandas as pd
+from emulate_api_chat_costs import ContextPaths, MODEL_CONTEXT_WINDOW, DEFAULT_CONTEXT_WINDOW, BUFFER_TOKENS
+from pricing import load_price_table, create_time_dates
+
+DATA_DIR = "data"
+TOKEN_COUNTS_CSV = os.path.join(DATA_DIR, "token_counts.csv")
+SWEEP_CSV = os.path.join(DATA_DIR, "emulation_sweep.csv")
+PLOT_SWEEP = os.path.join(DATA_DIR, "plot_emulation_sweep.png")
+
+DEFAULT_BUFFERS = tuple(range(0, 4097, 256))
+DEFAULT_WINDOWS = (None, 8192, 32768, 128000)     # None = each model's own window
+SWEEP_COLUMNS = [
+    "buffer_tokens", "context_window_cap", "api_input_tokens",
+    "api_input_token_cost", "api_output_token_cost", "api_total_cost",
+]
+
+def sweep_costs(df, buffers=DEFAULT_BUFFERS, windows=DEFAULT_WINDOWS, price_table=None, tree=None):
+    """
+    Total emulated API tokens and cost for every (buffer, window cap) setting.
+
+    A window cap limits every model's context window to min(model window, cap);
+    None keeps the models' windows. Rows are priced once (pricing engine, effective
+    dates); NaN prices count as 0 like the monthly sums.
+
+    Returns:
+        pd.DataFrame with SWEEP_COLUMNS, one row per setting.
+    """
+    paths = ContextPaths(df, tree)
+    model_windows = df['model'].map(MODEL_CONTEXT_WINDOW).fillna(DEFAULT_CONTEXT_WINDOW).to_numpy(dtype=np.int64)
+    dates = create_time_dates(df['conversation_create_time']) if 'conversation_create_time' in df.columns else None
+    price_in, price_out = (price_table or load_price_table()).prices(df['model'], dates)
+    in_cost = np.nan_to_num(price_in) / 1e6
+
+    in_conversation = np.zeros(len(df), dtype=bool)
+    in_conversation[paths.order] = True
+    output_cost = float(np.sum(np.where(in_conversation, df['output_tokens'].to_numpy() * np.nan_to_num(price_out) / 1e6, 0.0)))
+
+    rows = []
+    for cap in windows:
+        context_windows = model_windows if cap is None else np.minimum(model_windows, cap)
+        for buffer_tokens in buffers:
+            api_in = paths.input_tokens(context_windows, buffer_tokens)
+            input_cost = float(api_in @ in_cost)
+            rows.append((buffer_tokens, np.nan if cap is None else cap, int(api_in.sum()),
+                         input_cost, output_cost, input_cost + output_cost))
+    return pd.DataFrame(rows, columns=SWEEP_COLUMNS)
+
+def plot_sweep(sweep, png_path):
+    """Total API cost vs buffer size, one line per window cap, default buffer marked."""
+    from matplotlib.figure import Figure
+    import matplotlib.ticker as mtick
+
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    for cap, group in sweep.groupby(sweep['context_window_cap'].fillna(0), sort=True):
+        label = "model windows" if cap == 0 else f"window ≤ {int(cap):,}"
+        ax.plot(group['buffer_tokens'], group['api_total_cost'], marker='o', markersize=3, label=label)
+    ax.axvline(BUFFER_TOKENS, color='grey', linestyle='--', linewidth=1, label=f'default buffer ({BUFFER_TOKENS})')
+    ax.set_xlabel('Buffer Tokens')
+    ax.set_ylabel('Total Emulated API Cost (USD)')
+    ax.set_title('Emulated API Cost Sensitivity to Buffer Size and Context Window')
+    ax.legend()
+    ax.yaxis.set_major_formatter(mtick.StrMethodFormatter('${x:,.2f}'))
+    fig.tight_layout()
+    fig.savefig(png_path, bbox_inches='tight')
+
+def main(
+    token_counts_csv=TOKEN_COUNTS_CSV,
+    output_csv=SWEEP_CSV,
+    plot_png=PLOT_SWEEP,
+    buffers=DEFAULT_BUFFERS,
+    windows=DEFAULT_WINDOWS
+):
+    """Load token counts, sweep the settings, save the tidy table and the sensitivity plot."""
+    df = pd.read_csv(token_counts_csv, dtype={
+        'input_tokens': int, 'output_tokens': int, 'model': str, 'conversation_create_time': str,
+        'conversation_id': str, 'message_id': str, 'parent_id': str
+    }).sort_values(['conversation_id', 'message_id'])
+
+    sweep = sweep_costs(df, buffers, windows)
+    sweep.to_csv(output_csv, index=False, encoding='utf-8-sig')
+    print(f"✅ Saved {len(sweep)} sweep settings to {output_csv}")
+    plot_sweep(sweep, plot_png)
+    print(f"✅ Saved sensitivity plot to {plot_png}")
+    return sweep
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Sweep buffer size and context window caps of the API emulation.")
+    parser.add_argument("--token_counts_csv", type=str, default=TOKEN_COUNTS_CSV)
+    parser.add_argument("--output_csv", type=str, default=SWEEP_CSV)
+    parser.add_argument("--plot_png", type=str, default=PLOT_SWEEP)
+    parser.add_argument("--buffers", type=int, nargs="*", default=list(DEFAULT_BUFFERS))
+    parser.add_argument("--windows", nargs="*", default=["model", *DEFAULT_WINDOWS[1:]],
+                        help='Window caps; "model" = each model\'s own window')
+    args = parser.parse_args()
+
+    main(
+        args.token_counts_csv, args.output_csv, args.plot_png, args.buffers,
+        [None if w == "model" else int(w) for w in args.windows]
+    )
@@ -2,13 +2,17 @@ import pandas as pd
 import json
 import re
 from collections import defaultdict
+from table_schema import read_table, report_memory
+from aggregate_cube import message_cube, model_usage
+from artifact_sink import write_csv
 
 def fill_model_names(
     merged_csv_path="data/merged_conversations.csv",
     conversations_json=None,
     output_csv_path="data/merged_conversations_filled.csv",
     usage_csv_path="data/model_usage_frequency.csv",
-    debug=False
+    debug=False,
+    sink=None
 ):
     """
     Fills missing or placeholder model names in merged conversations CSV by looking up
@@ -16,9 +20,11 @@ def fill_model_names(
     Writes a new CSV with improved 'model' column and saves model usage frequency table as CSV.
     The frequency table is sorted chronologically by first use (oldest to most recent),
     and includes the first use timestamp per model.
+    Returns (filled DataFrame, message cube of it; see aggregate_cube.message_cube).
     """
     # --- 1) Load merged CSV ---
-    df = pd.read_csv(merged_csv_path, dtype=str)
+    df = read_table(merged_csv_path)
+    report_memory(df, "fill_model_names")
 
     # --- 2) Prepare regex for known model names ---
     model_patterns = [
@@ -50,7 +56,7 @@ def fill_model_names(
                     break
 
     # --- 4) First pass fill from JSON ---
-    df["model_filled"] = df["model"].fillna("unknown")
+    df["model_filled"] = df["model"].astype(object).fillna("unknown")
     first_pass_counts = defaultdict(int)
 
     for idx, row in df.iterrows():
@@ -66,7 +72,7 @@ def fill_model_names(
 
     # --- 5) Second pass fallback: fill within conversations by mode ---
     fallback_counts = defaultdict(int)
-    for conv_id, group in df.groupby("conversation_id"):
+    for conv_id, group in df.groupby("conversation_id", observed=True):
         # identify known models in this conversation
         known = group.loc[
             ~group["model_filled"].isin(("auto", "research", "unknown")),
@@ -82,7 +88,7 @@ def fill_model_names(
                         print(f"[Fallback] idx={idx}, conv_id={conv_id}, filled -> '{mode_model}'")
 
     # --- 6) Replace original model column ---
-    df["model"] = df["model_filled"]
+    df["model"] = df["model_filled"].astype("category")
     df.drop(columns="model_filled", inplace=True)
 
     # --- 7) Report filling statistics ---
@@ -101,23 +107,14 @@ def fill_model_names(
     df.to_csv(output_csv_path, index=False, encoding="utf-8-sig")
     print(f"✅ Saved updated CSV to {output_csv_path}")
 
-    # --- 9) Calculate and save model frequency table ---
-    # Parse 'create_time' to datetime for sorting and first-use calculation
-    df['create_time_parsed'] = pd.to_datetime(
-        df['create_time'], format='%Y%m%d_%H%M%S.%f', errors='coerce'
-    )
+    # --- 9) Message cube (counts per month/model/role) and model frequency table ---
+    cube = message_cube(df)
+    write_model_usage(model_usage(cube), usage_csv_path, sink)
 
-    # Group by model
-    usage_stats = (
-        df.groupby('model', as_index=False)
-        .agg(
-            frequency=('model', 'size'),
-            first_use=('create_time_parsed', 'min')
-        )
-        .sort_values('first_use', ascending=True)  # Chronological, oldest first
-        .reset_index(drop=True)
-    )
+    return df, cube
 
+def write_model_usage(usage_stats, usage_csv_path, sink=None):
+    """Append the TOTAL row to a model usage table and save it as CSV (in the background with a sink)."""
     # Add total frequency as the last row (optional)
     total_row = pd.DataFrame({
         'model': ['TOTAL'],
@@ -127,10 +124,10 @@ def fill_model_names(
     usage_stats = pd.concat([usage_stats, total_row], ignore_index=True)
 
     # Save the frequency/chronology table
-    usage_stats.to_csv(usage_csv_path, index=False, encoding="utf-8-sig")
+    write_csv(usage_stats, usage_csv_path, sink)
     print(f"✅ Saved model usage frequency CSV to {usage_csv_path}")
 
-    return df, usage_stats
+    return usage_stats
 
 # === CLI/Script usage ===
 if __name__ == "__main__":
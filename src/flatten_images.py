@@ -4,7 +4,7 @@ from pathlib import Path
 import os
 
 def normalize_missing(df: pd.DataFrame) -> pd.DataFrame:
-    """Normalize empty strings and 'nan' to pandas NA for all object columns."""
+    """Normalize empty strings, 'nan' and 'None' to pandas NA for all object columns."""
     df = df.copy()
     for c in df.columns:
         if df[c].dtype == object:
@@ -12,7 +12,7 @@ def normalize_missing(df: pd.DataFrame) -> pd.DataFrame:
                 df[c]
                 .astype(str)
                 .str.strip()
-                .replace({"": pd.NA, "nan": pd.NA})
+                .replace({"": pd.NA, "nan": pd.NA, "None": pd.NA})
             )
     return df
 
@@ -25,17 +25,18 @@ def extract_text_from_parts(parts):
         return ""
     return "\n".join(extract(p) for p in parts).strip()
 
-def flatten_all_messages_to_df(conversations, error_log_path="flat_error.txt"):
+def flatten_conversations(conversations, start_index=0):
     """
-    Flattens a list of conversation dicts into a pandas DataFrame.
-    Returns (DataFrame, error_count, error_conversation_count).
-    Writes errors to error_log_path.
+    Flattens an iterable of conversation dicts into a list of row dicts.
+    start_index is the position of the first conversation in the full export
+    (used for the "unknown_<n>" fallback id when processing in chunks).
+    Returns (rows, error_logs, errored_conversations).
     """
     rows = []
     error_logs = []
     errored_conversations = set()
 
-    for conv_index, conv in enumerate(conversations):
+    for conv_index, conv in enumerate(conversations, start_index):
         conv_id = conv.get("id", f"unknown_{conv_index}")
         try:
             title = conv.get("title", "")
@@ -95,6 +96,10 @@ def flatten_all_messages_to_df(conversations, error_log_path="flat_error.txt"):
             errored_conversations.add(conv_id)
             error_logs.append(f"[Conv {conv_id}] {e}\n" + traceback.format_exc())
 
+    return rows, error_logs, errored_conversations
+
+def write_error_log(error_log_path, error_logs, errored_conversations):
+    """Write flattening errors (if any) to error_log_path."""
     if error_logs:
         with open(error_log_path, "w", encoding="utf-8") as f:
             f.write(f"Total errors: {len(error_logs)}\nErrored IDs:\n")
@@ -103,9 +108,24 @@ def flatten_all_messages_to_df(conversations, error_log_path="flat_error.txt"):
             f.writelines(error_logs)
         print(f"⚠️  {len(error_logs)} errors written to {error_log_path}")
 
+def rows_to_df(rows):
+    """Build the flattened DataFrame from row dicts in COLUMN_ORDER."""
+    if not rows:
+        return pd.DataFrame(columns=COLUMN_ORDER)
     df = pd.DataFrame(rows)
     # Only keep columns that exist in df (to avoid KeyErrors if not all columns present)
-    df = df[[c for c in COLUMN_ORDER if c in df.columns]]
+    return df[[c for c in COLUMN_ORDER if c in df.columns]]
+
+def flatten_all_messages_to_df(conversations, error_log_path="flat_error.txt"):
+    """
+    Flattens a list of conversation dicts into a pandas DataFrame.
+    Returns (DataFrame, error_count, error_conversation_count).
+    Writes errors to error_log_path.
+    """
+    rows, error_logs, errored_conversations = flatten_conversations(conversations)
+    write_error_log(error_log_path, error_logs, errored_conversations)
+
+    df = rows_to_df(rows)
     print(f"✅ Flattened {len(df)} messages from {len(conversations)} conversations")
     return df, len(error_logs), len(errored_conversations)
 
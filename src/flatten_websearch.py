@@ -140,7 +140,7 @@ def extract_flattened_data(conversations):
         if (conv_idx + 1) % 100 == 0 or conv_idx == len(conversations) - 1:
             print(f"  Processed {conv_idx + 1} / {len(conversations)} conversations for web/thought/code extraction")
 
-    df = pd.DataFrame(rows)
+    df = pd.DataFrame(rows, columns=COLUMN_ORDER) if not rows else pd.DataFrame(rows)
     df = df[[c for c in COLUMN_ORDER if c in df.columns]]
     print(f"✅ Extracted {len(df)} web/thought/code rows")
     return df
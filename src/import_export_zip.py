@@ -4,14 +4,13 @@ import zipfile
 import shutil
 from datetime import datetime
 
-def prepare_export_and_load_conversations(base_dir, zip_path):
+def extract_export(base_dir, zip_path):
     """
-    1. Prompt for a complete directory to the ChatGPT export zip file.
+    1. Check the path to the ChatGPT export zip file.
     2. Build the 'data' directory (if missing) in the same location as main.py.
     3. Decompress the zip, rename the decompressed folder as 'chatgpt-YYYYMMDD-HHMM'.
     4. Copy/move the decompressed contents into 'data'.
-    5. Load conversations.json.
-    Returns: conversations (list), folder (str)
+    Returns: folder (str), relative to data/
     """
     if not os.path.isfile(zip_path):
         raise FileNotFoundError(f"ZIP file does not exist: {zip_path}")
@@ -84,10 +83,12 @@ def prepare_export_and_load_conversations(base_dir, zip_path):
     # 7. Clean up temp dir
     shutil.rmtree(temp_dir)
 
-    # 8. Load conversations.json from the new location
-    json_path = os.path.join(target_folder, "conversations.json")
+    return folder_name
+
+def load_conversations(json_path):
+    """Load conversations.json of an extracted export. Returns: conversations (list)"""
     if not os.path.isfile(json_path):
-        raise FileNotFoundError(f"❌ conversations.json not found in {target_folder}")
+        raise FileNotFoundError(f"❌ conversations.json not found: {json_path}")
     with open(json_path, "r", encoding="utf-8") as f:
         conversations = json.load(f)
     print(f"✅ Loaded {len(conversations)} conversations from {json_path}")
@@ -97,6 +98,73 @@ def prepare_export_and_load_conversations(base_dir, zip_path):
         print(f"🔎 First conversation title: {conversations[0].get('title', '<no title>')}")
     else:
         print("⚠️ No conversations loaded.")
+    return conversations
+
+def prepare_export_and_load_conversations(base_dir, zip_path):
+    """
+    Extract the export zip into data/ (see extract_export) and load conversations.json.
+    Returns: conversations (list), folder (str)
+    """
+    folder_name = extract_export(base_dir, zip_path)
+
+    # 8. Load conversations.json from the new location
+    conversations = load_conversations(os.path.join(base_dir, "data", folder_name, "conversations.json"))
 
     # Return conversations and folder name for further steps
     return conversations, folder_name
+
+def iter_conversations(json_path, read_size=1 << 20, with_text=False):
+    """
+    Stream the conversations of a conversations.json file (a top-level JSON array)
+    one at a time instead of json.load()-ing the whole export.
+    Yields (conversation dict, size of its JSON text in characters), plus the JSON
+    text itself if with_text (e.g. to fingerprint the conversation).
+    """
+    decoder = json.JSONDecoder()
+    with open(json_path, "r", encoding="utf-8") as f:
+        buf, pos, eof = "", 0, False
+
+        def fill(size=read_size):
+            nonlocal buf, pos, eof
+            chunk = f.read(size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        skip_ws()
+        if pos >= len(buf) or buf[pos] != "[":
+            raise ValueError(f"❌ {json_path} is not a JSON array of conversations")
+        pos += 1
+
+        while True:
+            skip_ws()
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            if pos < len(buf) and buf[pos] == ",":
+                pos += 1
+                skip_ws()
+            if pos >= len(buf):
+                raise ValueError(f"❌ Unexpected end of {json_path}")
+            try:
+                conv, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Incomplete conversation: at least double the pending text before retrying
+                fill(max(read_size, len(buf) - pos))
+                continue
+            if with_text:
+                yield conv, end - pos, buf[pos:end]
+            else:
+                yield conv, end - pos
+            pos = end
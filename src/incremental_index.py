@@ -0,0 +1,157 @@
+"""
+Per-user index of already processed conversations, for incremental runs on repeat exports.
+
+Conversations are processed in segments (conversation-aligned chunks of the streaming
+pipeline). Each segment keeps its stage files (flattened rows, merged/filled tables,
+token counts, emulated costs) and its aggregate cube in <index dir>/<segment>/, and the
+index records, per segment, the ordered (conversation_id, fingerprint, update_time) of
+its conversations plus its flatten error logs.
+
+Reuse is per conversation: a later export in which a conversation appears again with the
+same id and fingerprint doesn't flatten, tokenize or emulate it again. When all of a
+segment's conversations reappear unchanged and in the same order, the segment is reused
+as it is; when only some of them do (others changed, were deleted or moved), their rows
+are cut out of the segment's files into a new segment (see
+streaming_pipeline.extract_chunk), and only the changed and new conversations are processed.
+
+    <cache>/incremental/<user id>/index.json
+    <cache>/incremental/<user id>/seg_000000/ ...
+"""
+import hashlib
+import json
+import os
+import pickle
+import re
+import shutil
+from stage_cache import pipeline_fingerprint
+
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+
+# "[Conversation <id>] ..." / "[Conv <id>] ..." / "[Conv <id> - Node <id>] ..." (flatten_messages)
+_LOG_CONVERSATION = re.compile(r"\[Conv(?:ersation)? (.*?)(?:\]| - Node )")
+
+def conversation_key(conv, text):
+    """(conversation_id or None, fingerprint of its JSON text, update_time) of one conversation."""
+    conv_id = conv.get("id") if isinstance(conv, dict) else None
+    fingerprint = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+    update_time = conv.get("update_time") if isinstance(conv, dict) else None
+    return [conv_id, fingerprint, update_time]
+
+def export_user_id(export_dir):
+    """User id of an extracted export (from user.json), safe as a folder name; "default" if unknown."""
+    try:
+        with open(os.path.join(export_dir, "user.json"), encoding="utf-8") as f:
+            user_id = json.load(f).get("id")
+    except (OSError, ValueError, AttributeError):
+        user_id = None
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", str(user_id)) if user_id else "default"
+
+def run_parameters(token_count_mode, price_table, buffer_tokens):
+    """
+    Settings and code the cached outputs depend on; any change (including an upgrade of
+    the pipeline code or its libraries, see stage_cache.pipeline_fingerprint) invalidates
+    the whole index.
+    """
+    prices = hashlib.sha256(pickle.dumps((
+        price_table.models, price_table.input.tolist(), price_table.output.tolist(),
+        price_table.changes.tolist()
+    ), protocol=4)).hexdigest()
+    return {"version": INDEX_VERSION, "code": pipeline_fingerprint(), "token_count_mode": token_count_mode,
+            "prices": prices, "buffer_tokens": buffer_tokens}
+
+class IncrementalIndex:
+    """
+    The segments of one user's previous run (see module docstring).
+
+    Segments written by a run that did not finish (not in index.json) and segments
+    not used again by the next run are deleted, so the folder only ever holds one
+    run's worth of outputs.
+    """
+
+    def __init__(self, root, params):
+        self.root = str(root)
+        self.params = params
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            with open(os.path.join(self.root, INDEX_FILE), encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        if index.get("params") != params:
+            if index:
+                print(f"♻️ Incremental index {self.root}: settings changed, starting over")
+            index = {}
+        self.segments = index.get("segments", {})
+        self.counter = index.get("counter", 0)
+        self.used = set()
+
+        # Leftovers of an interrupted run
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and entry.name not in self.segments:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+        # Conversation lookup: (conversation_id, fingerprint) → (segment, position in it)
+        self.conversations = {
+            tuple(key[:2]): (name, position)
+            for name, seg in self.segments.items()
+            for position, key in enumerate(seg["conversations"])
+        }
+
+    def segment_dir(self, name):
+        return os.path.join(self.root, name)
+
+    def find(self, key):
+        """(segment, position) holding this conversation unchanged, or None."""
+        return self.conversations.get(tuple(key[:2])) if key[0] is not None else None
+
+    def covers(self, name, keys):
+        """True if keys are all of the segment's conversations, in order."""
+        return [k[:2] for k in keys] == [k[:2] for k in self.segments[name]["conversations"]]
+
+    def reuse(self, name):
+        """Mark a segment as part of this run; returns its (error logs, errored ids)."""
+        self.used.add(name)
+        seg = self.segments[name]
+        return seg["error_logs"], set(seg["errored"])
+
+    def errors_of(self, name, conversation_ids):
+        """(error logs, errored ids) of some of a segment's conversations, for a segment cut out of it."""
+        seg = self.segments[name]
+        logs = []
+        for log in seg["error_logs"]:
+            match = _LOG_CONVERSATION.match(log)
+            if match and match.group(1) in conversation_ids:
+                logs.append(log)
+        return logs, set(seg["errored"]) & set(conversation_ids)
+
+    def new_segment(self):
+        """Name of a fresh, empty segment folder for this run."""
+        name = f"seg_{self.counter:06d}"
+        self.counter += 1
+        return name
+
+    def add(self, name, keys, error_logs, errored):
+        """Record a segment processed in this run. Conversations without an id make it non-reusable."""
+        self.used.add(name)
+        if any(k[0] is None for k in keys):
+            return
+        self.segments[name] = {
+            "conversations": keys, "error_logs": list(error_logs), "errored": sorted(errored)
+        }
+
+    def save(self):
+        """Drop segments this run did not use and write index.json atomically."""
+        for name in list(self.segments):
+            if name not in self.used:
+                del self.segments[name]
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and entry.name not in self.segments:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+        tmp = os.path.join(self.root, INDEX_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"params": self.params, "counter": self.counter, "segments": self.segments}, f)
+        os.replace(tmp, os.path.join(self.root, INDEX_FILE))
+        n = sum(len(seg["conversations"]) for seg in self.segments.values())
+        print(f"✅ Saved incremental index: {len(self.segments)} segments, {n} conversations")
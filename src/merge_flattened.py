@@ -1,21 +1,54 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import os
+from table_schema import read_table, report_memory, object_baseline_mb, STRING_DTYPE
+
+MISSING = {"": pd.NA, "nan": pd.NA, "<NA>": pd.NA}
+
+# === Normalize helper: "", "nan" or "<NA>" → <NA> ===
+def map_categories(series: pd.Series, fn) -> pd.Series:
+    """fn applied once per category of a categorical instead of once per row; stays categorical."""
+    mapped = np.array([fn(c) for c in series.cat.categories] + [pd.NA], dtype=object)
+    values = mapped[series.cat.codes.to_numpy()]                         # code -1 (NA) → the appended NA
+    return pd.Series(values, index=series.index, name=series.name).astype("category")
+
+def _normalize_categorical(series: pd.Series) -> pd.Series:
+    """normalize_missing for a categorical: strip and map the categories, not every row."""
+    categories = pd.Series(series.cat.categories.astype(str))
+    cleaned = categories.str.strip().replace(MISSING)
+    if cleaned.equals(categories):
+        return series
+    return map_categories(series, lambda c: MISSING.get(str(c).strip(), str(c).strip()))
 
-# === Normalize helper: "" or "nan" → <NA> ===
 def normalize_missing(df: pd.DataFrame) -> pd.DataFrame:
-    """Convert empty string and 'nan' to <NA> for all object columns."""
+    """Convert empty string, 'nan' and stringified <NA> to <NA> for all object/string/categorical columns."""
     df = df.copy()
     for col in df.columns:
-        if df[col].dtype == object:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = _normalize_categorical(df[col])
+        elif df[col].dtype == object:
             df[col] = (
                 df[col]
                   .astype(str)
+                  .str.strip()
+                  .replace(MISSING)
+            )
+        elif pd.api.types.is_string_dtype(df[col].dtype):
+            df[col] = (
+                df[col]
                   .str.strip()
                   .replace({"": pd.NA, "nan": pd.NA})
             )
     return df
 
+def string_lengths(series: pd.Series) -> np.ndarray:
+    """Length of each value as a string, -1 where missing (per category for categoricals)."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        lengths = np.append(series.cat.categories.astype(str).str.len().to_numpy(dtype=np.int64), -1)
+        return lengths[series.cat.codes.to_numpy()]
+    return series.astype(STRING_DTYPE).str.len().fillna(-1).to_numpy(dtype=np.int64)
+
 # === Dedupe each DF on message_id by the longest non-null string per column ===
 def choose_longest(series: pd.Series):
     """Return longest non-null string from a Series, or <NA> if all NA."""
@@ -25,8 +58,21 @@ def choose_longest(series: pd.Series):
     return max(non_null, key=len)
 
 def dedupe_on_message_id(df: pd.DataFrame) -> pd.DataFrame:
-    """Deduplicate on message_id by taking longest string per column."""
-    return df.groupby("message_id", as_index=False).agg(choose_longest)
+    """
+    Deduplicate on message_id by taking the longest string per column (the first one on
+    ties, as choose_longest), sorted by message_id. Each column keeps its dtype: the
+    longest value is picked by row position, so categoricals are never expanded.
+    """
+    df = df[df["message_id"].notna()].reset_index(drop=True)
+    if not df["message_id"].duplicated().any():
+        return df.sort_values("message_id", kind="stable", ignore_index=True)
+    groups = df.groupby("message_id", sort=True).ngroup().to_numpy()
+    first = pd.Series(np.arange(len(df))).groupby(groups, sort=True).first().to_numpy()
+    out = {"message_id": df["message_id"].iloc[first].reset_index(drop=True)}
+    for col in df.columns.drop("message_id"):
+        picked = pd.Series(string_lengths(df[col])).groupby(groups, sort=True).idxmax().to_numpy()
+        out[col] = df[col].iloc[picked].reset_index(drop=True)
+    return pd.DataFrame(out)[df.columns]
 
 # === Choose longer/non-null value for merging ===
 def choose_better(v1, v2):
@@ -35,11 +81,24 @@ def choose_better(v1, v2):
     if pd.isna(v2): return v1
     return v1 if len(str(v1)) >= len(str(v2)) else v2
 
+def pick_better(s1: pd.Series, s2: pd.Series) -> pd.Series:
+    """choose_better on two aligned columns, vectorized; categoricals stay categorical."""
+    take_right = string_lengths(s2) > string_lengths(s1)
+    take_right |= s1.isna().to_numpy()
+    if isinstance(s1.dtype, pd.CategoricalDtype) and isinstance(s2.dtype, pd.CategoricalDtype):
+        categories = s1.cat.categories.union(s2.cat.categories)
+        codes = np.where(take_right,
+                         s2.cat.set_categories(categories).cat.codes.to_numpy(),
+                         s1.cat.set_categories(categories).cat.codes.to_numpy())
+        return pd.Series(pd.Categorical.from_codes(codes, categories), index=s1.index)
+    s1, s2 = s1.astype(STRING_DTYPE), s2.astype(STRING_DTYPE)
+    return s1.where(~take_right, s2)
+
 # === Robust merge_two: outer-merge and resolve overlaps ===
 def merge_two(left: pd.DataFrame, right: pd.DataFrame) -> pd.DataFrame:
     """
-    Outer-merge two DataFrames and resolve column conflicts using choose_better.
-    Handles missing columns gracefully.
+    Outer-merge two DataFrames and resolve column conflicts using choose_better
+    (vectorized in pick_better). Handles missing columns gracefully.
     """
     merged = pd.merge(left, right, on="message_id", how="outer",
                       suffixes=("_1", "_2"))
@@ -52,10 +111,7 @@ def merge_two(left: pd.DataFrame, right: pd.DataFrame) -> pd.DataFrame:
         c1, c2 = f"{col}_1", f"{col}_2"
         if col in left.columns and col in right.columns:
             # If both have this col, pick the longer value
-            out[col] = merged.apply(
-                lambda row: choose_better(row.get(c1), row.get(c2)),
-                axis=1
-            )
+            out[col] = pick_better(merged[c1], merged[c2])
         elif col in left.columns:
             out[col] = merged[c1] if c1 in merged.columns else pd.NA
         elif col in right.columns:
@@ -82,11 +138,15 @@ def safe_format_ts(v):
 def merge_all(csv1, csv2, csv3, output_csv, show_df=True):
     """
     Merge three flattened CSVs (main, websearch, images) into a single DataFrame and write to disk.
+
+    The sources are loaded with the shared schema (table_schema.read_table) and stay in it
+    through dedupe and merge: the low-cardinality columns are categoricals from the start,
+    and only the per-message text columns are strings.
     """
     print("🔄 Loading CSVs...")
-    df1 = pd.read_csv(csv1, dtype=str)
-    df2 = pd.read_csv(csv2, dtype=str)
-    df3 = pd.read_csv(csv3, dtype=str)
+    df1 = read_table(csv1)
+    df2 = read_table(csv2)
+    df3 = read_table(csv3)
     print("  - Loaded all sources.")
 
     df1 = dedupe_on_message_id(normalize_missing(df1))
@@ -111,13 +171,21 @@ def merge_all(csv1, csv2, csv3, output_csv, show_df=True):
             result[col] = pd.NA
     result = result[final_order]
 
-    # Timestamp formatting
+    # Timestamp formatting (once per distinct value for the categorical conversation times)
     for tc in ["conversation_create_time", "create_time", "update_time"]:
-        result[tc] = result[tc].map(safe_format_ts)
+        if isinstance(result[tc].dtype, pd.CategoricalDtype):
+            result[tc] = map_categories(result[tc], safe_format_ts)
+        else:
+            result[tc] = result[tc].map(safe_format_ts).astype(STRING_DTYPE)
 
     # Sort, clean, and save
-    result = result.sort_values("conversation_create_time", ascending=False, ignore_index=True)
-    result.replace("nan", pd.NA, inplace=True)
+    # (stable, so ties keep the message_id order of the outer merges → deterministic output;
+    # by value, not by category order)
+    result = result.sort_values("conversation_create_time", ascending=False, kind="stable", ignore_index=True,
+                                key=lambda s: s.astype(object))
+    strings = [c for c in result.columns if not isinstance(result[c].dtype, pd.CategoricalDtype)]
+    result[strings] = result[strings].replace("nan", pd.NA)
+    report_memory(result, "merge_all", baseline_mb=object_baseline_mb(result))
     result.to_csv(output_csv, index=False, encoding="utf-8-sig")
     print(f"✅ Merged {len(result)} rows into {output_csv}")
 
@@ -0,0 +1,100 @@
+"""
+Process-parallel tree emulation (see emulate_input_tokens(..., workers=N)).
+
+Conversations are independent, so they are split into shards balanced by total token
+volume (longest-processing-time first: biggest conversation to the lightest shard), and
+each shard runs tree_window_costs in a worker process. The per-row arrays are placed in
+shared memory once; workers attach to them by name, write their prompt sizes into a
+shared output array and only return the (small) branch lists. Results are therefore in
+the original row order without any merge step.
+"""
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from emulate_api_chat_costs import tree_window_costs
+from pipeline_dag import process_context
+
+def balanced_shards(weights, n_shards):
+    """
+    Greedy LPT partition of items into n_shards lists with near-equal weight sums.
+    Returns lists of item indexes (ascending within a shard); empty shards are dropped.
+    """
+    heap = [(0, k) for k in range(max(1, n_shards))]
+    shards = [[] for _ in heap]
+    for item in np.argsort(-np.asarray(weights), kind='stable'):
+        load, k = heapq.heappop(heap)
+        shards[k].append(int(item))
+        heapq.heappush(heap, (load + int(weights[item]), k))
+    return [sorted(s) for s in shards if s]
+
+def _share(arrays):
+    """Copy arrays into new shared memory blocks; returns (blocks, [(name, shape, dtype)])."""
+    blocks, specs = [], []
+    for a in arrays:
+        block = shared_memory.SharedMemory(create=True, size=max(1, a.nbytes))
+        np.ndarray(a.shape, a.dtype, buffer=block.buf)[...] = a
+        blocks.append(block)
+        specs.append((block.name, a.shape, a.dtype.str))
+    return blocks, specs
+
+def _emulate_shard(specs, bounds, buffer_tokens):
+    """
+    Worker: attach the shared arrays and emulate the conversations [a, b) of bounds.
+    Writes api_input_tokens in place; returns {conversation start: branch tuples}.
+    """
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    try:
+        (parent, tokens, windows, input_tokens, output_tokens, price_in, price_out, api_in) = [
+            np.ndarray(shape, dtype, buffer=block.buf) for block, (_, shape, dtype) in zip(blocks, specs)
+        ]
+        branches = {}
+        for a, b in bounds:
+            rows = np.arange(a, b)
+            api_in[a:b], branches[a] = tree_window_costs(
+                rows, parent[a:b], tokens[a:b], windows[a:b], input_tokens[a:b], output_tokens[a:b],
+                price_in[a:b], price_out[a:b], buffer_tokens
+            )
+        del parent, tokens, windows, input_tokens, output_tokens, price_in, price_out, api_in
+        return branches
+    finally:
+        for block in blocks:
+            block.close()
+
+def parallel_tree_input_tokens(parent, tokens, windows, input_tokens, output_tokens, price_in, price_out,
+                               first_row, buffer_tokens, workers):
+    """
+    tree_window_costs over every conversation of the conversation-grouped arrays, on a
+    pool of `workers` processes. parent holds grouped parent positions (-1 for roots).
+
+    Returns:
+        (np.ndarray api_input_tokens in grouped order,
+         branch tuples in conversation order with grouped positions as leaves)
+    """
+    m = len(tokens)
+    bounds = np.c_[first_row, np.r_[first_row[1:], m]] if len(first_row) else np.zeros((0, 2), dtype=np.int64)
+    volume = np.add.reduceat(tokens, first_row) + (bounds[:, 1] - bounds[:, 0]) if m else np.zeros(0)
+    shards = balanced_shards(volume, workers)
+
+    arrays = [
+        np.ascontiguousarray(parent, dtype=np.int64), np.ascontiguousarray(tokens, dtype=np.int64),
+        np.ascontiguousarray(windows, dtype=np.int64), np.ascontiguousarray(input_tokens, dtype=np.int64),
+        np.ascontiguousarray(output_tokens, dtype=np.int64), np.ascontiguousarray(price_in, dtype=np.float64),
+        np.ascontiguousarray(price_out, dtype=np.float64), np.zeros(m, dtype=np.int64),
+    ]
+    blocks, specs = _share(arrays)
+    try:
+        branches = {}
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards)) or 1, mp_context=process_context()) as pool:
+            futures = [pool.submit(_emulate_shard, specs, [tuple(bounds[c]) for c in shard], buffer_tokens)
+                       for shard in shards]
+            for future in futures:
+                branches.update(future.result())
+        api_in = np.ndarray(m, np.int64, buffer=blocks[-1].buf).copy()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    branch_rows = [(a + leaf, *rest) for a in sorted(branches) for leaf, *rest in branches[a]]
+    return api_in, branch_rows
@@ -0,0 +1,236 @@
+"""
+Pipeline stages as a declared dependency graph, run with as much overlap as it allows.
+
+Each stage names the stages it depends on; a stage starts as soon as all of them have
+finished and a scheduler slot is free. Thread stages run in the pipeline process and
+get the results of their dependencies. Process stages are picklable callables (e.g. a
+functools.partial of a module-level function) run without arguments in a child
+process; they suit GIL-bound work that reads and writes files.
+
+Forking a process while other threads run is unsafe (a lock another thread held at
+that moment, e.g. an import lock, stays held in the child forever), so process stages
+and the pools the stages start (plot rendering, parallel emulation) use
+process_context(): children forked from a single-threaded fork server.
+
+With a StageCache (stage_cache.py), a stage declared with cache=CachedStage(...) is
+restored from its cache entry when its inputs are unchanged instead of being run, so a
+retried run picks up at the first stage whose inputs changed. With an ArtifactSink
+(artifact_sink.py) the cache entries are written by its writers once the stage's
+background writes have landed, off the stages' critical path.
+
+After a run, timings() has every stage's start/end and critical_path() the chain of
+dependent stages that set the total wall time.
+
+    dag = PipelineDAG()
+    dag.add("load", lambda r: load_conversations(path))
+    dag.add("survey", lambda r: survey_conversation_keys(r["load"]), deps=["load"])
+    dag.add("what_if", partial(what_if_scenarios, scenarios), deps=["load"], process=True)
+    results = dag.run(workers=4)
+"""
+import multiprocessing as mp
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+
+DEFAULT_WORKERS = 4
+TIMINGS_CSV = "pipeline_stages.csv"
+
+# Imported once by the fork server, so its children start warm
+FORKSERVER_PRELOAD = ["pandas", "matplotlib.figure", "plot_render", "parallel_emulation"]
+
+Stage = namedtuple("Stage", ["name", "fn", "deps", "process", "keep_result", "cache"])
+
+def process_context():
+    """multiprocessing context for processes started while other threads may be running."""
+    ctx = mp.get_context("forkserver")
+    ctx.set_forkserver_preload(FORKSERVER_PRELOAD)
+    return ctx
+
+class StageError(RuntimeError):
+    """A stage raised; carries the stage name and, for process stages, the child's traceback."""
+
+    def __init__(self, stage, message):
+        super().__init__(f"stage '{stage}' failed: {message}")
+        self.stage = stage
+
+def _child(fn, keep_result, conn):
+    """Body of a process stage: run fn(), send back ("ok", result) or ("error", traceback)."""
+    try:
+        result = fn()
+        conn.send(("ok", result if keep_result else None))
+    except BaseException as e:
+        conn.send(("error", f"{type(e).__name__}: {e}\n{traceback.format_exc()}"))
+    finally:
+        conn.close()
+
+class PipelineDAG:
+    """Stages with dependencies, their results and timings (see module docstring)."""
+
+    def __init__(self, cache=None, sink=None):
+        self.cache = cache
+        self.sink = sink
+        self.stages = {}
+        self.results = {}
+        self.keys = {}
+        self.reused = set()
+        self.started = {}
+        self.finished = {}
+
+    def add(self, name, fn, deps=(), process=False, keep_result=True, cache=None):
+        """
+        Declare a stage. A thread stage's fn(results) gets {dependency name: its result};
+        a process stage's fn is picklable and called without arguments (its inputs are
+        files or bound in), and its result must be picklable. keep_result=False drops the
+        return value (None to the dependents), e.g. for a stage that returns a big table
+        but whose output that matters is a file. cache: a CachedStage naming the output
+        files, the input files read outside its cached dependencies and any parameters;
+        the stage is then skipped when the DAG's StageCache has its outputs.
+        """
+        if name in self.stages:
+            raise ValueError(f"duplicate stage: {name}")
+        missing = [d for d in deps if d not in self.stages]
+        if missing:
+            raise ValueError(f"stage '{name}' depends on undeclared stage(s): {', '.join(missing)}")
+        self.stages[name] = Stage(name, fn, tuple(deps), process, keep_result, cache)
+
+    def _run_stage(self, stage):
+        self.started[stage.name] = time.perf_counter()
+        try:
+            key = None
+            if self.cache is not None and stage.cache is not None:
+                key = self.keys[stage.name] = self.cache.key(stage.name, stage.cache, self._dep_keys(stage.deps))
+                hit, result = self.cache.load(key, stage.cache.outputs)
+                if hit:
+                    print(f"♻️ Stage {stage.name}: reused cached outputs ({key[:12]})")
+                    self.reused.add(stage.name)
+                    return result
+            result = self._execute(stage)
+            if key is not None:
+                self._save(key, stage, result)
+            return result
+        finally:
+            self.finished[stage.name] = time.perf_counter()
+
+    def _dep_keys(self, deps):
+        """
+        What a stage's cache key chains through: a cached dependency's key, or for an
+        uncached one its name and, recursively, the keys of its own dependencies.
+        """
+        keys = []
+        for d in deps:
+            if d in self.keys:
+                keys.append(self.keys[d])
+            else:
+                keys.append(f"stage:{d}")
+                keys += self._dep_keys(self.stages[d].deps)
+        return keys
+
+    def _save(self, key, stage, result):
+        if self.sink is None:
+            self.cache.save(key, stage.name, stage.cache.outputs, result)
+            return
+
+        def save():
+            self.sink.wait(stage.cache.outputs)
+            self.cache.save(key, stage.name, stage.cache.outputs, result)
+        self.sink.call(save, label=f"stage cache entry of '{stage.name}'")
+
+    def _execute(self, stage):
+        if not stage.process:
+            result = stage.fn({d: self.results[d] for d in stage.deps})
+            return result if stage.keep_result else None
+        ctx = process_context()
+        receiver, sender = ctx.Pipe(duplex=False)
+        child = ctx.Process(target=_child, args=(stage.fn, stage.keep_result, sender),
+                            name=f"stage-{stage.name}")
+        child.start()
+        sender.close()
+        try:
+            status, payload = receiver.recv()
+        except EOFError:
+            child.join()
+            raise StageError(stage.name, f"process exited with code {child.exitcode}")
+        child.join()
+        if status == "error":
+            raise StageError(stage.name, payload)
+        return payload
+
+    def run(self, workers=DEFAULT_WORKERS):
+        """
+        Run every stage, up to `workers` at a time, each once its dependencies are done.
+        Stops starting new stages after the first failure, waits for the running ones
+        and raises that failure. Returns {stage name: result}.
+        """
+        self.t0 = time.perf_counter()
+        pending = dict(self.stages)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="stage") as pool:
+            while pending or running:
+                if error is None:
+                    for name in list(pending):                 # declaration order among ready stages
+                        if len(running) >= max(1, workers):
+                            break
+                        if all(d in self.results for d in pending[name].deps):
+                            running[pool.submit(self._run_stage, pending.pop(name))] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        if error is None and isinstance(e, StageError):
+                            error = e
+                        elif error is None:
+                            error = StageError(name, f"{type(e).__name__}: {e}")
+                            error.__cause__ = e
+        if error is not None:
+            raise error
+        return self.results
+
+    # --- Timings ---
+    def critical_path(self):
+        """
+        (seconds, [stage names]) of the chain that set the run's wall time: from the last
+        stage to finish, back through the dependency each stage waited for longest.
+        """
+        chains = {}
+        for name, stage in self.stages.items():                    # declaration order is topological
+            if name not in self.finished:
+                continue
+            gate = max((d for d in stage.deps if d in chains), key=self.finished.get, default=None)
+            chains[name] = (chains[gate] if gate is not None else []) + [name]
+        if not chains:
+            return 0.0, []
+        path = chains[max(chains, key=self.finished.get)]
+        return sum(self.finished[n] - self.started[n] for n in path), path
+
+    def timings(self):
+        """Per-stage start, end and wall time (seconds since run()), critical path flagged."""
+        _, path = self.critical_path()
+        rows = [{
+            "stage": name,
+            "depends_on": " ".join(stage.deps),
+            "kind": "process" if stage.process else "thread",
+            "cached": name in self.reused,
+            "start_s": round(self.started[name] - self.t0, 3),
+            "end_s": round(self.finished[name] - self.t0, 3),
+            "wall_s": round(self.finished[name] - self.started[name], 3),
+            "critical_path": name in path,
+        } for name, stage in self.stages.items() if name in self.finished]
+        return pd.DataFrame(rows, columns=["stage", "depends_on", "kind", "cached", "start_s", "end_s", "wall_s", "critical_path"])
+
+    def report(self, output_csv=None):
+        """Print the stage timings; optionally save them as CSV."""
+        table = self.timings()
+        total = max(self.finished.values(), default=self.t0) - self.t0
+        print(f"⏱️ Stage timings (wall time {total:.1f}s):")
+        print(table.to_string(index=False))
+        if output_csv is not None:
+            table.to_csv(output_csv, index=False, encoding="utf-8-sig")
+        return table
@@ -1,129 +1,49 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
-from matplotlib import cm
 import os
-
-# --- 0) Set up paths and output directory ---
-DATA_DIR = "data"
-MSG_CSV = os.path.join(DATA_DIR, "merged_conversations_filled.csv")
-TOK_CSV = os.path.join(DATA_DIR, "token_counts.csv")
-
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
-
-def plot_monthly_summary(merged_csv_path="data/merged_conversations_filled.csv", output_dir="data"):
-
-    # === 1. Monthly message and conversation plots ===
-    msg_df = pd.read_csv(MSG_CSV, dtype=str)
-
-    # Unique conversation and message counts
-    unique_conversations = msg_df['conversation_id'].nunique()
-    unique_messages = msg_df['message_id'].nunique()
-    print(f"Number of unique conversation_id: {unique_conversations}")
-    print(f"Number of unique message_id: {unique_messages}")
-
-    # Parse datetime columns
-    msg_df['conversation_create_time'] = pd.to_datetime(
-        msg_df['conversation_create_time'],
-        format='%Y%m%d_%H%M%S.%f',
-        errors='coerce'
-    )
-    msg_df['create_time'] = pd.to_datetime(
-        msg_df['create_time'],
-        format='%Y%m%d_%H%M%S.%f',
-        errors='coerce'
-    )
-
-    # Monthly aggregates
-    conv_df = msg_df[['conversation_id', 'conversation_create_time']].drop_duplicates()
-    conv_df['month'] = conv_df['conversation_create_time'].dt.to_period('M')
-    monthly_conversations = conv_df.groupby('month').size()
-    msg_df['month'] = msg_df['create_time'].dt.to_period('M')
-    monthly_messages = msg_df.groupby('month').size()
-    monthly_ratio = (monthly_messages / monthly_conversations).fillna(0)
-
-    # Plot monthly conversations
-    fig1 = plt.figure(figsize=(10, 5))
-    plt.bar(monthly_conversations.index.astype(str), monthly_conversations.values)
-    plt.title('Historical Monthly Conversation Count')
-    plt.xlabel('Month')
-    plt.ylabel('Number of Conversations')
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-    plt.savefig(os.path.join(DATA_DIR, "monthly_conversations.png"), bbox_inches='tight')
-    plt.close(fig1)
-    print(f"✅ Saved: {os.path.join(DATA_DIR, 'monthly_conversations.png')}")
-
-    # Plot monthly messages
-    fig2 = plt.figure(figsize=(10, 5))
-    plt.bar(monthly_messages.index.astype(str), monthly_messages.values)
-    plt.title('Historical Monthly Message Count')
-    plt.xlabel('Month')
-    plt.ylabel('Number of Messages')
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-    plt.savefig(os.path.join(DATA_DIR, "monthly_messages.png"), bbox_inches='tight')
-    plt.close(fig2)
-    print(f"✅ Saved: {os.path.join(DATA_DIR, 'monthly_messages.png')}")
-
-    # Plot monthly messages per conversation
-    fig3 = plt.figure(figsize=(10, 5))
-    plt.bar(monthly_ratio.index.astype(str), monthly_ratio.values)
-    plt.title('Historical Monthly Messages per Conversation')
-    plt.xlabel('Month')
-    plt.ylabel('Messages per Conversation')
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-    plt.savefig(os.path.join(DATA_DIR, "monthly_messages_per_conversation.png"), bbox_inches='tight')
-    plt.close(fig3)
-    print(f"✅ Saved: {os.path.join(DATA_DIR, 'monthly_messages_per_conversation.png')}")
-
-    # === 2. Monthly token usage (input/output, stacked by model) ===
-    df = pd.read_csv(TOK_CSV, dtype=str)
-
-    # Parse date and numeric columns
-    df['conversation_create_time'] = pd.to_datetime(
-        df['conversation_create_time'],
-        format='%Y%m%d_%H%M%S.%f',
-        errors='coerce'
-    )
-    df['month'] = df['conversation_create_time'].dt.to_period('M').astype(str)
-    df['input_tokens'] = pd.to_numeric(df['input_tokens'], errors='coerce').fillna(0).astype(int)
-    df['output_tokens'] = pd.to_numeric(df['output_tokens'], errors='coerce').fillna(0).astype(int)
-
-    # Pivot tables: month x model
-    pivot_in = df.pivot_table(index='month', columns='model', values='input_tokens', aggfunc='sum', fill_value=0)
-    pivot_out = df.pivot_table(index='month', columns='model', values='output_tokens', aggfunc='sum', fill_value=0)
-    models = sorted(set(pivot_in.columns) | set(pivot_out.columns))
-    months = list(pivot_in.index)
-    x = range(len(months))
+import numpy as np
+from aggregate_cube import build_cube, metric_table, monthly_counts, monthly_token_usage
+from plot_render import FigureJob, render_figures
+
+def render_monthly_bars(months, values, title, ylabel, png_path):
+    """One bar per month (conversation / message count plots)."""
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    ax.bar(months, values)
+    ax.set_title(title)
+    ax.set_xlabel('Month')
+    ax.set_ylabel(ylabel)
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+    fig.tight_layout()
+    fig.savefig(png_path, bbox_inches='tight')
+
+def render_token_usage(months, models, tokens_in, tokens_out, png_path):
+    """Input/output token bars per month, stacked by model (tokens_*: models × months arrays)."""
+    from matplotlib.figure import Figure
+    import matplotlib.ticker as mticker
+    import matplotlib
+
+    x = np.arange(len(months))
     width = 0.4
 
     # Generate colors for each model
-    cmap = cm.get_cmap('hsv', len(models))
+    cmap = matplotlib.colormaps['hsv'].resampled(len(models))
     colors = [cmap(i) for i in range(len(models))]
 
-    fig4, ax = plt.subplots(figsize=(14, 7))
-    bottom_in = [0] * len(months)
-    bottom_out = [0] * len(months)
+    # Stack bottoms: running totals of the models below
+    bottom_in = np.cumsum(tokens_in, axis=0) - tokens_in
+    bottom_out = np.cumsum(tokens_out, axis=0) - tokens_out
 
+    fig = Figure(figsize=(14, 7))
+    ax = fig.subplots()
     for i, model in enumerate(models):
-        color = colors[i]
-        vals_in = pivot_in.get(model, [0] * len(months))
-        ax.bar([xi - width/2 for xi in x], vals_in, width,
-            bottom=bottom_in, color=color, alpha=0.5)
-        bottom_in = [bot + v for bot, v in zip(bottom_in, vals_in)]
-        
-        vals_out = pivot_out.get(model, [0] * len(months))
-        ax.bar([xi + width/2 for xi in x], vals_out, width,
-            bottom=bottom_out, color=color, alpha=1.0, label=model)
-        bottom_out = [bot + v for bot, v in zip(bottom_out, vals_out)]
+        ax.bar(x - width/2, tokens_in[i], width, bottom=bottom_in[i], color=colors[i], alpha=0.5)
+        ax.bar(x + width/2, tokens_out[i], width, bottom=bottom_out[i], color=colors[i], alpha=1.0, label=model)
 
     # Y-axis formatting in millions
-    max_in = pivot_in.sum(axis=1).max()
-    max_out = pivot_out.sum(axis=1).max()
-    y_max = max(max_in, max_out) * 1.1
+    y_max = max(tokens_in.sum(axis=0).max(initial=0), tokens_out.sum(axis=0).max(initial=0)) * 1.1
     ax.set_ylim(0, y_max)
     ax.yaxis.set_major_formatter(mticker.FuncFormatter(lambda x, pos: f'{x/1e6:.1f}M'))
 
@@ -133,13 +53,63 @@ def plot_monthly_summary(merged_csv_path="data/merged_conversations_filled.csv",
     ax.set_ylabel('Token Count (Millions)')
     ax.set_title('Monthly Token Usage by Model (Input vs Output)')
     ax.legend(loc='upper left', bbox_to_anchor=(1.02, 1), frameon=False)
-    fig4.tight_layout()
-    plt.savefig(os.path.join(DATA_DIR, "monthly_token_usage_by_model.png"), bbox_inches='tight')
-    plt.close(fig4)
-    print(f"✅ Saved: {os.path.join(DATA_DIR, 'monthly_token_usage_by_model.png')}")
+    fig.tight_layout()
+    fig.savefig(png_path, bbox_inches='tight')
+
+def monthly_count_figures(cube, output_dir="data"):
+    """FigureJobs of the three monthly count plots (message metrics of the cube only)."""
+    print(f"Number of unique conversation_id: {int(metric_table(cube, 'conversations').sum())}")
+    print(f"Number of unique message_id: {int(metric_table(cube, 'distinct_messages').sum())}")
+    monthly_conversations, monthly_messages = monthly_counts(cube)
+    monthly_ratio = (monthly_messages / monthly_conversations).fillna(0)
 
-    pass
+    return [
+        FigureJob(render_monthly_bars, (
+            list(series.index.astype(str)), series.to_numpy(), title, ylabel
+        ), os.path.join(output_dir, name))
+        for series, title, ylabel, name in (
+            (monthly_conversations, 'Historical Monthly Conversation Count', 'Number of Conversations',
+             "monthly_conversations.png"),
+            (monthly_messages, 'Historical Monthly Message Count', 'Number of Messages',
+             "monthly_messages.png"),
+            (monthly_ratio, 'Historical Monthly Messages per Conversation', 'Messages per Conversation',
+             "monthly_messages_per_conversation.png"),
+        )
+    ]
+
+def token_usage_figure(cube, output_dir="data"):
+    """FigureJob of the monthly token usage plot (input/output, stacked by model)."""
+    pivot_in, pivot_out = monthly_token_usage(cube)
+    models = sorted(set(pivot_in.columns) | set(pivot_out.columns))
+    return FigureJob(render_token_usage, (
+        list(pivot_in.index), models,
+        pivot_in.reindex(columns=models, fill_value=0).to_numpy().T,
+        pivot_out.reindex(index=pivot_in.index, columns=models, fill_value=0).to_numpy().T,
+    ), os.path.join(output_dir, "monthly_token_usage_by_model.png"))
+
+def monthly_summary_figures(cube, output_dir="data"):
+    """FigureJobs of the four monthly summary plots, with their inputs read from the cube."""
+    return monthly_count_figures(cube, output_dir) + [token_usage_figure(cube, output_dir)]
+
+def plot_monthly_summary(merged_csv_path="data/merged_conversations_filled.csv", output_dir="data", cube=None,
+                         token_counts_csv=None, render=True, workers=0, cache_dir=None):
+    """
+    Monthly conversation/message counts and token usage plots, read from the aggregate
+    cube (see aggregate_cube.py). Without a cube, one is built from merged_csv_path and
+    token_counts_csv (default: token_counts.csv next to merged_csv_path).
+    Renders the figures (see plot_render.render_figures) unless render=False; returns the FigureJobs.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if cube is None:
+        if token_counts_csv is None:
+            token_counts_csv = os.path.join(os.path.dirname(str(merged_csv_path)), "token_counts.csv")
+        cube = build_cube(merged_csv_path, token_counts_csv)
+
+    jobs = monthly_summary_figures(cube, output_dir)
+    if render:
+        render_figures(jobs, workers, cache_dir)
+    return jobs
 
 if __name__ == "__main__":
     plot_monthly_summary()                # <-- keep demo call if you like
-    print("🎉 All summary plots are saved in the data/ folder!")
\ No newline at end of file
+    print("🎉 All summary plots are saved in the data/ folder!")
@@ -0,0 +1,129 @@
+"""
+Parallel, cached figure rendering.
+
+A figure is a FigureJob: a module-level render function (object-oriented matplotlib,
+Agg only, no pyplot state), its small input aggregates and the PNG path. Jobs are
+rendered one figure per worker in a process pool; a figure whose render function and
+inputs hash the same as an earlier render is copied from the plot cache instead.
+
+    render_figures(jobs, workers=0, cache_dir="cache/plots")
+"""
+import hashlib
+import inspect
+import io
+import os
+import pickle
+import shutil
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pipeline_dag import process_context
+from artifact_sink import write_bytes
+
+DEFAULT_CACHE_MAX_MB = 64
+EVICT_TARGET = 0.9          # after eviction, shrink to this fraction of max_mb
+
+FigureJob = namedtuple("FigureJob", ["render", "args", "png_path"])
+
+# matplotlib is not thread-safe: in-process renders from concurrent pipeline stages take turns
+_render_lock = threading.Lock()
+
+def figure_key(job):
+    """Content hash of a figure: render function source, its inputs and the matplotlib version."""
+    import matplotlib
+    h = hashlib.sha256()
+    h.update(matplotlib.__version__.encode())
+    h.update(f"{job.render.__module__}.{job.render.__qualname__}".encode())
+    h.update(inspect.getsource(job.render).encode())
+    h.update(pickle.dumps(job.args, protocol=4))
+    return h.hexdigest()
+
+def _render(job):
+    job.render(*job.args, job.png_path)
+    return str(job.png_path)
+
+def evict(cache_dir, max_mb=DEFAULT_CACHE_MAX_MB):
+    """
+    Delete the least recently used cached renders once cache_dir grows past max_mb.
+    Safe to run from concurrent renderers (files another one removed first are skipped).
+    """
+    entries = []
+    for e in os.scandir(cache_dir):
+        if e.is_file() and e.name.endswith(".png"):
+            try:
+                entries.append((e.stat().st_mtime, e.stat().st_size, e.path))
+            except FileNotFoundError:
+                pass
+    total = sum(size for _, size, _ in entries)
+    if total <= max_mb * 1024 * 1024:
+        return 0
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= EVICT_TARGET * max_mb * 1024 * 1024:
+            break
+        total -= size
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+def render_figures(jobs, workers=0, cache_dir=None, cache_max_mb=DEFAULT_CACHE_MAX_MB, sink=None):
+    """
+    Render every FigureJob, reusing cached renders from cache_dir when given.
+
+    Args:
+        jobs (list[FigureJob]): Figures to produce.
+        workers (int): Process pool size; 0 = one per CPU, 1 = render in-process.
+        cache_dir (str): Persistent plot cache (None disables caching).
+        cache_max_mb (int): Size cap of that cache (least recently used renders go first).
+        sink (ArtifactSink): Write in-process renders (PNG and cache copy) in the background.
+
+    Returns:
+        int: Number of figures actually rendered (cache misses).
+    """
+    pending = []
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    for job in jobs:
+        cached = os.path.join(cache_dir, figure_key(job) + ".png") if cache_dir is not None else None
+        try:
+            if cached is None:
+                raise FileNotFoundError
+            shutil.copyfile(cached, job.png_path)
+            os.utime(cached)
+            print(f"♻️ Reused cached render: {job.png_path}")
+        except FileNotFoundError:
+            pending.append((job, cached))
+
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=process_context()) as pool:
+            futures = [pool.submit(_render, job) for job, _ in pending]
+            for future in futures:
+                print(f"✅ Saved: {future.result()}")
+    else:
+        for job, cached in pending:
+            if sink is None:
+                with _render_lock:
+                    print(f"✅ Saved: {_render(job)}")
+                continue
+            # Render to memory; the sink writes the PNG (and its cache copy) while we go on
+            png = io.BytesIO()
+            with _render_lock:
+                job.render(*job.args, png)
+            write_bytes(png.getvalue(), job.png_path, sink)
+            if cached is not None:
+                write_bytes(png.getvalue(), cached, sink)
+            print(f"✅ Saved: {job.png_path}")
+
+    if cache_dir is not None and pending:
+        if workers > 1 or sink is None:
+            for job, cached in pending:
+                # Write then rename, so a concurrent reader never copies a partial render
+                tmp = f"{cached}.{os.getpid()}.tmp"
+                shutil.copyfile(job.png_path, tmp)
+                os.replace(tmp, cached)
+        evict(cache_dir, cache_max_mb)
+    return len(pending)
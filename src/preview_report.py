@@ -0,0 +1,109 @@
+"""
+Preview report: the first, approximate phase of a run, ready seconds after ingest.
+
+The export is streamed (iter_conversations) and only the main message rows are
+flattened; no merge, model fill, tokenizer or emulation. Tokens are approximated as
+content characters / CHARS_PER_TOKEN (user messages as input, everything else as
+output) and priced with the pricing engine, so the cost figure is a naive-cost
+ballpark. The outputs mirror the full report's headline files and are superseded by it:
+
+    preview_monthly_summary.csv   month, conversations, messages, approx tokens and cost
+    model_usage_frequency.csv     as written by the full pipeline (export model slugs)
+    aggregate_cube.csv            the preview's aggregate cube
+    monthly_*.png                 the monthly summary plots
+"""
+import os
+import numpy as np
+import pandas as pd
+from import_export_zip import iter_conversations
+from flatten_messages import flatten_conversations, rows_to_df
+from merge_flattened import safe_format_ts
+from fill_model_names import write_model_usage
+from aggregate_cube import (message_cube, token_cube, combine_cubes, metric_table, model_usage,
+                            write_cube, CUBE_CSV)
+from plot_monthly_summary import monthly_summary_figures
+from plot_render import render_figures
+from pricing import load_price_table
+
+PREVIEW_CSV = "preview_monthly_summary.csv"
+CHARS_PER_TOKEN = 4
+CHUNK_CONVERSATIONS = 500
+
+def preview_cube(conversations, start_index=0, price_table=None):
+    """Aggregate cube of a list of conversations, with approximate token counts and costs."""
+    rows, _, _ = flatten_conversations(conversations, start_index)
+    df = rows_to_df(rows)
+    for tc in ("conversation_create_time", "create_time"):
+        df[tc] = df[tc].map(safe_format_ts)
+    df["model"] = df["model"].replace("", np.nan).fillna("unknown")
+
+    n_chars = df["content"].fillna("").astype(str).str.len().to_numpy()
+    n_tokens = -(-n_chars // CHARS_PER_TOKEN)
+    is_user = (df["role"] == "user").to_numpy(dtype=bool)
+    tokens = pd.DataFrame({
+        "conversation_create_time": df["conversation_create_time"],
+        "model": df["model"],
+        "input_tokens": np.where(is_user, n_tokens, 0),
+        "output_tokens": np.where(is_user, 0, n_tokens),
+    })
+    return combine_cubes([message_cube(df), token_cube(tokens, df["role"].fillna(""), price_table)])
+
+def monthly_preview(cube):
+    """Monthly conversations, messages, approximate tokens and cost (months with a date)."""
+    columns = {
+        "conversations": metric_table(cube, "conversations"),
+        "messages": metric_table(cube, "messages"),
+        "approx_input_tokens": metric_table(cube, "input_tokens"),
+        "approx_output_tokens": metric_table(cube, "output_tokens"),
+        "approx_cost": metric_table(cube, "naive_input_cost") + metric_table(cube, "naive_output_cost"),
+    }
+    table = pd.DataFrame(columns).fillna(0).rename_axis("month")
+    table = table[table.index != "NaT"]
+    for column in ("conversations", "messages", "approx_input_tokens", "approx_output_tokens"):
+        table[column] = table[column].astype(np.int64)
+    return table.reset_index()
+
+def preview_report(json_path, output_dir, price_table=None, workers=0, cache_dir=None):
+    """
+    Write the preview report of conversations.json to output_dir (see module docstring).
+
+    Args:
+        json_path (str): conversations.json of the extracted export.
+        output_dir (str): Folder for the preview files (created if missing).
+        price_table (PriceTable): Rates for the approximate cost (default: load_price_table()).
+        workers, cache_dir: Plot rendering, as in plot_render.render_figures.
+
+    Returns:
+        DataFrame: The monthly preview table (as in preview_monthly_summary.csv).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    price_table = price_table or load_price_table()
+    parts, chunk, start = [], [], 0
+    for conv, _ in iter_conversations(json_path):
+        chunk.append(conv)
+        if len(chunk) >= CHUNK_CONVERSATIONS:
+            parts.append(preview_cube(chunk, start, price_table))
+            start += len(chunk)
+            chunk = []
+    if chunk or not parts:
+        parts.append(preview_cube(chunk, start, price_table))
+    cube = combine_cubes(parts)
+    write_cube(cube, os.path.join(output_dir, CUBE_CSV))
+
+    monthly = monthly_preview(cube)
+    monthly.to_csv(os.path.join(output_dir, PREVIEW_CSV), index=False, encoding="utf-8-sig")
+    print(f"✅ Saved preview summary to {os.path.join(output_dir, PREVIEW_CSV)}")
+    write_model_usage(model_usage(cube), os.path.join(output_dir, "model_usage_frequency.csv"))
+    render_figures(monthly_summary_figures(cube, output_dir), workers, cache_dir)
+
+    print(f"⚡ Preview: {int(monthly['conversations'].sum())} conversations, "
+          f"{int(monthly['messages'].sum())} messages, ≈ ${monthly['approx_cost'].sum():.2f} at API rates")
+    return monthly
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Write the fast preview report of an extracted export.")
+    parser.add_argument("--json_path", type=str, required=True, help="conversations.json of the export")
+    parser.add_argument("--output_dir", type=str, default="data/_preview")
+    args = parser.parse_args()
+    preview_report(args.json_path, args.output_dir)
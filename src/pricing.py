@@ -0,0 +1,165 @@
+import csv
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# --- Price schedule: (model, effective_from, input, output) in $ per 1M tokens ---
+# A rate applies from effective_from until the model's next entry; None = since the start.
+# Rows before a model's first effective date use its earliest rate.
+PRICE_SCHEDULE = [
+    ('text-davinci-002-render-sha',        None, 0.50,  1.50),
+    ('text-davinci-002-render-sha-mobile', None, 0.50,  1.50),
+    ('gpt-3.5-turbo',                      None, 0.50,  1.50),
+    ('gpt-4',                              None, 30.00, 60.00),
+    ('gpt-4-mobile',                       None, 30.00, 60.00),
+    ('gpt-4-browsing',                     None, 30.00, 60.00),
+    ('gpt-4-plugins',                      None, 30.00, 60.00),
+    ('gpt-4-gizmo',                        None, 30.00, 60.00),
+    ('gpt-4o',                             None, 5.00,  15.00),   # launch pricing
+    ('gpt-4o',                     '2024-10-02', 2.50,  10.00),   # alias moved to gpt-4o-2024-08-06
+    ('gpt-4o-canmore',                     None, 2.50,  10.00),
+    ('gpt-4o-mini',                        None, 0.15,  0.60),
+    ('gpt-4-5',                            None, 75.00, 150.00),
+    ('gpt-4-1',                            None, 2.00,  8.00),
+    ('o1-preview',                         None, 15.00, 60.00),
+    ('o1',                                 None, 15.00, 60.00),
+    ('o1-mini',                            None, 1.10,  4.40),
+    ('o3-mini',                            None, 1.10,  4.40),
+    ('o3-mini-high',                       None, 1.10,  4.40),
+    ('o3',                                 None, 10.00, 40.00),
+    ('o3',                         '2025-06-10', 2.00,  8.00),    # o3 price cut
+    ('o4-mini',                            None, 1.10,  4.40),
+    ('o4-mini-high',                       None, 1.10,  4.40),
+]
+# Optional CSV (model,effective_from,input,output) replacing PRICE_SCHEDULE
+PRICE_SCHEDULE_FILE_ENV = "PRICE_SCHEDULE_FILE"
+
+_SINCE_START = np.datetime64("1970-01-01", "D")
+
+class PriceTable:
+    """
+    Effective-dated price schedule as sorted arrays, for vectorized lookups.
+
+    Entries are sorted by (model, effective_from); a row's entry is its model's first
+    entry plus the number of that model's rate changes on or before its date, counted
+    with a few whole-array comparisons (one per change, not per row).
+    Unknown models get NaN prices.
+    """
+
+    def __init__(self, rows):
+        rows = sorted(
+            ((str(m), _SINCE_START if d in (None, "") else np.datetime64(d, "D"), float(i), float(o))
+             for m, d, i, o in rows),
+            key=lambda r: (r[0], r[1])
+        )
+        self.models = list(dict.fromkeys(r[0] for r in rows))
+        self.model_index = {m: k for k, m in enumerate(self.models)}
+        codes = np.array([self.model_index[r[0]] for r in rows], dtype=np.int64)
+        days = np.array([r[1] for r in rows], dtype="datetime64[D]").astype(np.int64)
+
+        self.first_entry = np.searchsorted(codes, np.arange(len(self.models)))
+        self.last_entry = np.searchsorted(codes, np.arange(len(self.models)), side="right") - 1
+        # Day each later rate of a model takes effect, padded with "never": (models, max entries - 1)
+        depth = int((self.last_entry - self.first_entry).max(initial=0))
+        self.changes = np.full((len(self.models), depth), np.iinfo(np.int64).max, dtype=np.int64)
+        for k in range(len(rows)):
+            j = k - self.first_entry[codes[k]]
+            if j:
+                self.changes[codes[k], j - 1] = days[k]
+        self.input = np.array([r[2] for r in rows] + [np.nan])      # index -1 → NaN
+        self.output = np.array([r[3] for r in rows] + [np.nan])
+
+    def model_codes(self, models):
+        """Index of each model in self.models (-1 if unknown); fast path for categoricals."""
+        models = pd.Series(models) if not isinstance(models, pd.Series) else models
+        if isinstance(models.dtype, pd.CategoricalDtype):
+            codes, uniques = models.cat.codes.to_numpy(), models.cat.categories
+        else:
+            codes, uniques = pd.factorize(models)
+        lookup = np.array([self.model_index.get(u, -1) for u in uniques] + [-1], dtype=np.int64)
+        return lookup[codes]                                          # factorize's -1 (NaN) → -1
+
+    def entries(self, models, dates=None):
+        """
+        Schedule entry applying to each (model, date) row, -1 where the model is unknown.
+        dates: datetime-like per row (NaT or None → the model's latest rate).
+        """
+        codes = self.model_codes(models)
+        known = codes >= 0
+        entry = np.full(len(codes), -1, dtype=np.int64)
+        if dates is None:
+            entry[known] = self.last_entry[codes[known]]
+            return entry
+
+        days = np.asarray(dates)
+        if not np.issubdtype(days.dtype, np.datetime64):
+            days = np.asarray(pd.to_datetime(days, errors="coerce"))
+        days = days.astype("datetime64[D]")
+        day_numbers = np.where(np.isnat(days), np.iinfo(np.int64).max - 1, days.astype(np.int64))
+
+        safe_codes = np.where(known, codes, 0)
+        found = self.first_entry[safe_codes]
+        for j in range(self.changes.shape[1]):
+            found += day_numbers >= self.changes[safe_codes, j]
+        entry[known] = found[known]
+        return entry
+
+    def prices(self, models, dates=None):
+        """(input, output) $/1M-token arrays per row."""
+        entry = self.entries(models, dates)
+        return self.input[entry], self.output[entry]
+
+    def costs(self, models, input_tokens, output_tokens, dates=None):
+        """(input cost, output cost) in $ per row: tokens / 1e6 × rate."""
+        price_in, price_out = self.prices(models, dates)
+        return (np.asarray(input_tokens) / 1e6) * price_in, (np.asarray(output_tokens) / 1e6) * price_out
+
+    def current(self):
+        """Latest rates as {model: {'input': ..., 'output': ...}}."""
+        return {m: {'input': self.input[self.last_entry[k]], 'output': self.output[self.last_entry[k]]}
+                for k, m in enumerate(self.models)}
+
+def read_price_schedule(path):
+    """Rows of a price schedule CSV with columns model,effective_from,input,output."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return [(r["model"], r.get("effective_from") or None, r["input"], r["output"])
+                for r in csv.DictReader(f)]
+
+@lru_cache(maxsize=8)
+def _load_price_table(path, mtime_ns):
+    return PriceTable(read_price_schedule(path) if path else PRICE_SCHEDULE)
+
+def load_price_table(path=None):
+    """
+    PriceTable for path, else the file named by $PRICE_SCHEDULE_FILE, else PRICE_SCHEDULE.
+    Cached per file version, so repeated calls are free.
+    """
+    path = path or os.getenv(PRICE_SCHEDULE_FILE_ENV) or None
+    mtime_ns = os.stat(path).st_mtime_ns if path else 0
+    return _load_price_table(str(path) if path else None, mtime_ns)
+
+def create_time_dates(create_times):
+    """Dates of 'YYYYMMDD_HHMMSS.ff' timestamps (NaT when missing or malformed)."""
+    return pd.to_datetime(pd.Series(create_times).astype(str).str[:8], format="%Y%m%d", errors="coerce")
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="Time the vectorized pricing engine on synthetic rows.")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--schedule", type=str, default=None, help="Price schedule CSV (default: built-in)")
+    args = parser.parse_args()
+
+    table = load_price_table(args.schedule)
+    rng = np.random.default_rng(0)
+    models = pd.Series(pd.Categorical.from_codes(
+        rng.integers(0, len(table.models) + 1, args.rows), table.models + ["unknown-model"]
+    ))
+    dates = np.datetime64("2023-01-01") + rng.integers(0, 1000, args.rows).astype("timedelta64[D]")
+    tokens = rng.integers(0, 5000, args.rows)
+
+    t0 = time.perf_counter()
+    input_cost, output_cost = table.costs(models, tokens, tokens, dates)
+    print(f"Priced {args.rows:,} rows in {time.perf_counter() - t0:.3f}s "
+          f"(total ${np.nansum(input_cost) + np.nansum(output_cost):,.0f})")
@@ -0,0 +1,299 @@
+"""
+Local HTTP/JSON query service over the archived run outputs (output/analysis-*/results.zip).
+
+    GET /                                        endpoints and cache statistics
+    GET /runs                                    archived runs, newest first
+    GET /runs/<run>/monthly_costs                monthly naive vs API-emulated costs
+    GET /runs/<run>/model_usage                  model usage frequency and first use
+    GET /runs/<run>/conversation_costs?limit=20&sort=api_total_cost
+                                                 conversations ranked by cost
+
+<run> is an analysis-* folder name or "latest". A run still in progress is served from
+its preview_results.zip (see preview_report.py) until results.zip is written; its
+monthly_costs are then the approximate preview_monthly_summary.csv.
+
+Parsed tables live in an in-process LRU keyed by (archive, member, archive mtime and
+size), and encoded responses in a second LRU keyed by their ETag, which is derived from
+the same signature. A poll with a matching If-None-Match gets a 304 from a stat() call;
+a poll without one gets the cached bytes. An archive is only read again once it changes.
+"""
+import hashlib
+import json
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pandas as pd
+
+from pricing import load_price_table, create_time_dates
+from preview_report import PREVIEW_CSV
+
+DEFAULT_PORT = 8765
+TABLE_CACHE_ENTRIES = 32
+RESPONSE_CACHE_ENTRIES = 256
+ARCHIVES = ("results.zip", "preview_results.zip")     # in order of preference
+RANKING_COLUMNS = ("api_total_cost", "naive_total_cost", "api_input_tokens", "input_tokens",
+                   "output_tokens", "messages")
+
+class LRUCache:
+    """Thread-safe least-recently-used map with a fixed number of entries."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.loading = {}                       # {key: Future of the load in progress}
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get_or_load(self, key, load):
+        """
+        Cached value of key, else load() stored under it. The lock is not held while
+        loading, so hits and other keys are served meanwhile; concurrent misses of the
+        same key wait for the one load in progress (and get its error if it fails).
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            pending = self.loading.get(key)
+            if pending is None:
+                self.misses += 1
+                pending = self.loading[key] = Future()
+                loader = True
+            else:
+                self.hits += 1
+                loader = False
+        if not loader:
+            return pending.result()
+
+        try:
+            value = load()
+        except BaseException as e:
+            with self.lock:
+                del self.loading[key]
+            pending.set_exception(e)
+            raise
+        with self.lock:
+            del self.loading[key]
+            self.entries[key] = value
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        pending.set_result(value)
+        return value
+
+    def stats(self):
+        return {"entries": len(self.entries), "max_entries": self.max_entries,
+                "hits": self.hits, "misses": self.misses}
+
+class QueryError(Exception):
+    """Request that cannot be answered; carries the HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _records(df):
+    """JSON-ready rows of a DataFrame (NaN → null)."""
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+def _read_member(archive, member, **kwargs):
+    with zipfile.ZipFile(archive) as zf:
+        if member not in zf.namelist():
+            raise QueryError(404, f"{member} is not in {os.path.basename(archive)}")
+        with zf.open(member) as f:
+            return pd.read_csv(f, encoding="utf-8-sig", **kwargs)
+
+def conversation_costs(emulated, titles=None, price_table=None):
+    """Per-conversation totals of the emulator output (+ naive cost and title), by API cost."""
+    input_cost, output_cost = (price_table or load_price_table()).costs(
+        emulated["model"], emulated["input_tokens"], emulated["output_tokens"],
+        create_time_dates(emulated["conversation_create_time"])
+    )
+    emulated = emulated.assign(naive_total_cost=np.nan_to_num(input_cost) + np.nan_to_num(output_cost))
+    table = emulated.groupby("conversation_id", sort=False).agg(
+        conversation_create_time=("conversation_create_time", "first"),
+        messages=("message_id", "size"),
+        input_tokens=("input_tokens", "sum"),
+        output_tokens=("output_tokens", "sum"),
+        api_input_tokens=("api_input_tokens", "sum"),
+        naive_total_cost=("naive_total_cost", "sum"),
+        api_total_cost=("api_total_cost", "sum"),
+    ).reset_index()
+    if titles is not None:
+        titles = titles.drop_duplicates("conversation_id").set_index("conversation_id")["conversation_title"]
+        table.insert(1, "conversation_title", table["conversation_id"].map(titles))
+    return table.sort_values("api_total_cost", ascending=False, kind="stable", ignore_index=True)
+
+class QueryService:
+    """The service state: where the runs are, and the table and response caches."""
+
+    def __init__(self, output_parent, table_entries=TABLE_CACHE_ENTRIES, response_entries=RESPONSE_CACHE_ENTRIES):
+        self.output_parent = str(output_parent)
+        self.tables = LRUCache(table_entries)
+        self.responses = LRUCache(response_entries)
+
+    # --- Runs ---
+    def runs(self):
+        """[(run name, archive path)] of the archived runs, newest first."""
+        found = []
+        if os.path.isdir(self.output_parent):
+            for entry in os.scandir(self.output_parent):
+                if not (entry.is_dir() and entry.name.startswith("analysis-")):
+                    continue
+                for name in ARCHIVES:
+                    archive = os.path.join(entry.path, name)
+                    if os.path.isfile(archive):
+                        found.append((entry.name, archive))
+                        break
+        return sorted(found, reverse=True)
+
+    def archive(self, run):
+        runs = self.runs()
+        if not runs:
+            raise QueryError(404, "no archived runs yet")
+        if run == "latest":
+            return runs[0][1]
+        for name, archive in runs:
+            if name == run:
+                return archive
+        raise QueryError(404, f"unknown run: {run}")
+
+    @staticmethod
+    def signature(path):
+        st = os.stat(path)
+        return (path, st.st_mtime_ns, st.st_size)
+
+    # --- Tables (parsed once per archive version) ---
+    def table(self, archive, member, **kwargs):
+        return self.tables.get_or_load(
+            self.signature(archive) + (member,), lambda: _read_member(archive, member, **kwargs)
+        )
+
+    def monthly_costs(self, archive, query):
+        # A preview archive only has the approximate monthly summary
+        member = PREVIEW_CSV if archive.endswith(ARCHIVES[1]) else "monthly_token_cost_comparison.csv"
+        return _records(self.table(archive, member, dtype={"month": str}))
+
+    def model_usage(self, archive, query):
+        return _records(self.table(archive, "model_usage_frequency.csv", dtype={"model": str, "first_use": str}))
+
+    def conversation_costs(self, archive, query):
+        try:
+            limit = int(query.get("limit", ["20"])[0])
+        except ValueError:
+            raise QueryError(400, "limit must be an integer")
+        sort = query.get("sort", ["api_total_cost"])[0]
+        if sort not in RANKING_COLUMNS:
+            raise QueryError(400, f"sort must be one of {', '.join(RANKING_COLUMNS)}")
+
+        def load():
+            emulated = self.table(archive, "token_costs_true_api_emulated.csv", dtype={
+                "conversation_id": str, "message_id": str, "conversation_create_time": str, "model": str
+            })
+            try:
+                titles = self.table(archive, "merged_conversations_filled.csv",
+                                    usecols=["conversation_id", "conversation_title"], dtype=str)
+            except QueryError:
+                titles = None
+            return conversation_costs(emulated, titles)
+
+        table = self.tables.get_or_load(self.signature(archive) + ("conversation_costs",), load)
+        if sort != "api_total_cost":
+            table = table.sort_values(sort, ascending=False, kind="stable")
+        return _records(table.head(max(limit, 0)))
+
+    ENDPOINTS = {
+        "monthly_costs": monthly_costs,
+        "model_usage": model_usage,
+        "conversation_costs": conversation_costs,
+    }
+
+    # --- Requests ---
+    def respond(self, path, query):
+        """(ETag, encoder) of a GET; the encoder builds the JSON body bytes when needed."""
+        parts = [p for p in path.split("/") if p]
+        if not parts:
+            return None, lambda: {
+                "endpoints": ["/runs", "/runs/<run>/" + "|".join(self.ENDPOINTS)],
+                "table_cache": self.tables.stats(), "response_cache": self.responses.stats(),
+            }
+        if parts == ["runs"]:
+            runs = self.runs()
+            key = ("runs",) + tuple(self.signature(a) for _, a in runs)
+            return key, lambda: [{"run": name, "archive": os.path.basename(a)} for name, a in runs]
+        if len(parts) == 3 and parts[0] == "runs" and parts[2] in self.ENDPOINTS:
+            archive = self.archive(parts[1])
+            endpoint = self.ENDPOINTS[parts[2]]
+            key = self.signature(archive) + (parts[2], tuple(sorted((k, tuple(v)) for k, v in query.items())))
+            return key, lambda: endpoint(self, archive, query)
+        raise QueryError(404, f"no such endpoint: {path}")
+
+def etag_of(key):
+    return '"' + hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:20] + '"'
+
+def make_handler(service):
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            try:
+                key, encode = service.respond(url.path, parse_qs(url.query))
+                if key is None:
+                    self.send_json(200, json.dumps(encode()).encode("utf-8"))
+                    return
+                etag = etag_of(key)
+                if etag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                body = service.responses.get_or_load(
+                    etag, lambda: json.dumps(encode(), allow_nan=False).encode("utf-8")
+                )
+                self.send_json(200, body, etag)
+            except QueryError as e:
+                self.send_json(e.status, json.dumps({"error": str(e)}).encode("utf-8"))
+            except Exception as e:
+                self.send_json(500, json.dumps({"error": f"{type(e).__name__}: {e}"}).encode("utf-8"))
+
+        def send_json(self, status, body, etag=None):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            if etag is not None:
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass                                        # keep the pipeline log clean
+
+    return QueryHandler
+
+def serve_in_background(output_parent, host="127.0.0.1", port=DEFAULT_PORT):
+    """Start the service on a daemon thread next to the watcher; returns the server."""
+    server = ThreadingHTTPServer((host, port), make_handler(QueryService(output_parent)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="query-service", daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve the archived run outputs as JSON over HTTP.")
+    parser.add_argument("--output_dir", type=str, default="output")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(QueryService(args.output_dir)))
+    print(f"🔎 Serving {os.path.abspath(args.output_dir)} on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
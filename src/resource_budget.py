@@ -0,0 +1,162 @@
+"""
+Resource budget for hosts shared with other services (e.g. a NAS).
+
+    MAX_WORKERS     cap on the size of every pool the pipeline starts: stage scheduler,
+                    tokenizer threads, emulation and plot processes, writers (0 = no cap)
+    MAX_MEMORY_MB   resident memory a run should stay under (0 = no cap)
+    IO_NICE         I/O priority of the daemon and everything it starts: "idle",
+                    "best-effort:<0-7>" or "<0-7>" (7 = lowest best-effort priority)
+
+plan_run() turns the configured settings and the size of the export into a RunPlan.
+When the estimated peak exceeds MAX_MEMORY_MB it steps down, one step at a time,
+until the estimate fits:
+
+    1. render plots and emulate in-process (no extra worker processes)
+    2. run the stages one at a time (no overlapping tables)
+    3. streaming mode, with chunks sized to the memory that is left
+
+The estimate is the streaming pipeline's memory model (STREAM_EXPANSION × the size of
+conversations.json) plus fixed per-process overheads, so it is rough: a memory-mode
+run that still runs out of memory (MemoryError, or a pool process OOM-killed) is retried
+in streaming mode (see is_out_of_memory and streaming_fallback). If the warm worker
+itself is killed, main.py's retry_crashed_job queues the zip again with the same
+fallback.
+"""
+import os
+import shutil
+import subprocess
+from collections import namedtuple
+
+from streaming_pipeline import STREAM_EXPANSION
+from token_counter import available_cores
+
+BASE_MB = 300               # the warm worker itself: interpreter, pandas, matplotlib, tokenizers
+PROCESS_MB = 120            # each extra pool process (started from the fork server)
+OVERLAP_FACTOR = 1.5        # peak of overlapping stages relative to running them one at a time
+MIN_STREAM_MB = 64          # smallest streaming memory ceiling used, whatever the budget
+
+IO_CLASSES = {"realtime": "1", "best-effort": "2", "idle": "3"}
+
+RunPlan = namedtuple("RunPlan", [
+    "mode", "stream_memory_mb", "pipeline_workers", "emulation_workers", "plot_workers",
+    "token_threads", "artifact_writers", "estimate_mb", "notes",
+])
+
+def _capped(n, cap):
+    return min(n, cap) if cap else n
+
+def _noted(plan, note):
+    """plan with note added (notes is a tuple, so _replace'd plans never share one)."""
+    return plan._replace(notes=plan.notes + (note,))
+
+def estimate_mb(plan, json_bytes):
+    """Estimated peak resident MB of a run of an export with json_bytes of conversations."""
+    processes = sum(n for n in (plan.emulation_workers, plan.plot_workers or available_cores()) if n > 1)
+    if plan.mode == "streaming":
+        data_mb = plan.stream_memory_mb
+    else:
+        data_mb = json_bytes / (1024 * 1024) * STREAM_EXPANSION
+        if plan.pipeline_workers > 1:
+            data_mb *= OVERLAP_FACTOR
+    return int(BASE_MB + processes * PROCESS_MB + data_mb)
+
+def plan_run(json_bytes, mode="memory", stream_memory_mb=1024, pipeline_workers=4, emulation_workers=1,
+             plot_workers=0, artifact_writers=1, max_workers=0, max_memory_mb=0):
+    """
+    Settings for one run within the budget (see module docstring).
+
+    Args:
+        json_bytes (int): Size of the export's conversations.json.
+        mode, stream_memory_mb, pipeline_workers, emulation_workers, plot_workers,
+        artifact_writers: The configured settings (as in main.py; plot_workers 0 = one per CPU).
+        max_workers (int): MAX_WORKERS (0 = no cap).
+        max_memory_mb (int): MAX_MEMORY_MB (0 = no cap).
+
+    Returns:
+        RunPlan: The settings to use; notes lists every setting changed and why.
+    """
+    cores = _capped(available_cores(), max_workers)
+    plan = RunPlan(
+        mode=mode,
+        stream_memory_mb=stream_memory_mb,
+        pipeline_workers=_capped(pipeline_workers, max_workers),
+        emulation_workers=_capped(emulation_workers, max_workers),
+        plot_workers=_capped(plot_workers or cores, max_workers) if max_workers else plot_workers,
+        token_threads=cores if max_workers else None,          # None: count_tokens' default
+        artifact_writers=_capped(artifact_writers, max_workers),
+        estimate_mb=0,
+        notes=(),
+    )
+    if max_workers:
+        plan = _noted(plan, f"pools capped at MAX_WORKERS={max_workers}")
+
+    if max_memory_mb:
+        steps = []
+        if plan.emulation_workers > 1 or (plan.plot_workers or available_cores()) > 1:
+            steps.append(("in-process plots and emulation", dict(emulation_workers=1, plot_workers=1)))
+        if plan.mode == "memory" and plan.pipeline_workers > 1:
+            steps.append(("stages one at a time", dict(pipeline_workers=1)))
+        if plan.mode == "memory":
+            steps.append(("streaming mode", dict(mode="streaming")))
+        for label, change in steps:
+            if estimate_mb(plan, json_bytes) <= max_memory_mb:
+                break
+            plan = _noted(plan._replace(**change), f"{label} to stay under MAX_MEMORY_MB={max_memory_mb}")
+
+        if plan.mode == "streaming":
+            # Whatever the steps left: the chunks get the memory not taken by the processes
+            available = max_memory_mb - (estimate_mb(plan._replace(stream_memory_mb=0), json_bytes))
+            ceiling = max(MIN_STREAM_MB, min(plan.stream_memory_mb, available))
+            if ceiling != plan.stream_memory_mb:
+                plan = _noted(plan._replace(stream_memory_mb=ceiling), f"streaming memory ceiling {ceiling} MB")
+            if available < MIN_STREAM_MB:
+                plan = _noted(plan, f"MAX_MEMORY_MB={max_memory_mb} is below the minimum this run needs "
+                                    f"(~{BASE_MB + MIN_STREAM_MB} MB); expect it to be exceeded")
+    return plan._replace(estimate_mb=estimate_mb(plan, json_bytes))
+
+def streaming_fallback(plan, max_memory_mb=0):
+    """The plan to retry a memory-mode run with after it ran out of memory."""
+    plan = plan._replace(mode="streaming", pipeline_workers=1, emulation_workers=1, plot_workers=1)
+    if max_memory_mb:
+        plan = plan._replace(stream_memory_mb=max(MIN_STREAM_MB, min(plan.stream_memory_mb, max_memory_mb - BASE_MB)))
+    plan = _noted(plan, f"streaming retry after running out of memory (ceiling {plan.stream_memory_mb} MB)")
+    return plan._replace(estimate_mb=estimate_mb(plan, 0))
+
+def is_out_of_memory(error):
+    """True if a failed run ran out of memory: a MemoryError, or a process killed by SIGKILL (OOM)."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, MemoryError):
+            return True
+        message = str(error)
+        if "MemoryError" in message or "exited with code -9" in message or "terminated abruptly" in message:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+def set_io_priority(spec):
+    """
+    Apply IO_NICE to this process (see module docstring) with ionice. Threads and
+    processes started afterwards inherit it, so call it before starting any.
+    Returns True if the priority was set.
+    """
+    spec = (spec or "").strip().lower()
+    if not spec:
+        return False
+    name, _, level = spec.partition(":")
+    if name.isdigit():
+        name, level = "best-effort", name
+    if name not in IO_CLASSES or (level and not (level.isdigit() and 0 <= int(level) <= 7)):
+        raise ValueError(f"IO_NICE must be 'idle', 'best-effort:<0-7>' or '<0-7>', not {spec!r}")
+    if shutil.which("ionice") is None:
+        print("⚠️ ionice not found, IO_NICE ignored")
+        return False
+    command = ["ionice", "-c", IO_CLASSES[name], "-p", str(os.getpid())]
+    if level and name != "idle":
+        command[3:3] = ["-n", level]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"⚠️ Could not set I/O priority {spec!r}: {result.stderr.strip()}")
+        return False
+    return True
@@ -2,18 +2,22 @@ import os
 import smtplib
 import mimetypes
 from email.message import EmailMessage
-from dotenv import load_dotenv
 
 def send_email_report(
     output_dir="data",
     log_filename="logs.txt",
-    usage_csv="model_usage_frequency.csv"
+    usage_csv="model_usage_frequency.csv",
+    preview=False,
+    attachments=()
 ):
     """
     Send all PNGs in data/, model_usage_frequency.csv (in data/), and logs.txt (in data/).
     Credentials from .env (EMAIL_USER, EMAIL_PASS). Prompts user for recipient.
+    preview: this is the fast preview report (subject and text say so; the full report follows).
+    attachments: further file names in output_dir to attach (e.g. the preview summary CSV).
     """
     # --- Load env ---
+    from dotenv import load_dotenv
     load_dotenv()
     sender = os.getenv("EMAIL_USER")
     password = os.getenv("EMAIL_PASS")
@@ -51,20 +55,39 @@ def send_email_report(
     else:
         print(f"⚠️ Log file not found: {log_full_path}")
 
+    for fname in attachments:
+        full_path = os.path.join(output_dir, fname)
+        if os.path.isfile(full_path):
+            files_to_attach.append(full_path)
+        else:
+            print(f"⚠️ Attachment not found: {full_path}")
+
     # --- Compose Email ---
     msg = EmailMessage()
-    msg["Subject"] = "ChatGPT History Analysis Report"
+    msg["Subject"] = "ChatGPT History Analysis Report" + (" (preview)" if preview else "")
     msg["From"] = sender
     msg["To"] = recipient
-    msg.set_content(
-        "Hello,\n\n"
-        "Please find attached your ChatGPT usage report:\n"
-        "• Model usage frequency table (CSV)\n"
-        "• Plots (.png) summarizing your usage\n"
-        "• The processing log (logs.txt)\n\n"
-        "Questions? Reply to this email!\n\n"
-        "Best regards,\nChatGPT Analyzer"
-    )
+    if preview:
+        msg.set_content(
+            "Hello,\n\n"
+            "Here is a quick preview of your ChatGPT usage report:\n"
+            "• Monthly conversation/message counts with an approximate cost (CSV)\n"
+            "• Model usage frequency table (CSV)\n"
+            "• Plots (.png) summarizing your usage\n\n"
+            "Token counts and costs are rough estimates. The full report, with exact\n"
+            "token counts and emulated API costs, follows in a separate email.\n\n"
+            "Best regards,\nChatGPT Analyzer"
+        )
+    else:
+        msg.set_content(
+            "Hello,\n\n"
+            "Please find attached your ChatGPT usage report:\n"
+            "• Model usage frequency table (CSV)\n"
+            "• Plots (.png) summarizing your usage\n"
+            "• The processing log (logs.txt)\n\n"
+            "Questions? Reply to this email!\n\n"
+            "Best regards,\nChatGPT Analyzer"
+        )
 
     # --- Attach files ---
     for path in files_to_attach:
@@ -0,0 +1,185 @@
+"""
+Content-addressed cache of pipeline stage outputs (cache/stages/).
+
+A cached stage's key hashes the pipeline code (src/ and main.py, which wires the
+stages and their arguments) and library versions, the stage name and parameters, the
+content of its external input files (e.g. conversations.json) and the keys of the
+stages it depends on (through uncached ones, e.g. load, to their own dependencies). Stages are deterministic, so the key
+fixes the outputs: an entry holds the files the stage wrote and, for stages whose
+result feeds their dependents in memory, the pickled result.
+
+A retried export (dropped again after a failed run, or resumed from _inbox after a
+crash) therefore restores every stage up to the first one whose inputs changed and
+recomputes from there. Entries are only written once a stage succeeds; the least
+recently used ones are evicted past the size cap.
+
+    cache = StageCache("cache/stages", max_mb=1024)
+    dag = PipelineDAG(cache)
+    dag.add("merge", merge, deps=[...], cache=CachedStage(outputs=["data/merged_conversations.csv"]))
+"""
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import threading
+from collections import namedtuple
+from importlib import metadata
+
+DEFAULT_CACHE_MAX_MB = 1024
+EVICT_TARGET = 0.9          # after eviction, shrink to this fraction of max_mb
+CACHE_VERSION = 1
+LIBRARIES = ("numpy", "pandas", "tiktoken")
+ENTRY_FILE = "entry.json"
+RESULT_FILE = "result.pkl"
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+# The stage functions and main.py, which declares the stages, their outputs and arguments
+PIPELINE_SOURCES = (SRC_DIR, os.path.join(os.path.dirname(SRC_DIR), "main.py"))
+
+# outputs: files the stage writes (those missing after it ran are left out of the entry);
+# inputs: files read outside the cached dependencies; params: anything else the outputs depend on
+CachedStage = namedtuple("CachedStage", ["outputs", "inputs", "params"], defaults=((), None))
+
+_digests = {}
+_digest_lock = threading.Lock()
+
+def file_digest(path, chunk_size=1 << 20):
+    """blake2b of a file's content, remembered per (path, size, mtime) for the process."""
+    st = os.stat(path)
+    memo = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _digest_lock:                          # concurrent stages hash a shared input once
+        if memo not in _digests:
+            h = hashlib.blake2b(digest_size=16)
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(chunk_size), b""):
+                    h.update(block)
+            _digests[memo] = h.hexdigest()
+        return _digests[memo]
+
+def code_fingerprint(*paths):
+    """Hash of the Python sources under the given files/folders and the library versions."""
+    h = hashlib.sha256(f"v{CACHE_VERSION}".encode())
+    for name in LIBRARIES:
+        try:
+            h.update(f"{name}=={metadata.version(name)}".encode())
+        except metadata.PackageNotFoundError:
+            h.update(f"{name} missing".encode())
+    sources = []
+    for path in map(str, paths):
+        if os.path.isfile(path):
+            sources.append(path)
+        elif os.path.isdir(path):
+            sources += [os.path.join(path, f) for f in os.listdir(path) if f.endswith(".py")]
+    for source in sorted(sources):
+        h.update(os.path.basename(source).encode())
+        with open(source, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def pipeline_fingerprint():
+    """code_fingerprint of PIPELINE_SOURCES: changes with any pipeline code or its wiring."""
+    return code_fingerprint(*PIPELINE_SOURCES)
+
+def _entry_size(entry_dir):
+    total = 0
+    for e in os.scandir(entry_dir):
+        try:
+            total += e.stat().st_size
+        except FileNotFoundError:
+            pass
+    return total
+
+class StageCache:
+    """Stage output entries under root, keyed by key() (see module docstring)."""
+
+    def __init__(self, root, max_mb=DEFAULT_CACHE_MAX_MB, code=None):
+        self.root = str(root)
+        self.max_mb = max_mb
+        self.code = code or pipeline_fingerprint()
+        os.makedirs(self.root, exist_ok=True)
+        for e in os.scandir(self.root):             # left by a run that crashed mid-save
+            if e.name.startswith(".tmp-"):
+                shutil.rmtree(e.path, ignore_errors=True)
+
+    def key(self, stage, spec, dep_keys):
+        """Key of a stage run from its CachedStage spec and the keys of its dependencies."""
+        h = hashlib.sha256(self.code.encode())
+        h.update(stage.encode())
+        h.update(json.dumps(spec.params, sort_keys=True, default=str).encode())
+        for path in spec.inputs:
+            h.update(file_digest(path).encode())
+        for dep_key in dep_keys:
+            h.update(dep_key.encode())
+        return h.hexdigest()
+
+    def load(self, key, outputs):
+        """
+        Restore an entry: copy its files over the stage's outputs and return (True, result).
+        (False, None) when there is no usable entry.
+        """
+        entry_dir = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(entry_dir, ENTRY_FILE), encoding="utf-8") as f:
+                stored = set(json.load(f)["files"])
+            for path in map(str, outputs):
+                name = os.path.basename(path)
+                if name in stored:
+                    shutil.copyfile(os.path.join(entry_dir, name), path)
+            result = None
+            if os.path.isfile(os.path.join(entry_dir, RESULT_FILE)):
+                with open(os.path.join(entry_dir, RESULT_FILE), "rb") as f:
+                    result = pickle.load(f)
+            os.utime(entry_dir)
+        except FileNotFoundError:
+            return False, None
+        except Exception as e:
+            print(f"⚠️ Unusable stage cache entry {key[:12]}, recomputing: {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return False, None
+        return True, result
+
+    def save(self, key, stage, outputs, result=None):
+        """Store a finished stage's output files (and result, unless None) under key."""
+        entry_dir = os.path.join(self.root, key)
+        tmp_dir = os.path.join(self.root, f".tmp-{key}-{os.getpid()}-{threading.get_ident()}")
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            files = []
+            for path in map(str, outputs):
+                if os.path.isfile(path):
+                    shutil.copyfile(path, os.path.join(tmp_dir, os.path.basename(path)))
+                    files.append(os.path.basename(path))
+            if result is not None:
+                with open(os.path.join(tmp_dir, RESULT_FILE), "wb") as f:
+                    pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            with open(os.path.join(tmp_dir, ENTRY_FILE), "w", encoding="utf-8") as f:
+                json.dump({"stage": stage, "files": files}, f)
+            # Rename into place, so a reader never sees a partial entry
+            os.rename(tmp_dir, entry_dir)
+        except OSError as e:
+            if not os.path.isdir(entry_dir):        # else an identical entry got there first
+                print(f"⚠️ Could not cache the outputs of stage '{stage}': {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries once the cache grows past max_mb."""
+        entries = []
+        for e in os.scandir(self.root):
+            if e.is_dir() and not e.name.startswith(".tmp-"):
+                try:
+                    entries.append((e.stat().st_mtime, _entry_size(e.path), e.path))
+                except FileNotFoundError:
+                    pass
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_mb * 1024 * 1024:
+            return 0
+        removed = 0
+        for _, size, path in sorted(entries)[:-1]:          # never the entry just written
+            if total <= EVICT_TARGET * self.max_mb * 1024 * 1024:
+                break
+            total -= size
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        return removed
@@ -0,0 +1,443 @@
+import csv
+import heapq
+import os
+import shutil
+
+import pandas as pd
+
+from import_export_zip import iter_conversations
+from survey_schema import survey_conversation_keys, print_survey
+from flatten_messages import flatten_conversations, rows_to_df, write_error_log
+from flatten_websearch import extract_flattened_data
+from flatten_images import extract_image_records
+from merge_flattened import merge_all
+from fill_model_names import fill_model_names, write_model_usage
+from token_counter import count_tokens, combine_cost_estimates, COST_ESTIMATE_CSV
+from token_arrays import write_token_arrays
+from token_cache import DEFAULT_MAX_MB as TOKEN_CACHE_MAX_MB
+from emulate_api_chat_costs import main as emulate_api_chat_costs
+from aggregate_cube import (csv_token_cube, combine_cubes, message_cube, model_usage, write_cube, read_cube,
+                            CUBE_CSV, MESSAGE_COLUMNS)
+from incremental_index import conversation_key
+from table_schema import read_table
+
+# --- Memory model: resident bytes per byte of conversations.json text in one chunk ---
+# (parsed dicts + flattened rows + the merge/fill DataFrame copies, measured ~10-15×)
+STREAM_EXPANSION = 20
+DEFAULT_MEMORY_MB = 1024
+
+# --- Per-chunk intermediate files, merged into DATA_DIR at the end ---
+STAGE_FILES = (
+    "conversations_flat.csv",
+    "flattened_websearch_thoughts.csv",
+    "image_generations.csv",
+    "merged_conversations.csv",
+    "merged_conversations_filled.csv",
+    "token_counts.csv",
+    "token_costs_true_api_emulated.csv",
+    "token_costs_branches.csv",
+)
+
+# merged_conversations.csv is sorted by conversation_create_time (newest first, stable on
+# message_id); 'YYYYMMDD_HHMMSS.cc' is fixed-width, so flipping the digits gives an
+# ascending key for heapq.merge.
+_DESCENDING_DIGITS = str.maketrans("0123456789", "9876543210")
+
+def _merged_order_key(header):
+    i_ct, i_mid = header.index("conversation_create_time"), header.index("message_id")
+    return lambda row: (row[i_ct] == "", row[i_ct].translate(_DESCENDING_DIGITS), row[i_mid])
+
+def _emulated_order_key(header):
+    i_conv, i_mid = header.index("conversation_id"), header.index("message_id")
+    return lambda row: (row[i_conv] == "", row[i_conv], row[i_mid] == "", row[i_mid])
+
+def _branch_order_key(header):
+    i_conv, i_leaf = header.index("conversation_id"), header.index("leaf_message_id")
+    return lambda row: (row[i_conv], row[i_leaf])
+
+# What the flatten step writes for a chunk without any rows of a source
+EMPTY_SOURCES = {
+    "conversations_flat.csv": lambda: rows_to_df([]),
+    "flattened_websearch_thoughts.csv": lambda: extract_flattened_data([]),
+    "image_generations.csv": lambda: extract_image_records([]),
+}
+
+# How each stage file is combined: None = concatenate in export order, else a sort key factory
+MERGE_KEYS = {
+    "conversations_flat.csv": None,
+    "flattened_websearch_thoughts.csv": None,
+    "image_generations.csv": None,
+    "merged_conversations.csv": _merged_order_key,
+    "merged_conversations_filled.csv": _merged_order_key,
+    "token_counts.csv": _merged_order_key,
+    "token_costs_true_api_emulated.csv": _emulated_order_key,
+    "token_costs_branches.csv": _branch_order_key,
+}
+
+def iter_conversation_chunks(json_path, memory_limit_mb=DEFAULT_MEMORY_MB):
+    """
+    Stream conversations.json and group whole conversations into chunks whose JSON
+    text stays under memory_limit_mb / STREAM_EXPANSION. A single conversation larger
+    than the budget becomes a chunk of its own.
+    Yields (start_index, list of conversations).
+    """
+    budget = memory_limit_mb * 1024 * 1024 / STREAM_EXPANSION
+    chunk, chunk_size, start = [], 0, 0
+    for conv, size in iter_conversations(json_path):
+        if chunk and chunk_size + size > budget:
+            yield start, chunk
+            start += len(chunk)
+            chunk, chunk_size = [], 0
+        chunk.append(conv)
+        chunk_size += size
+    if chunk:
+        yield start, chunk
+
+def iter_incremental_chunks(json_path, index, memory_limit_mb=DEFAULT_MEMORY_MB, max_conversations=None):
+    """
+    Like iter_conversation_chunks, but against an IncrementalIndex. Conversations the
+    index holds unchanged (same id and fingerprint) are yielded in runs taken from one
+    segment, in that segment's order; everything else is grouped into new chunks of at
+    most max_conversations. Chunks stay in export order.
+    Yields (start_index, list of conversations, conversation keys, segment name or None);
+    a run that covers its whole segment reuses it, a shorter one is cut out of it.
+    """
+    budget = memory_limit_mb * 1024 * 1024 / STREAM_EXPANSION
+    chunk, keys, chunk_size, start = [], [], 0, 0
+    run = None       # (segment name, position of the run's last conversation in it, [(conv, key)])
+
+    def flush():
+        nonlocal chunk, keys, chunk_size, start
+        if chunk:
+            yield start, chunk, keys, None
+            start += len(chunk)
+            chunk, keys, chunk_size = [], [], 0
+
+    def add(conv, key, size):
+        nonlocal chunk_size
+        if chunk and (chunk_size + size > budget or (max_conversations and len(chunk) >= max_conversations)):
+            yield from flush()
+        chunk.append(conv)
+        keys.append(key)
+        chunk_size += size
+
+    def end_run():
+        nonlocal run, start
+        if run is not None:
+            name, _, items = run
+            yield start, [c for c, _ in items], [k for _, k in items], name
+            start += len(items)
+            run = None
+
+    for conv, size, text in iter_conversations(json_path, with_text=True):
+        key = conversation_key(conv, text)
+        found = index.find(key)
+        if found is None:
+            yield from end_run()
+            yield from add(conv, key, size)
+            continue
+        name, position = found
+        if run is not None and run[0] == name and run[1] < position:
+            run[2].append((conv, key))
+            run = (name, position, run[2])
+            continue
+        yield from end_run()
+        yield from flush()
+        run = (name, position, [(conv, key)])
+
+    yield from end_run()
+    yield from flush()
+
+def _read_csv_rows(path):
+    """Return (header, row iterator) for a CSV written by pandas (utf-8-sig)."""
+    f = open(path, "r", encoding="utf-8-sig", newline="")
+    reader = csv.reader(f)
+    header = next(reader, None)
+
+    def rows():
+        with f:
+            yield from reader
+    return header, rows()
+
+def combine_csvs(paths, output_csv, key_factory=None):
+    """
+    Combine per-chunk CSVs into output_csv, either concatenated in order
+    (key_factory=None) or k-way merged on the key built from the header.
+    Rows are re-serialised with the same csv dialect pandas uses, so the result is
+    byte-identical to writing the whole table at once. Only one row per input
+    file is held in memory.
+    """
+    parts = [_read_csv_rows(p) for p in paths if os.path.isfile(p)]
+    header, iters = None, []
+    for h, rows in parts:
+        if not h or h == [""]:  # chunk without rows (pandas writes '""' for an empty frame)
+            rows.close()
+            continue
+        if header is None:
+            header = h
+        elif h != header:
+            raise ValueError(f"❌ Column mismatch while combining into {output_csv}: {h} != {header}")
+        iters.append(rows)
+
+    if header is None:
+        # Every chunk was empty: the in-memory run writes the same empty table
+        if paths and os.path.isfile(paths[0]):
+            shutil.copyfile(paths[0], output_csv)
+        return 0
+
+    merged = heapq.merge(*iters, key=key_factory(header)) if key_factory else (r for it in iters for r in it)
+    count = 0
+    with open(output_csv, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        writer.writerow(header)
+        for row in merged:
+            writer.writerow(row)
+            count += 1
+    return count
+
+def filter_csv(path, output_csv, conversation_ids):
+    """
+    Copy the rows of a stage file whose conversation_id is in conversation_ids to
+    output_csv, re-serialised like combine_csvs. Returns the number of rows kept.
+    """
+    header, rows = _read_csv_rows(path)
+    if not header or header == [""]:
+        rows.close()
+        shutil.copyfile(path, output_csv)
+        return 0
+    i_conv = header.index("conversation_id")
+    count = 0
+    with open(output_csv, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        writer.writerow(header)
+        for row in rows:
+            if row[i_conv] in conversation_ids:
+                writer.writerow(row)
+                count += 1
+    return count
+
+def process_chunk(conversations, start_index, chunk_dir, token_cache_path=None,
+                  token_cache_max_mb=TOKEN_CACHE_MAX_MB, token_count_mode="exact", token_threads=None):
+    """
+    Run flatten → merge → fill → count tokens → emulate on one conversation-aligned chunk,
+    writing the stage files into chunk_dir.
+    Returns (flatten error logs, errored conversation ids, aggregate cube of the chunk).
+    """
+    os.makedirs(chunk_dir, exist_ok=True)
+    path = lambda name: os.path.join(chunk_dir, name)
+
+    # Flatten
+    rows, error_logs, errored = flatten_conversations(conversations, start_index)
+    rows_to_df(rows).to_csv(path("conversations_flat.csv"), index=False, encoding="utf-8-sig")
+    del rows
+    extract_flattened_data(conversations).to_csv(path("flattened_websearch_thoughts.csv"), index=False, encoding="utf-8-sig")
+    extract_image_records(conversations).to_csv(path("image_generations.csv"), index=False, encoding="utf-8-sig")
+
+    # Merge + fill
+    merge_all(
+        path("conversations_flat.csv"),
+        path("flattened_websearch_thoughts.csv"),
+        path("image_generations.csv"),
+        path("merged_conversations.csv"),
+        show_df=False
+    )
+    filled, message_part = fill_model_names(
+        path("merged_conversations.csv"),
+        conversations,
+        path("merged_conversations_filled.csv"),
+        usage_csv_path=path("model_usage_frequency.csv")
+    )
+    roles = filled[["message_id", "role"]]
+    del filled
+
+    # Tokens + per-conversation emulation
+    _count_and_emulate(chunk_dir, token_cache_path, token_cache_max_mb, token_count_mode, token_threads)
+    cube_part = combine_cubes([
+        message_part,
+        csv_token_cube(path("token_counts.csv"), path("token_costs_true_api_emulated.csv"), roles)
+    ])
+
+    return error_logs, errored, cube_part
+
+def _count_and_emulate(chunk_dir, token_cache_path, token_cache_max_mb, token_count_mode, token_threads):
+    """Count tokens of a chunk's filled table and emulate its API costs."""
+    path = lambda name: os.path.join(chunk_dir, name)
+    count_tokens(
+        path("merged_conversations_filled.csv"),
+        path("token_counts.csv"),
+        cache_path=token_cache_path,
+        cache_max_mb=token_cache_max_mb,
+        mode=token_count_mode,
+        num_threads=token_threads
+    )
+    emulate_api_chat_costs(
+        path("token_counts.csv"),
+        path("token_costs_true_api_emulated.csv"),
+        branches_csv=path("token_costs_branches.csv")
+    )
+
+def extract_chunk(conversation_ids, source_dir, chunk_dir, token_cache_path=None,
+                  token_cache_max_mb=TOKEN_CACHE_MAX_MB, token_count_mode="exact", token_threads=None):
+    """
+    Cut the rows of some conversations out of an earlier chunk's stage files into
+    chunk_dir, giving the files process_chunk would write for just those conversations
+    (every stage works per conversation). Only estimate-mode token counts are redone:
+    their sample and monthly estimate belong to the whole earlier chunk.
+    Returns the aggregate cube of the new chunk.
+    """
+    os.makedirs(chunk_dir, exist_ok=True)
+    path = lambda name: os.path.join(chunk_dir, name)
+    conversation_ids = set(conversation_ids)
+    names = STAGE_FILES if token_count_mode != "estimate" else STAGE_FILES[:STAGE_FILES.index("token_counts.csv")]
+    for name in names:
+        source = os.path.join(source_dir, name)
+        if os.path.isfile(source) and not filter_csv(source, path(name), conversation_ids) and name in EMPTY_SOURCES:
+            # No rows left: write the empty table the flatten step writes
+            EMPTY_SOURCES[name]().to_csv(path(name), index=False, encoding="utf-8-sig")
+
+    filled = read_table(path("merged_conversations_filled.csv"), usecols=MESSAGE_COLUMNS)
+    message_part = message_cube(filled)
+    roles = filled[["message_id", "role"]]
+    del filled
+    if token_count_mode == "estimate":
+        _count_and_emulate(chunk_dir, token_cache_path, token_cache_max_mb, token_count_mode, token_threads)
+    return combine_cubes([
+        message_part,
+        csv_token_cube(path("token_counts.csv"), path("token_costs_true_api_emulated.csv"), roles)
+    ])
+
+def run_streaming_pipeline(json_path, data_dir, memory_limit_mb=DEFAULT_MEMORY_MB,
+                           token_cache_path=None, token_cache_max_mb=TOKEN_CACHE_MAX_MB,
+                           token_count_mode="exact", index=None, max_conversations=None, token_threads=None):
+    """
+    Bounded-memory version of the survey → flatten → merge → fill → tokens → emulation
+    steps of main.py. Conversations are streamed from json_path and processed in
+    conversation-aligned chunks; the per-chunk stage files are then combined into
+    data_dir so that every CSV is byte-identical to an in-memory run. The aggregate cube
+    is combined from per-chunk cubes; its costs sum in whole cost units, so neither the
+    cube nor the monthly tables depend on where the chunks were cut (see aggregate_cube.py).
+
+    With an IncrementalIndex, chunks are kept as the index's segments and conversations
+    unchanged since a previous run are reused instead of processed: whole segments as
+    they are, the rest cut out of their segments (see incremental_index.py).
+
+    Args:
+        json_path (str): Path to conversations.json.
+        data_dir (str): Output directory (DATA_DIR).
+        memory_limit_mb (int): Memory ceiling used to size the chunks.
+        token_cache_path (str): Optional persistent token-count cache (see token_cache.py).
+        token_cache_max_mb (int): Size cap of that cache.
+        token_count_mode (str): "exact" or "estimate" (see count_tokens).
+        index (IncrementalIndex): Optional per-user index of a previous run.
+        max_conversations (int): Optional cap on the conversations per chunk (smaller
+            segments make the index more selective).
+        token_threads (int): Tokenizer threads (default: available cores).
+
+    Returns:
+        pd.DataFrame: Aggregate cube of the whole export (also written to CUBE_CSV),
+        or None if there were no conversations.
+    """
+    work_dir = os.path.join(data_dir, "_stream")
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    survey = None
+    error_logs, errored = [], set()
+    cube_parts, chunk_dirs = [], []
+    n_conversations, n_reused = 0, 0
+    if index is None:
+        chunks = ((start, conversations, None, None)
+                  for start, conversations in iter_conversation_chunks(json_path, memory_limit_mb))
+    else:
+        chunks = iter_incremental_chunks(json_path, index, memory_limit_mb, max_conversations)
+
+    try:
+        for i, (start, conversations, keys, reused) in enumerate(chunks):
+            survey = survey_conversation_keys(conversations, print_progress=False, survey=survey)
+
+            if reused is not None and index.covers(reused, keys):
+                # Unchanged since the previous run: the segment's stage files are used as they are
+                print(f"♻️ Chunk {i + 1}: conversations {start + 1}–{start + len(conversations)} unchanged ({reused})")
+                chunk_dir = index.segment_dir(reused)
+                chunk_errors, chunk_errored = index.reuse(reused)
+                cube_part = read_cube(os.path.join(chunk_dir, CUBE_CSV))
+                n_reused += len(conversations)
+            elif reused is not None:
+                # Unchanged, but the rest of their segment isn't: their rows become a segment of their own
+                print(f"♻️ Chunk {i + 1}: conversations {start + 1}–{start + len(conversations)} unchanged "
+                      f"(cut out of {reused})")
+                segment = index.new_segment()
+                chunk_dir = index.segment_dir(segment)
+                conversation_ids = [k[0] for k in keys]
+                chunk_errors, chunk_errored = index.errors_of(reused, conversation_ids)
+                cube_part = extract_chunk(
+                    conversation_ids, index.segment_dir(reused), chunk_dir, token_cache_path, token_cache_max_mb,
+                    token_count_mode, token_threads
+                )
+                write_cube(cube_part, os.path.join(chunk_dir, CUBE_CSV))
+                index.add(segment, keys, chunk_errors, chunk_errored)
+                n_reused += len(conversations)
+            else:
+                print(f"🧩 Chunk {i + 1}: conversations {start + 1}–{start + len(conversations)}")
+                segment = index.new_segment() if index is not None else None
+                chunk_dir = index.segment_dir(segment) if index is not None else os.path.join(work_dir, f"chunk_{i:05d}")
+                chunk_errors, chunk_errored, cube_part = process_chunk(
+                    conversations, start, chunk_dir, token_cache_path, token_cache_max_mb, token_count_mode,
+                    token_threads
+                )
+                if index is not None:
+                    write_cube(cube_part, os.path.join(chunk_dir, CUBE_CSV))
+                    index.add(segment, keys, chunk_errors, chunk_errored)
+            error_logs += chunk_errors
+            errored |= chunk_errored
+            cube_parts.append(cube_part)
+            chunk_dirs.append(chunk_dir)
+            n_conversations += len(conversations)
+            del conversations
+
+        if survey is not None:
+            print_survey(survey)
+        write_error_log(os.path.join(data_dir, "flat_error.txt"), error_logs, errored)
+        print(f"✅ Streamed {n_conversations} conversations in {len(chunk_dirs)} chunks"
+              + (f" ({n_reused} unchanged, reused from the incremental index)" if index is not None else ""))
+
+        # --- Combine per-chunk stage files ---
+        for name in STAGE_FILES:
+            key_factory = MERGE_KEYS[name]
+            n = combine_csvs(
+                [os.path.join(d, name) for d in chunk_dirs],
+                os.path.join(data_dir, name),
+                key_factory
+            )
+            print(f"✅ Combined {n} rows into {name}")
+
+        if token_count_mode == "estimate":
+            # Chunks are sampled independently: estimates and variances add up per month
+            parts = [pd.read_csv(p, dtype={"month": str}) for p in
+                     (os.path.join(d, COST_ESTIMATE_CSV) for d in chunk_dirs) if os.path.isfile(p)]
+            if parts:
+                combine_cost_estimates(parts).to_csv(
+                    os.path.join(data_dir, COST_ESTIMATE_CSV), index=False, encoding="utf-8-sig"
+                )
+
+        cube = None
+        if cube_parts:
+            cube = combine_cubes(cube_parts)
+            write_cube(cube, os.path.join(data_dir, CUBE_CSV))
+            write_model_usage(model_usage(cube), os.path.join(data_dir, "model_usage_frequency.csv"))
+
+        token_csv = os.path.join(data_dir, "token_counts.csv")
+        if os.path.isfile(token_csv):
+            tokens = read_table(token_csv, categorical=False, usecols=[
+                "conversation_id", "conversation_create_time", "input_tokens", "output_tokens", "model"
+            ])
+            tokens["input_tokens"] = tokens["input_tokens"].astype(int)
+            tokens["output_tokens"] = tokens["output_tokens"].astype(int)
+            write_token_arrays(tokens, token_csv)
+            del tokens
+
+        if index is not None:
+            index.save()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return cube
@@ -1,16 +1,18 @@
 from collections import defaultdict
 import pprint
 
-def survey_conversation_keys(conversations, print_progress=True):
+def survey_conversation_keys(conversations, print_progress=True, survey=None):
     """
     Survey the structure of your conversations.json file.
+    Pass a previous result as survey to keep accumulating into it (chunked runs).
     Returns: survey (dict with conversation/mapping_node/message keys)
     """
-    survey = {
-        "conversation": defaultdict(set),
-        "mapping_node": defaultdict(set),
-        "message": defaultdict(set),
-    }
+    if survey is None:
+        survey = {
+            "conversation": defaultdict(set),
+            "mapping_node": defaultdict(set),
+            "message": defaultdict(set),
+        }
 
     if print_progress:
         print("🔎 Surveying schema of conversations...")
@@ -40,16 +42,19 @@ def survey_conversation_keys(conversations, print_progress=True):
                     survey["message"][k].add(type(v).__name__)
 
     if print_progress:
-        print("\n✅ Finished schema survey.\n")
+        print_survey(survey)
 
-        # Display key findings
-        print("🔑 Conversation-level keys + types:")
-        pprint.pprint(dict(survey["conversation"]))
+    return survey
 
-        print("\n🔧 Mapping-node-level keys + types:")
-        pprint.pprint(dict(survey["mapping_node"]))
+def print_survey(survey):
+    """Display the key findings of a survey."""
+    print("\n✅ Finished schema survey.\n")
 
-        print("\n🗨️ Message-level keys + types:")
-        pprint.pprint(dict(survey["message"]))
+    print("🔑 Conversation-level keys + types:")
+    pprint.pprint(dict(survey["conversation"]))
 
-    return survey
+    print("\n🔧 Mapping-node-level keys + types:")
+    pprint.pprint(dict(survey["mapping_node"]))
+
+    print("\n🗨️ Message-level keys + types:")
+    pprint.pprint(dict(survey["message"]))
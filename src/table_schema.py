@@ -0,0 +1,72 @@
+import pandas as pd
+from collections import defaultdict
+
+# --- Arrow-backed strings when pyarrow is available, plain pandas strings otherwise ---
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = "string[pyarrow]"
+except ImportError:
+    STRING_DTYPE = "string"
+
+# --- Low-cardinality columns of the flattened/merged tables → categoricals ---
+# (per-conversation columns repeat on every message row, so they compress the same way)
+CATEGORICAL_COLUMNS = (
+    "role", "type", "model", "status", "recipient", "end_turn", "weight",
+    "conversation_id", "conversation_title", "conversation_create_time",
+)
+
+def table_dtypes(categorical=True):
+    """
+    Return a read_csv dtype mapping for the conversation tables:
+    categoricals for CATEGORICAL_COLUMNS, STRING_DTYPE for everything else
+    (message ids, message timestamps, content, summaries).
+    """
+    dtypes = defaultdict(lambda: STRING_DTYPE)
+    if categorical:
+        for col in CATEGORICAL_COLUMNS:
+            dtypes[col] = "category"
+    return dtypes
+
+def read_table(path, usecols=None, categorical=True, **kwargs):
+    """
+    Drop-in replacement for pd.read_csv(path, dtype=str) using the shared schema.
+
+    Args:
+        path (str): CSV to load.
+        usecols (list): Optional subset of columns to load.
+        categorical (bool): If False, load every column as STRING_DTYPE
+            (for stages that do per-value string work on all columns).
+
+    Returns:
+        pd.DataFrame
+    """
+    return pd.read_csv(path, dtype=table_dtypes(categorical), usecols=usecols, **kwargs)
+
+def fillna_category(series, value):
+    """fillna() that also works on categoricals whose categories don't contain value yet."""
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    return series.fillna(value)
+
+def memory_mb(df):
+    """Deep memory usage of a DataFrame in MB."""
+    return df.memory_usage(deep=True).sum() / 1e6
+
+def object_baseline_mb(df):
+    """
+    Deep memory usage in MB of df as plain object strings (the old dtype=str tables).
+    Converts one column at a time, so only a single column's copy is alive.
+    """
+    return sum(df[col].astype(object).memory_usage(deep=True, index=False) for col in df.columns) / 1e6
+
+def report_memory(df, stage, baseline_mb=None):
+    """
+    Print the resident size of a stage's table, optionally against the same
+    table as plain object strings (see object_baseline_mb).
+    """
+    mb = memory_mb(df)
+    msg = f"🧮 [{stage}] {len(df)} rows × {df.shape[1]} cols: {mb:.1f} MB"
+    if baseline_mb is not None and mb > 0:
+        msg += f" (object strings: {baseline_mb:.1f} MB, {baseline_mb / mb:.1f}× smaller)"
+    print(msg)
+    return mb
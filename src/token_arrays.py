@@ -0,0 +1,107 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# --- On-disk layout of the token_counts sidecar (one record per token_counts.csv row) ---
+TOKEN_ARRAY_DTYPE = np.dtype([
+    ("input_tokens",  "<i4"),
+    ("output_tokens", "<i4"),
+    ("conversation",  "<i4"),   # index into keys["conversations"], -1 if missing
+    ("model",         "<i2"),   # index into keys["models"], -1 if missing
+    ("month",         "<i4"),   # YYYYMM of conversation_create_time, 0 if unparseable
+])
+
+def token_array_paths(output_csv):
+    """
+    Return (npy_path, keys_path) for the binary sidecar of a token counts CSV,
+    e.g. data/token_counts.csv -> data/token_counts.npy, data/token_counts_keys.json
+    """
+    stem = os.path.splitext(str(output_csv))[0]
+    return stem + ".npy", stem + "_keys.json"
+
+def _encode_keys(series):
+    """Factorize a string column into (codes, uniques), treating ''/NaN as missing (-1)."""
+    values = series.where(series.notna() & (series.astype(str) != ""), None)
+    codes, uniques = pd.factorize(values)
+    return codes, [str(u) for u in uniques]
+
+def write_token_arrays(df, output_csv):
+    """
+    Write the numeric part of a token counts table as a structured .npy array plus
+    a small JSON file holding the conversation/model key lists.
+
+    Args:
+        df (pd.DataFrame): Token counts table as produced by count_tokens.
+        output_csv (str): Path of the token counts CSV the sidecar belongs to.
+
+    Returns:
+        str: Path of the written .npy file.
+    """
+    npy_path, keys_path = token_array_paths(output_csv)
+
+    conv_codes, conversations = _encode_keys(df["conversation_id"])
+    model_codes, models = _encode_keys(df["model"])
+    if len(models) > np.iinfo(np.int16).max:
+        raise ValueError(f"Too many distinct models for int16 codes: {len(models)}")
+
+    dates = pd.to_datetime(
+        df["conversation_create_time"].astype(str).str[:8],
+        format="%Y%m%d",
+        errors="coerce"
+    )
+    month = (dates.dt.year * 100 + dates.dt.month).fillna(0)
+
+    arr = np.empty(len(df), dtype=TOKEN_ARRAY_DTYPE)
+    arr["input_tokens"] = df["input_tokens"].to_numpy()
+    arr["output_tokens"] = df["output_tokens"].to_numpy()
+    arr["conversation"] = conv_codes
+    arr["model"] = model_codes
+    arr["month"] = month.to_numpy()
+
+    np.save(npy_path, arr)
+    with open(keys_path, "w", encoding="utf-8") as f:
+        json.dump({"conversations": conversations, "models": models}, f)
+    return npy_path
+
+def load_token_arrays(output_csv, mmap_mode="r"):
+    """
+    Load the sidecar written by write_token_arrays.
+    Returns (structured array, keys dict), or (None, None) if no sidecar exists.
+    """
+    npy_path, keys_path = token_array_paths(output_csv)
+    if not (os.path.isfile(npy_path) and os.path.isfile(keys_path)):
+        return None, None
+    arr = np.load(npy_path, mmap_mode=mmap_mode)
+    with open(keys_path, encoding="utf-8") as f:
+        keys = json.load(f)
+    return arr, keys
+
+def month_labels(month_codes):
+    """Map YYYYMM integer codes to 'YYYY-MM' strings (NaN where the code is 0)."""
+    codes = np.asarray(month_codes)
+    labels = pd.Series(
+        [f"{m // 100:04d}-{m % 100:02d}" for m in codes.tolist()],
+        dtype=object
+    )
+    labels[codes == 0] = np.nan
+    return labels
+
+def load_token_frame(output_csv):
+    """
+    Build a lightweight DataFrame (conversation_id codes, model, input/output tokens, month)
+    from the sidecar of output_csv. Returns None if the sidecar is missing.
+    """
+    arr, keys = load_token_arrays(output_csv)
+    if arr is None:
+        return None
+
+    models = np.array(keys["models"] + [np.nan], dtype=object)  # code -1 → NaN
+    conv = np.asarray(arr["conversation"])
+    return pd.DataFrame({
+        "conversation_id": pd.Series(conv, dtype="Int32").mask(conv < 0),
+        "model": models[np.asarray(arr["model"])],
+        "input_tokens": np.asarray(arr["input_tokens"], dtype=np.int64),
+        "output_tokens": np.asarray(arr["output_tokens"], dtype=np.int64),
+        "month": month_labels(arr["month"]).to_numpy(),
+    })
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+DEFAULT_MAX_MB = 256
+LOOKUP_BATCH = 900          # stay under SQLite's bound-parameter limit
+EVICT_TARGET = 0.9          # after eviction, shrink to this fraction of max_mb
+
+class TokenCountCache:
+    """
+    Persistent (encoding_name, content hash) → token count store in SQLite.
+
+    Lives outside DATA_DIR so it survives the end-of-run wipe; every monthly
+    re-export then only tokenizes messages that weren't seen before.
+    Least-recently-used rows are evicted once the file grows past max_mb.
+    """
+
+    def __init__(self, path, max_mb=DEFAULT_MAX_MB):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_counts ("
+            " encoding TEXT NOT NULL,"
+            " digest BLOB NOT NULL,"
+            " n_tokens INTEGER NOT NULL,"
+            " last_used INTEGER NOT NULL,"
+            " PRIMARY KEY (encoding, digest)"
+            ") WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_token_counts_last_used ON token_counts(last_used)")
+        self.conn.commit()
+
+    @staticmethod
+    def digest(text):
+        """128-bit content hash used as the cache key."""
+        return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    def get_many(self, encoding_name, digests):
+        """
+        Look up many digests in batched IN queries.
+        Returns {digest: n_tokens} for the hits and refreshes their last_used stamp.
+        """
+        found = {}
+        unique = list(dict.fromkeys(digests))
+        for i in range(0, len(unique), LOOKUP_BATCH):
+            batch = unique[i:i + LOOKUP_BATCH]
+            marks = ",".join("?" * len(batch))
+            found.update(self.conn.execute(
+                f"SELECT digest, n_tokens FROM token_counts WHERE encoding = ? AND digest IN ({marks})",
+                [encoding_name, *batch]
+            ))
+        if found:
+            now = int(time.time())
+            self.conn.executemany(
+                "UPDATE token_counts SET last_used = ? WHERE encoding = ? AND digest = ?",
+                ((now, encoding_name, d) for d in found)
+            )
+            self.conn.commit()
+        self.hits += sum(1 for d in digests if d in found)
+        self.misses += sum(1 for d in digests if d not in found)
+        return found
+
+    def put_many(self, encoding_name, items):
+        """Store (digest, n_tokens) pairs, then evict if the file is over budget."""
+        now = int(time.time())
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO token_counts (encoding, digest, n_tokens, last_used) VALUES (?, ?, ?, ?)",
+            ((encoding_name, d, int(n), now) for d, n in items)
+        )
+        self.conn.commit()
+        self.evict()
+
+    def size_bytes(self):
+        """Bytes of live pages in the database file."""
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def evict(self):
+        """Drop least-recently-used rows until the cache is below EVICT_TARGET × max_mb."""
+        dropped = 0
+        size = self.size_bytes()
+        while size > self.max_bytes:
+            rows = self.conn.execute("SELECT COUNT(*) FROM token_counts").fetchone()[0]
+            if not rows:
+                break
+            # Pages stay partly filled after a delete, so repeat until the estimate holds
+            n_drop = max(1, int(rows * (1 - EVICT_TARGET * self.max_bytes / size)))
+            self.conn.execute(
+                "DELETE FROM token_counts WHERE (encoding, digest) IN ("
+                " SELECT encoding, digest FROM token_counts ORDER BY last_used LIMIT ?)",
+                (n_drop,)
+            )
+            self.conn.commit()
+            dropped += n_drop
+            size = self.size_bytes()
+        return dropped
+
+    def stats_message(self):
+        """One-line hit/miss summary for logs.txt."""
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return (f"🗃️ Token cache: {self.hits} hits, {self.misses} misses "
+                f"({rate:.1%} hit rate), {self.size_bytes() / 1e6:.1f} MB at {self.path}")
+
+    def close(self):
+        self.conn.close()
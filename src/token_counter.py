@@ -1,29 +1,252 @@
 import pandas as pd
-import tiktoken
+import numpy as np
 import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from token_arrays import write_token_arrays
+from table_schema import read_table, report_memory
+from token_cache import TokenCountCache, DEFAULT_MAX_MB
+from pricing import load_price_table, create_time_dates
+
+# Rows with these (or empty) model names are not billable and get 0 tokens
+UNBILLED_MODELS = ("auto", "research", "unknown")
+MIN_BATCH_SIZE = 64
+
+# --- Model → tokenizer registry (export model codes use '-' where the API uses '.') ---
+DEFAULT_ENCODING = "cl100k_base"
+MODEL_ENCODINGS = {
+    "gpt-4o": "o200k_base", "gpt-4o-mini": "o200k_base", "gpt-4o-canmore": "o200k_base",
+    "gpt-4-1": "o200k_base", "gpt-4-1-mini": "o200k_base", "gpt-4-1-nano": "o200k_base",
+    "gpt-4-5": "o200k_base",
+    "o1": "o200k_base", "o1-preview": "o200k_base", "o1-mini": "o200k_base",
+    "o3": "o200k_base", "o3-mini": "o200k_base", "o3-mini-high": "o200k_base", "o3-pro": "o200k_base",
+    "o4-mini": "o200k_base", "o4-mini-high": "o200k_base",
+}
+# Unlisted variants of the same families (e.g. 'gpt-4o-2024-08-06', 'gpt-4.1-mini')
+ENCODING_PREFIXES = (
+    ("gpt-4o", "o200k_base"), ("gpt-4-1", "o200k_base"), ("gpt-4.1", "o200k_base"),
+    ("gpt-4-5", "o200k_base"), ("gpt-4.5", "o200k_base"),
+    ("o1", "o200k_base"), ("o3", "o200k_base"), ("o4", "o200k_base"),
+)
+
+def encoding_for_model(model):
+    """tiktoken encoding name for a normalized model code; DEFAULT_ENCODING if unknown."""
+    if model in MODEL_ENCODINGS:
+        return MODEL_ENCODINGS[model]
+    for prefix, encoding_name in ENCODING_PREFIXES:
+        if model == prefix or model.startswith(prefix + "-"):
+            return encoding_name
+    return DEFAULT_ENCODING
+
+# --- Estimate mode: exact counts on a stratified sample, bytes-per-token ratio for the rest ---
+TOKEN_COUNT_MODES = ("exact", "estimate")
+SAMPLE_PER_STRATUM = 200
+CONFIDENCE_Z = 1.96         # 95% bounds on the monthly cost totals
+COST_ESTIMATE_CSV = "monthly_cost_estimate.csv"
+
+def available_cores():
+    """CPU cores this process may run on (respects container CPU affinity)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _count_batch(enc, texts):
+    """Token counts for a batch of texts; each token list is dropped right after len()."""
+    return [len(enc.encode(t)) for t in texts]
+
+def token_lengths(enc, texts, num_threads=None, count_only=True):
+    """
+    Token counts for a list of texts, encoded in batches on a thread pool
+    (tiktoken releases the GIL while encoding).
+
+    Args:
+        enc (tiktoken.Encoding): Tokenizer.
+        texts (list[str]): Texts to count.
+        num_threads (int): Pool size (default: available cores).
+        count_only (bool): If True, workers return counts only and never hold a
+            batch of token lists; if False, use enc.encode_batch.
+
+    Returns:
+        np.ndarray: int64 token count per text.
+    """
+    if not texts:
+        return np.zeros(0, dtype=np.int64)
+    num_threads = num_threads or available_cores()
+
+    if not count_only:
+        return np.fromiter(
+            (len(toks) for toks in enc.encode_batch(texts, num_threads=num_threads)),
+            dtype=np.int64, count=len(texts)
+        )
+
+    batch_size = max(MIN_BATCH_SIZE, -(-len(texts) // (num_threads * 4)))
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    if num_threads == 1 or len(batches) == 1:
+        counts = [_count_batch(enc, b) for b in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=num_threads) as pool:
+            counts = list(pool.map(lambda b: _count_batch(enc, b), batches))
+    return np.fromiter((n for c in counts for n in c), dtype=np.int64, count=len(texts))
+
+def cached_token_lengths(enc, texts, cache, num_threads=None, count_only=True):
+    """
+    token_lengths() behind a TokenCountCache: one batched lookup for all texts,
+    tokenize only the misses, then store their counts.
+    """
+    digests = [cache.digest(t) for t in texts]
+    found = cache.get_many(enc.name, digests)
+    counts = np.fromiter((found.get(d, -1) for d in digests), dtype=np.int64, count=len(texts))
+
+    miss = np.flatnonzero(counts < 0)
+    if len(miss):
+        fresh = token_lengths(enc, [texts[i] for i in miss], num_threads, count_only)
+        counts[miss] = fresh
+        cache.put_many(enc.name, zip((digests[i] for i in miss), fresh.tolist()))
+    return counts
+
+def language_buckets(content):
+    """
+    UTF-8 byte length and a language-ish bucket per text, from its bytes-per-character
+    ratio: 'ascii' (1), 'cjk' (≥ 2.5, mostly 3-byte characters), 'other' otherwise.
+    Returns (np.ndarray of byte lengths, np.ndarray of bucket names).
+    """
+    chars = content.str.len().to_numpy(dtype=np.int64)
+    nbytes = content.str.encode("utf-8", "surrogatepass").str.len().to_numpy(dtype=np.int64)
+    bucket = np.where(nbytes == chars, "ascii", np.where(nbytes >= 2.5 * chars, "cjk", "other"))
+    return nbytes, bucket
+
+def estimate_token_lengths(texts, nbytes, strata, encodings, cache=None,
+                           sample_size=SAMPLE_PER_STRATUM, seed=0, num_threads=None, count_only=True):
+    """
+    Estimate token counts from byte lengths, one tokens-per-byte ratio per stratum.
+
+    Up to sample_size texts of every stratum are tokenized exactly (and keep their exact
+    count); the ratio Σtokens / Σbytes of that sample prices the rest of the stratum.
+
+    Args:
+        texts (np.ndarray[str]): Texts to count.
+        nbytes (np.ndarray): UTF-8 byte length of each text.
+        strata (np.ndarray): Stratum code (0..k-1) of each text.
+        encodings (list[str]): tiktoken encoding name of each stratum.
+        cache (TokenCountCache): Optional cache for the sampled texts.
+
+    Returns:
+        (np.ndarray counts, np.ndarray exact mask, pd.DataFrame per-stratum fit with
+         columns ratio, ratio_var, resid_var for estimate_monthly_costs).
+    """
+    import tiktoken
+
+    rng = np.random.default_rng(seed)
+    counts = np.zeros(len(texts), dtype=np.int64)
+    exact = np.zeros(len(texts), dtype=bool)
+    fit = pd.DataFrame(0.0, index=range(len(encodings)), columns=["ratio", "ratio_var", "resid_var"])
+
+    order = np.argsort(strata, kind="stable")
+    bounds = np.searchsorted(strata[order], np.arange(len(encodings) + 1))
+    for k, name in enumerate(encodings):
+        members = order[bounds[k]:bounds[k + 1]]
+        sample = np.sort(rng.choice(members, min(sample_size, len(members)), replace=False))
+        enc = tiktoken.get_encoding(name)
+        sample_texts = list(texts[sample])
+        if cache is not None:
+            counts[sample] = cached_token_lengths(enc, sample_texts, cache, num_threads, count_only)
+        else:
+            counts[sample] = token_lengths(enc, sample_texts, num_threads, count_only)
+        exact[sample] = True
+
+        t, b = counts[sample].astype(float), nbytes[sample].astype(float)
+        ratio = t.sum() / b.sum() if b.sum() else 0.0
+        n, N = len(sample), len(members)
+        resid_var = ((t - ratio * b) ** 2).sum() / (n - 1) if n > 1 else 0.0
+        # Variance of the ratio estimator, with finite-population correction
+        ratio_var = (1 - n / N) * resid_var / (n * b.mean() ** 2) if n > 1 and b.mean() else 0.0
+        fit.loc[k] = (ratio, ratio_var, resid_var)
+
+        rest = members[~exact[members]]
+        counts[rest] = np.rint(nbytes[rest] * ratio).astype(np.int64)
+    return counts, exact, fit
+
+def estimate_monthly_costs(months, prices, nbytes, strata, exact, n_tokens, fit):
+    """
+    Per-row-priced (naive) monthly cost totals of an estimate-mode run with
+    CONFIDENCE_Z bounds. The error of month m is Σ_s W_sm (r̂_s − r_s) from the fitted
+    ratios plus the per-row residuals of the estimated rows, where
+    W_sm = Σ price × bytes over the estimated rows of stratum s in month m.
+
+    Returns:
+        pd.DataFrame: month, estimated_cost, cost_variance, cost_lower, cost_upper.
+    """
+    prices = np.nan_to_num(prices) / 1e6
+    est = ~exact
+    frame = pd.DataFrame({
+        "month": months,
+        "stratum": strata,
+        "estimated_cost": n_tokens * prices,
+        "weighted_bytes": np.where(est, nbytes * prices, 0.0),
+        "resid": np.where(est, prices ** 2 * fit["resid_var"].to_numpy()[strata], 0.0),
+    })
+    by_stratum = frame.groupby(["month", "stratum"])[["weighted_bytes"]].sum().reset_index()
+    by_stratum["ratio_term"] = by_stratum["weighted_bytes"] ** 2 * fit["ratio_var"].to_numpy()[by_stratum["stratum"]]
+
+    monthly = frame.groupby("month")[["estimated_cost", "resid"]].sum()
+    monthly["cost_variance"] = monthly.pop("resid") + by_stratum.groupby("month")["ratio_term"].sum()
+    return add_cost_bounds(monthly.reset_index())
+
+def add_cost_bounds(monthly):
+    """(Re)compute cost_lower / cost_upper from estimated_cost and cost_variance."""
+    sd = np.sqrt(monthly["cost_variance"])
+    monthly["cost_lower"] = (monthly["estimated_cost"] - CONFIDENCE_Z * sd).clip(lower=0)
+    monthly["cost_upper"] = monthly["estimated_cost"] + CONFIDENCE_Z * sd
+    return monthly
+
+def combine_cost_estimates(parts):
+    """Combine monthly_cost_estimate tables of independently sampled row sets (e.g. stream chunks)."""
+    monthly = pd.concat(parts).groupby("month")[["estimated_cost", "cost_variance"]].sum().reset_index()
+    return add_cost_bounds(monthly)
 
 def count_tokens(
     input_csv,
     output_csv,
     debug=False,
-    encoding_name="cl100k_base",
-    preview_rows=5
+    encoding_name=None,
+    preview_rows=5,
+    num_threads=None,
+    count_only=True,
+    cache_path=None,
+    cache_max_mb=DEFAULT_MAX_MB,
+    mode="exact",
+    sample_size=SAMPLE_PER_STRATUM
 ):
     """
     Counts input and output tokens for each message in a filled conversations CSV
-    and writes the result as a new CSV.
+    and writes the result as a new CSV, plus a compact .npy sidecar of the numeric
+    columns (see token_arrays.py).
 
     Args:
         input_csv (str): Path to the filled CSV.
         output_csv (str): Path for the output CSV.
         debug (bool): If True, print debug info.
-        encoding_name (str): tiktoken encoding name (default: cl100k_base).
+        encoding_name (str): Force one tiktoken encoding for every model
+            (default: per-model encoding from MODEL_ENCODINGS).
         preview_rows (int): Number of rows to print debug info for.
+        num_threads (int): Tokenizer threads (default: available cores).
+        count_only (bool): Count without materialising token lists (see token_lengths).
+        cache_path (str): SQLite token-count cache to reuse across runs (None: no cache).
+        cache_max_mb (int): Size cap of the cache before LRU eviction.
+        mode (str): "exact" tokenizes every distinct content; "estimate" tokenizes a
+            stratified sample per encoding × model × language bucket and estimates the
+            rest from UTF-8 byte lengths, then writes COST_ESTIMATE_CSV with confidence
+            bounds on the monthly (per-row priced) cost totals next to output_csv.
+        sample_size (int): Sampled texts per stratum in estimate mode.
 
     Returns:
         pd.DataFrame: The resulting token counts table.
     """
 
+    if mode not in TOKEN_COUNT_MODES:
+        raise ValueError(f"Unknown token count mode {mode!r}, expected one of {TOKEN_COUNT_MODES}")
+
     # --- Ensure output directory exists ---
     out_dir = os.path.dirname(output_csv)
     if not os.path.isdir(out_dir):
@@ -31,54 +254,106 @@ def count_tokens(
             print(f"[Debug] Creating output directory: {out_dir}")
         os.makedirs(out_dir, exist_ok=True)
 
+    import tiktoken
+
     # --- Load the filled conversations table ---
-    df = pd.read_csv(input_csv, dtype=str)
-
-    # --- Prepare the tokenizer ---
-    enc = tiktoken.get_encoding(encoding_name)
-
-    # --- Iterate and count tokens ---
-    records = []
-    for idx, row in df.iterrows():
-        conv_id = row.get("conversation_id", "")
-        msg_id  = row.get("message_id", "")
-        conv_ct = row.get("conversation_create_time", "")
-        model   = (row.get("model") or "").strip().lower()
-        role    = row.get("role", "")
-        raw     = row.get("content", None)
-        content = "" if pd.isna(raw) else str(raw)
-
-        inp_toks, out_toks = 0, 0
-        if model and model not in ("auto", "research", "unknown"):
-            toks = enc.encode(content)
-            n = len(toks)
-            if role == "user":
-                inp_toks = n
-            else:
-                out_toks = n
-            if debug and idx < preview_rows:
-                print(f"[Debug] idx={idx} role={role!r} model={model!r} tokens={n}")
+    df = read_table(input_csv, usecols=[
+        "conversation_id", "message_id", "parent_id", "conversation_create_time", "model", "role", "content"
+    ])
+    report_memory(df, "count_tokens")
+
+    # --- Billable rows: a real model name ---
+    model = df["model"].astype(object).fillna("").astype(str).str.strip().str.lower()
+    billable = (model != "") & ~model.isin(UNBILLED_MODELS)
+    is_user = (df["role"] == "user").fillna(False).to_numpy(dtype=bool)
+
+    # --- Tokenizer per row: the override, or the registry entry of its model ---
+    if encoding_name:
+        row_encoding = pd.Series(encoding_name, index=df.index)
+    else:
+        row_encoding = model.map({m: encoding_for_model(m) for m in model[billable].unique()})
+
+    content = df["content"].astype(object).where(df["content"].notna(), "").astype(str)
+    n_tokens = np.zeros(len(df), dtype=np.int64)
+    cache = TokenCountCache(cache_path, cache_max_mb) if cache_path else None
+    try:
+        if mode == "estimate":
+            # --- Stratified sample per encoding × model × language bucket ---
+            nbytes, bucket = language_buckets(content)
+            rows = (billable & (content != "")).to_numpy()
+            keys = pd.DataFrame({"encoding": row_encoding[rows], "model": model[rows], "bucket": bucket[rows]})
+            strata = keys.groupby(list(keys.columns), sort=True).ngroup().to_numpy()
+            stratum_keys = keys.drop_duplicates().sort_values(list(keys.columns))
+            counts, exact, fit = estimate_token_lengths(
+                content[rows].to_numpy(), nbytes[rows], strata, list(stratum_keys["encoding"]),
+                cache, sample_size, num_threads=num_threads, count_only=count_only
+            )
+            n_tokens[rows] = counts
+            print(f"📐 Estimated {int((~exact).sum())} of {int(rows.sum())} non-empty billable rows "
+                  f"from {len(stratum_keys)} strata ({int(exact.sum())} tokenized)")
+            if debug:
+                print(pd.concat([stratum_keys.reset_index(drop=True), fit], axis=1).to_string())
         else:
-            if debug and idx < preview_rows:
-                print(f"[Debug] idx={idx} role={role!r} model={model!r} → tokens=0")
-
-        records.append({
-            "conversation_id": conv_id,
-            "message_id": msg_id,
-            "conversation_create_time": conv_ct,
-            "input_tokens": inp_toks,
-            "output_tokens": out_toks,
-            "model": model
-        })
-
-    # --- Create DataFrame and attempt to save ---
-    out_df = pd.DataFrame(records)
+            # --- Encode each distinct (encoding, content) pair once, in threaded batches ---
+            for name in sorted(row_encoding[billable].unique()):
+                rows = (billable & (row_encoding == name)).to_numpy()
+                codes, uniques = pd.factorize(content[rows])
+                enc = tiktoken.get_encoding(name)
+                if cache is not None:
+                    lengths = cached_token_lengths(enc, list(uniques), cache, num_threads, count_only)
+                else:
+                    lengths = token_lengths(enc, list(uniques), num_threads, count_only)
+                n_tokens[rows] = lengths[codes]
+                print(f"🔤 {name}: encoded {len(uniques)} distinct contents for {int(rows.sum())} billable rows")
+        if cache is not None:
+            logging.info(cache.stats_message())
+    finally:
+        if cache is not None:
+            cache.close()
+    if debug:
+        for idx in range(min(preview_rows, len(df))):
+            print(f"[Debug] idx={idx} role={df['role'].iloc[idx]!r} model={model.iloc[idx]!r} "
+                  f"encoding={row_encoding.iloc[idx]!r} tokens={n_tokens[idx]}")
+
+    # --- Split into input (user) and output (everything else) tokens ---
+    out_df = pd.DataFrame({
+        "conversation_id": df["conversation_id"],
+        "message_id": df["message_id"],
+        "parent_id": df["parent_id"],
+        "conversation_create_time": df["conversation_create_time"],
+        "input_tokens": np.where(is_user, n_tokens, 0),
+        "output_tokens": np.where(is_user, 0, n_tokens),
+        "model": model
+    })
+
+    # --- Attempt to save ---
     try:
         out_df.to_csv(output_csv, index=False, encoding="utf-8-sig")
         print(f"✅ Wrote {len(out_df)} token records to {output_csv}")
     except Exception as e:
         print(f"❌ Failed to write CSV to {output_csv}: {e}")
 
+    # --- Estimate mode: monthly cost totals with confidence bounds ---
+    if mode == "estimate":
+        price_in, price_out = load_price_table().prices(model, create_time_dates(df["conversation_create_time"]))
+        prices = np.where(is_user, price_in, price_out)[rows]
+        months = pd.to_datetime(
+            df["conversation_create_time"].astype(object),
+            format="%Y%m%d_%H%M%S.%f",
+            errors="coerce"
+        ).dt.to_period("M").astype(str).to_numpy()[rows]
+        monthly = estimate_monthly_costs(months, prices, nbytes[rows], strata, exact, counts, fit)
+        estimate_csv = os.path.join(out_dir, COST_ESTIMATE_CSV)
+        monthly.to_csv(estimate_csv, index=False, encoding="utf-8-sig")
+        print(f"✅ Wrote monthly cost estimate (±{CONFIDENCE_Z}σ) to {estimate_csv}")
+
+    # --- Binary sidecar for the cost/plot stages (np.load(..., mmap_mode="r")) ---
+    try:
+        npy_path = write_token_arrays(out_df, output_csv)
+        print(f"✅ Wrote token arrays sidecar to {npy_path}")
+    except Exception as e:
+        print(f"❌ Failed to write token arrays sidecar for {output_csv}: {e}")
+
     return out_df
 
 # === CLI/Script usage ===
@@ -88,14 +363,27 @@ if __name__ == "__main__":
     parser.add_argument("--input_csv", type=str, required=True, help="Path to filled conversations CSV")
     parser.add_argument("--output_csv", type=str, required=True, help="Output path for token counts CSV")
     parser.add_argument("--debug", action="store_true")
-    parser.add_argument("--encoding", type=str, default="cl100k_base")
+    parser.add_argument("--encoding", type=str, default=None, help="Force one encoding for all models (default: per-model registry)")
     parser.add_argument("--preview_rows", type=int, default=5)
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--keep_token_lists", action="store_true", help="Use encode_batch instead of the count-only path")
+    parser.add_argument("--cache_path", type=str, default=None, help="SQLite token-count cache (e.g. cache/token_cache.sqlite)")
+    parser.add_argument("--cache_max_mb", type=int, default=DEFAULT_MAX_MB)
+    parser.add_argument("--mode", choices=TOKEN_COUNT_MODES, default="exact")
+    parser.add_argument("--sample_size", type=int, default=SAMPLE_PER_STRATUM, help="Sampled texts per stratum (estimate mode)")
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
     count_tokens(
         input_csv=args.input_csv,
         output_csv=args.output_csv,
         debug=args.debug,
         encoding_name=args.encoding,
-        preview_rows=args.preview_rows
+        preview_rows=args.preview_rows,
+        num_threads=args.num_threads,
+        count_only=not args.keep_token_lists,
+        cache_path=args.cache_path,
+        cache_max_mb=args.cache_max_mb,
+        mode=args.mode,
+        sample_size=args.sample_size
     )
@@ -0,0 +1,188 @@
+import atexit
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+import traceback
+
+# Pipeline modules imported once by the worker, so no job pays for them
+PIPELINE_MODULES = (
+    "import_export_zip", "survey_schema", "flatten_messages", "flatten_websearch",
+    "flatten_images", "merge_flattened", "fill_model_names", "analyze_model_usage",
+    "token_counter", "emulate_api_chat_costs", "aggregate_cube", "plot_monthly_summary",
+    "plot_render", "plot_token_costs_comparison", "what_if_scenarios", "send_email_report", "streaming_pipeline",
+    "incremental_index", "preview_report", "pipeline_dag", "stage_cache", "artifact_sink", "resource_budget",
+)
+RESTART_DELAY = 3
+MONITOR_INTERVAL = 5          # seconds between checks that the worker is alive
+
+def preload():
+    """
+    Pay the one-off start-up costs of a pipeline run: heavy imports, the matplotlib
+    font cache and every tiktoken encoding the model registry can ask for.
+    """
+    t0 = time.perf_counter()
+    import importlib
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import font_manager
+    font_manager.fontManager.findfont("DejaVu Sans")   # loads (or builds) the font cache
+
+    for name in PIPELINE_MODULES:
+        importlib.import_module(name)
+
+    import tiktoken
+    from token_counter import MODEL_ENCODINGS, DEFAULT_ENCODING
+    for encoding_name in sorted({DEFAULT_ENCODING, *MODEL_ENCODINGS.values()}):
+        try:
+            tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            # Offline without a cached BPE file: count_tokens will raise when it needs it
+            logging.warning(f"⚠️ Could not preload tiktoken encoding {encoding_name}: {e}")
+    logging.info(f"🔥 Warm worker ready in {time.perf_counter() - t0:.1f}s")
+
+def _serve(job_fn, jobs, events, initializer=None):
+    """
+    Worker loop: initializer(), preload once, then run job_fn(zip_path, **options) for
+    every queued job, reporting ("started", job_id) and ("finished", job_id) to the watcher.
+    """
+    if initializer is not None:
+        initializer()
+    preload()
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, zip_path, options = job
+        events.send(("started", job_id))            # a Pipe: sent before the job can crash
+        try:
+            job_fn(zip_path, **options)
+        except Exception as e:
+            logging.error(f"❌ Error during pipeline: {e}\n{traceback.format_exc()}")
+        finally:
+            events.send(("finished", job_id))
+
+class WarmWorker:
+    """
+    Long-lived child process that runs pipeline jobs sent by the watcher.
+
+    The worker is started once, preloads everything (see preload) and then serves
+    zip paths from a queue, so successive runs skip import and initialisation. It is
+    spawned rather than forked: the watcher runs threads (the query service, the
+    monitor below), and a process forked while they run can inherit a held lock.
+
+    A monitor thread restarts the worker when it dies (e.g. OOM-killed mid-run). The
+    watcher keeps every job it submitted until the worker reports it finished, so
+    the jobs queued behind the crash are sent again to the new worker, and the job
+    that was running is handed to on_crash(zip_path, options, exitcode) instead of being
+    retried blindly: it returns the options to run the job again with (e.g. in streaming
+    mode after an OOM kill), or None to drop it.
+    """
+
+    def __init__(self, job_fn, initializer=None, on_crash=None):
+        self.job_fn = job_fn
+        self.initializer = initializer          # run first in every (re)started worker
+        self.on_crash = on_crash
+        self.ctx = mp.get_context("spawn")
+        self.jobs = None
+        self.events = None
+        self.process = None
+        self.pending = {}                       # {job_id: (zip_path, options)} submitted, not finished
+        self.running = None                     # job_id the worker last reported started
+        self.next_id = 0
+        self.lock = threading.RLock()
+        self.monitor = None
+        self.stopping = False
+        atexit.register(self.terminate)
+
+    def start(self):
+        """Start a worker and send it every pending job, in submission order."""
+        with self.lock:
+            # Fresh queue and pipe: a worker killed inside get() would leave the old queue's lock held
+            self.jobs = self.ctx.Queue()
+            self.events, child_events = self.ctx.Pipe(duplex=False)
+            # Not daemonic: jobs start process pools of their own (plot rendering, emulation
+            # workers); terminated at exit instead
+            self.process = self.ctx.Process(
+                target=_serve, args=(self.job_fn, self.jobs, child_events, self.initializer), daemon=False
+            )
+            self.process.start()
+            child_events.close()
+            self.running = None
+            for job_id, (zip_path, options) in self.pending.items():
+                self.jobs.put((job_id, zip_path, options))
+            logging.info(f"🔥 Started warm worker (pid {self.process.pid})")
+            if self.monitor is None:
+                self.monitor = threading.Thread(target=self._monitor, name="warm-worker-monitor", daemon=True)
+                self.monitor.start()
+
+    def _drain(self):
+        """Apply the worker's started/finished reports to pending and running."""
+        try:
+            while self.events.poll():
+                event, job_id = self.events.recv()
+                if event == "started":
+                    self.running = job_id
+                else:
+                    self.pending.pop(job_id, None)
+                    if self.running == job_id:
+                        self.running = None
+        except (EOFError, OSError):
+            pass                                # worker gone; what was sent is applied
+
+    def _monitor(self):
+        while not self.stopping:
+            time.sleep(MONITOR_INTERVAL)
+            if not self.stopping:
+                self.ensure_alive()
+
+    def ensure_alive(self):
+        """
+        Restart the worker if it exited; returns False if a restart was needed. The job it
+        was running is dropped from the queue and passed to on_crash, which may resubmit it.
+        """
+        with self.lock:
+            if self.process is not None:
+                self._drain()
+            if self.process is not None and self.process.is_alive():
+                return True
+            crashed, exitcode = None, None
+            if self.process is not None:
+                self._drain()
+                exitcode = self.process.exitcode
+                if self.running is not None:
+                    crashed = self.pending.pop(self.running, None)
+                logging.error(f"❌ Warm worker exited with code {exitcode}"
+                              + (f" while running {os.path.basename(crashed[0])}" if crashed else "")
+                              + "; restarting")
+                time.sleep(RESTART_DELAY)
+            self.start()
+        if crashed is not None and self.on_crash is not None:
+            zip_path, options = crashed
+            try:
+                retry = self.on_crash(zip_path, options, exitcode)
+                if retry is not None:
+                    self.submit(zip_path, **retry)
+            except Exception as e:
+                logging.error(f"❌ Error while handling the crashed job {zip_path}: {e}")
+        return False
+
+    def submit(self, zip_path, **options):
+        """Queue job_fn(zip_path, **options) for the worker (runs after any job already queued)."""
+        with self.lock:
+            self.ensure_alive()
+            job_id, self.next_id = self.next_id, self.next_id + 1
+            self.pending[job_id] = (zip_path, options)
+            self.jobs.put((job_id, zip_path, options))
+
+    def terminate(self):
+        self.stopping = True
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+
+    def stop(self):
+        self.stopping = True
+        if self.process is not None and self.process.is_alive():
+            self.jobs.put(None)
+            self.process.join()
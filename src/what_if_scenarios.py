@@ -0,0 +1,180 @@
+"""
+What-if scenarios: what the history would have cost with other models or price schedules.
+
+A scenario substitutes one model for every message and/or prices the history with
+another schedule CSV (see pricing.read_price_schedule). All scenarios are computed in
+one pass: the conversation paths are built once (ContextPaths), the emulated prompt
+sizes depend only on the context windows, so they are computed once per distinct
+window vector and shared; pricing is a (rows × scenarios) matrix operation. Token counts are kept as counted (no re-tokenization for the
+substituted model).
+
+    python src/what_if_scenarios.py --models gpt-4o-mini gpt-4-1 o3
+    python src/what_if_scenarios.py --scenario "o3 (2025 rates)=o3@prices_2025.csv"
+"""
+import os
+import re
+from difflib import get_close_matches
+import numpy as np
+import pandas as pd
+from emulate_api_chat_costs import (
+    ContextPaths, MODEL_CONTEXT_WINDOW, DEFAULT_CONTEXT_WINDOW, BUFFER_TOKENS
+)
+from pricing import load_price_table, create_time_dates
+
+DATA_DIR = "data"
+TOKEN_COUNTS_CSV = os.path.join(DATA_DIR, "token_counts.csv")
+SCENARIOS_CSV = os.path.join(DATA_DIR, "what_if_monthly_costs.csv")
+PLOT_PREFIX = "plot_what_if_"
+MONTHLY_PLUS = 21.0
+
+# Always computed first: the history as it happened, default prices
+ACTUAL = {'name': 'actual', 'model': None, 'prices': None}
+
+def parse_scenario(spec):
+    """
+    Scenario dict from "NAME=MODEL[@PRICES_CSV]" (MODEL may be empty: keep the actual
+    models), or a bare model name. Raises ValueError if MODEL has no price (see check_scenario).
+    """
+    name, _, rest = spec.partition("=") if "=" in spec else (spec, "", spec)
+    model, _, prices = rest.partition("@")
+    return check_scenario({'name': name.strip(), 'model': model.strip() or None, 'prices': prices.strip() or None})
+
+def check_scenario(scenario):
+    """
+    Raise ValueError if the scenario's model is not in its price table: every row would be
+    priced NaN, which the monthly sums count as $0. Warn if it has no context window
+    (MODEL_CONTEXT_WINDOW), as it is then emulated with DEFAULT_CONTEXT_WINDOW.
+    """
+    model = scenario['model']
+    if model is None:
+        return scenario
+    known = load_price_table(scenario['prices']).models
+    if model not in known:
+        close = get_close_matches(model, known, n=3)
+        raise ValueError(f"❌ What-if scenario '{scenario['name']}': no price for model {model!r}"
+                         + (f" (did you mean {', '.join(map(repr, close))}?)" if close else "")
+                         + (f" in {scenario['prices']}" if scenario['prices'] else ""))
+    if model not in MODEL_CONTEXT_WINDOW:
+        print(f"⚠️ What-if scenario '{scenario['name']}': no context window for {model!r}, "
+              f"using {DEFAULT_CONTEXT_WINDOW} tokens")
+    return scenario
+
+def scenario_costs(df, scenarios, buffer_tokens=BUFFER_TOKENS, tree=None):
+    """
+    Emulated API input/output cost of every row under every scenario.
+
+    Returns:
+        (np.ndarray (rows × scenarios) input cost, np.ndarray (rows × scenarios) output cost)
+        NaN where a scenario has no price for the row's model; 0 outside conversations.
+    """
+    n = len(df)
+    dates = create_time_dates(df['conversation_create_time']) if 'conversation_create_time' in df.columns else None
+    actual_windows = df['model'].map(MODEL_CONTEXT_WINDOW).fillna(DEFAULT_CONTEXT_WINDOW).to_numpy(dtype=np.int64)
+
+    # --- Prompt sizes once per distinct context window vector ---
+    paths = ContextPaths(df, tree)
+    in_conversation = np.zeros(n, dtype=bool)
+    in_conversation[paths.order] = True
+    api_in_by_window = {}
+    columns = []
+    for s in scenarios:
+        key = MODEL_CONTEXT_WINDOW.get(s['model'], DEFAULT_CONTEXT_WINDOW) if s['model'] else None
+        if key not in api_in_by_window:
+            api_in_by_window[key] = paths.input_tokens(actual_windows if key is None else key, buffer_tokens)
+        columns.append(key)
+    api_in = np.column_stack([api_in_by_window[key] for key in columns])
+
+    # --- (rows × scenarios) price matrices ---
+    price_in = np.empty((n, len(scenarios)))
+    price_out = np.empty((n, len(scenarios)))
+    for j, s in enumerate(scenarios):
+        models = df['model'] if s['model'] is None else pd.Series(
+            pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), [s['model']])
+        )
+        price_in[:, j], price_out[:, j] = load_price_table(s['prices']).prices(models, dates)
+
+    output_tokens = df['output_tokens'].to_numpy(dtype=np.float64)[:, None]
+    in_conversation = in_conversation[:, None]
+    input_cost = np.where(in_conversation, (api_in / 1e6) * price_in, 0.0)
+    output_cost = np.where(in_conversation, (output_tokens / 1e6) * price_out, 0.0)
+    return input_cost, output_cost
+
+def monthly_scenario_table(df, scenarios, buffer_tokens=BUFFER_TOKENS, tree=None):
+    """Month × scenario API cost table (<name>_total_cost and <name>_gain_loss columns) with a TOTAL row."""
+    input_cost, output_cost = scenario_costs(df, scenarios, buffer_tokens, tree)
+    months = create_time_dates(df['conversation_create_time']).dt.strftime('%Y-%m').to_numpy()
+    totals = pd.DataFrame(input_cost + output_cost, columns=[s['name'] for s in scenarios])
+    monthly = totals.groupby(months).sum().sort_index()
+
+    table = pd.DataFrame({'month': monthly.index})
+    for s in scenarios:
+        table[f"{s['name']}_total_cost"] = monthly[s['name']].to_numpy()
+        table[f"{s['name']}_gain_loss"] = table[f"{s['name']}_total_cost"] - MONTHLY_PLUS
+    summary = {'month': 'TOTAL', **table.drop(columns='month').sum().to_dict()}
+    return pd.concat([table, pd.DataFrame([summary])], ignore_index=True)
+
+def plot_scenario(table, name, png_path):
+    """Monthly cost of one scenario vs the $21 Plus subscription (same layout as the comparison plots)."""
+    from matplotlib.figure import Figure
+    import matplotlib.ticker as mtick
+
+    rows = table[table['month'] != 'TOTAL']
+    costs, gains = rows[f"{name}_total_cost"], rows[f"{name}_gain_loss"]
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    ax.bar(rows['month'], costs, color=['#2ca02c' if g > 0 else '#d62728' for g in gains],
+           label=f'API Emulation ({name})')
+    ax.axhline(MONTHLY_PLUS, color='grey', linestyle='--', linewidth=2, label='$21 GPT Plus Subscription')
+    for i, (cost, gain) in enumerate(zip(costs, gains)):
+        sign = '+' if gain > 0 else ''
+        ax.text(i, cost + 0.5, f"{sign}{gain:.1f}", ha='center', va='bottom', fontsize=9)
+    ax.set_xlabel('Month')
+    ax.set_ylabel('Total Cost (USD)')
+    ax.set_title(f'Monthly Token Cost (What-if: {name}) vs $21 GPT Plus')
+    ax.legend()
+    ax.yaxis.set_major_formatter(mtick.StrMethodFormatter('${x:,.0f}'))
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+    fig.savefig(png_path, bbox_inches='tight')
+
+def main(
+    scenarios,
+    token_counts_csv=TOKEN_COUNTS_CSV,
+    output_csv=SCENARIOS_CSV,
+    plot_dir=None,
+    buffer_tokens=BUFFER_TOKENS
+):
+    """
+    Compute the actual history plus each scenario (dicts or "NAME=MODEL[@PRICES_CSV]" specs),
+    save the monthly comparison table and one plot per scenario (plot_what_if_<name>.png).
+    Returns the table.
+    """
+    scenarios = [ACTUAL] + [parse_scenario(s) if isinstance(s, str) else check_scenario(s) for s in scenarios]
+    df = pd.read_csv(token_counts_csv, dtype={
+        'input_tokens': int, 'output_tokens': int, 'model': str, 'conversation_create_time': str,
+        'conversation_id': str, 'message_id': str, 'parent_id': str
+    }).sort_values(['conversation_id', 'message_id'])
+
+    table = monthly_scenario_table(df, scenarios, buffer_tokens)
+    table.to_csv(output_csv, index=False, encoding='utf-8-sig')
+    print(f"✅ Saved what-if comparison of {len(scenarios)} scenarios to {output_csv}")
+    print(table[['month'] + [f"{s['name']}_total_cost" for s in scenarios]].tail(1).to_string(index=False))
+
+    plot_dir = plot_dir or os.path.dirname(str(output_csv))
+    for s in scenarios[1:]:
+        png_path = os.path.join(plot_dir, f"{PLOT_PREFIX}{re.sub(r'[^A-Za-z0-9._-]+', '_', s['name'])}.png")
+        plot_scenario(table, s['name'], png_path)
+        print(f"✅ Saved what-if plot to {png_path}")
+    return table
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Price the chat history under other models / price schedules.")
+    parser.add_argument("--token_counts_csv", type=str, default=TOKEN_COUNTS_CSV)
+    parser.add_argument("--output_csv", type=str, default=SCENARIOS_CSV)
+    parser.add_argument("--models", nargs="*", default=[], help="One substitution scenario per model")
+    parser.add_argument("--scenario", action="append", default=[], help='"NAME=MODEL[@PRICES_CSV]"')
+    parser.add_argument("--buffer_tokens", type=int, default=BUFFER_TOKENS)
+    args = parser.parse_args()
+
+    main(args.models + args.scenario, args.token_counts_csv, args.output_csv, buffer_tokens=args.buffer_tokens)